@@ -0,0 +1,348 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+# http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Run func tasks in a pool of worker processes, so that CPU-bound 
+python functions are not serialized by the GIL.
+
+Each worker process has a pipe to this process, and a thread in this
+process that waits for results on the pipe and calls the task's
+continuation.  Only one task is sent to a worker at a time.
+
+Large input values are cached in the worker processes which they were 
+sent to.  This process keeps track of what is cached in each worker, 
+so it can send a reference to the cached value instead of pickling
+the value again, and prefers to send a task to a worker that already
+holds its inputs.
+
+The function must be defined at the top level of a module so that
+the worker process can find it by name.  Worker processes are forked
+from this process when the pool is first used.
+
+@author: Tim Armstrong
+'''
+from __future__ import with_statement
+import threading
+import logging
+import time
+import sys
+import cPickle
+import weakref
+from collections import deque, OrderedDict
+
+import multiprocessing
+
+from PyDFlow.base.LocalExecutor import cpu_count
+from PyDFlow.base import history
+
+# Number of worker processes to start.  None means one per cpu
+NUM_PROCESSES = None
+
+# Inputs which pickle to at least this many bytes are cached in 
+# worker processes
+CACHE_MIN_BYTES = 64 * 1024
+# Maximum bytes of pickled data cached per worker process
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+structure_lock = threading.Lock()
+init = False
+workers = None
+pending = None  # jobs waiting for a free worker
+pool_size = None # number of workers to keep running
+
+# Keys for ivar data cached in workers
+ivar_keys = weakref.WeakKeyDictionary()
+next_key = 0
+
+def configure(processes=None):
+    """
+    Set the number of worker processes.  Must be called before any
+    tasks are run in worker processes.
+    """
+    global NUM_PROCESSES
+    if init:
+        raise Exception("Cannot change the number of worker processes " +
+                        "after they have started")
+    NUM_PROCESSES = processes
+
+def ensure_init():
+    global init, workers, pending, pool_size
+    with structure_lock:
+        if not init:
+            pool_size = NUM_PROCESSES
+            if pool_size is None:
+                pool_size = cpu_count()
+            logging.debug("Starting %d func worker processes" % pool_size)
+            pending = deque()
+            workers = [ProcessWorker(i) for i in range(pool_size)]
+            init = True
+
+def start_worker():
+    """
+    Start a worker process to replace one that died.  Must hold 
+    structure_lock.
+    """
+    used = set([w.worker_num for w in workers])
+    worker_num = min([i for i in range(len(workers) + 1) if i not in used])
+    logging.info("Starting func worker process %d" % worker_num)
+    worker = ProcessWorker(worker_num)
+    workers.append(worker)
+    return worker
+
+def resolve_func(func_ref):
+    """
+    Find the function with the given (module, name) reference.
+    The name may refer to a PyDFlow task wrapper, in which case the
+    wrapped function is returned.
+    """
+    modname, name = func_ref
+    mod = sys.modules.get(modname)
+    if mod is None:
+        mod = __import__(modname, fromlist=[name])
+    f = getattr(mod, name)
+    return getattr(f, 'func', f)
+
+def func_ref(func):
+    ref = (func.__module__, func.__name__)
+    try:
+        found = resolve_func(ref)
+    except (ImportError, AttributeError):
+        found = None
+    if found is not func:
+        raise ValueError(("Function %s must be defined at the top level of " +
+                "module %s to be run in a separate process") % ref[::-1])
+    return ref
+
+class FuncJob(object):
+    def __init__(self, task, func, input_items, continuation,
+                 failure_continuation, contstack):
+        self.task = task
+        self.func_ref = func_ref(func)
+        self.input_items = input_items
+        self.continuation = continuation
+        self.failure_continuation = failure_continuation
+        self.contstack = contstack
+        # When job was sent to a worker process
+        self.sent_time = None
+        
+    def keys(self):
+        return [ivar_keys.get(ivar) for ivar, val in self.input_items
+                if ivar is not None]
+
+    def do_callback(self, success, result):
+        if success:
+            self.continuation(self.task, result, self.contstack)
+        else:
+            self.failure_continuation(self.task, result)
+        
+class ProcessWorker(object):
+    def __init__(self, worker_num):
+        self.worker_num = worker_num
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=worker_main, 
+                                               args=(child_conn,))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        # key -> pickled size of data in worker's cache, least recently 
+        # used first
+        self.cached = OrderedDict()
+        self.cached_bytes = 0
+        self.job = None
+        self.reader = ResultThread(self)
+        self.reader.start()
+        
+    def cached_bytes_for(self, job):
+        return sum([self.cached.get(k, 0) for k in job.keys()])
+
+    def send(self, job):
+        """
+        Send a job to the worker.  Should only be called by the thread
+        which assigned the job to this worker.
+        """
+        global next_key
+        items = []
+        evict = []
+        stored = []
+        for ivar, val in job.input_items:
+            key = None
+            if ivar is not None:
+                key = ivar_keys.get(ivar)
+            if key is not None and key in self.cached:
+                items.append(('ref', key))
+                continue
+            data = cPickle.dumps(val, cPickle.HIGHEST_PROTOCOL)
+            if ivar is not None and len(data) >= CACHE_MIN_BYTES:
+                if key is None:
+                    with structure_lock:
+                        # Another thread may have got here first
+                        key = ivar_keys.get(ivar)
+                        if key is None:
+                            key = next_key
+                            next_key += 1
+                            ivar_keys[ivar] = key
+                stored.append((key, len(data)))
+                items.append(('store', key, data))
+            else:
+                items.append(('val', data))
+        # Only update cache once everything was pickled successfully
+        for item in items:
+            if item[0] == 'ref':
+                # Move to most recently used
+                self.cached[item[1]] = self.cached.pop(item[1])
+        for key, size in stored:
+            self.cached[key] = size
+            self.cached_bytes += size
+        # Evict least recently used, but not anything needed for this job
+        if self.cached_bytes > CACHE_MAX_BYTES:
+            in_use = set(job.keys())
+            for key in self.cached.keys():
+                if self.cached_bytes <= CACHE_MAX_BYTES:
+                    break
+                if key not in in_use:
+                    self.cached_bytes -= self.cached.pop(key)
+                    evict.append(key)
+        logging.debug("Sending %s to worker process %d" % (repr(job.task), 
+                                                           self.worker_num))
+        job.sent_time = time.time()
+        self.conn.send((job.func_ref, items, evict))
+
+class ResultThread(threading.Thread):
+    """
+    Waits for results from a worker process and hands it more work
+    """
+    def __init__(self, worker):
+        threading.Thread.__init__(self, 
+                        name="func_process_%d" % worker.worker_num)
+        self.worker = worker
+        self.setDaemon(True) # Ensure threads will exit with application
+
+    def run(self):
+        worker = self.worker
+        while True:
+            try:
+                success, result = worker.conn.recv()
+            except (EOFError, IOError), e:
+                next_job = None
+                with structure_lock:
+                    job = worker.job
+                    worker.job = None
+                    workers.remove(worker)
+                    # Replace it now if there is work waiting, otherwise
+                    # the pool is topped up when more work arrives
+                    if len(pending) > 0:
+                        replacement = start_worker()
+                        next_job = replacement.job = pending.popleft()
+                if job is not None:
+                    logging.error("Lost contact with worker process %d" %
+                                                         worker.worker_num)
+                    job.do_callback(False, e)
+                if next_job is not None:
+                    replacement.reader.send(next_job)
+                return
+            with structure_lock:
+                job = worker.job
+                if len(pending) > 0:
+                    worker.job = pending.popleft()
+                else:
+                    worker.job = None
+                next_job = worker.job
+            if next_job is not None:
+                self.send(next_job)
+            if success and history.ACTIVE:
+                history.record(job.task, time.time() - job.sent_time)
+            job.do_callback(success, result)
+
+    def send(self, job):
+        """
+        Send job to the worker.  If it can't be sent, fail it and send the
+        next pending job instead.
+        """
+        while job is not None:
+            try:
+                self.worker.send(job)
+                return
+            except (EOFError, IOError, OSError), e:
+                # Worker process died: run() will fail the job when it 
+                # finds the connection closed
+                return
+            except Exception, e:
+                # Couldn't pickle data
+                failed = job
+                with structure_lock:
+                    if len(pending) > 0:
+                        job = pending.popleft()
+                    else:
+                        job = None
+                    self.worker.job = job
+                failed.do_callback(False, e)
+
+def launch_func(task, func, input_items, continuation, failure_continuation,
+                contstack):
+    """
+    Run func in a worker process with the provided inputs.
+    input_items is a list of (ivar, value) pairs, where ivar can
+    be None for raw values.
+    """
+    ensure_init()
+    job = FuncJob(task, func, input_items, continuation, 
+                  failure_continuation, contstack)
+    worker = None
+    with structure_lock:
+        if len(workers) < pool_size:
+            start_worker()
+        idle = [w for w in workers if w.job is None]
+        if len(idle) == 0:
+            pending.append(job)
+        else:
+            # Prefer worker with most input data already cached
+            worker = max(idle, key=lambda w: w.cached_bytes_for(job))
+            worker.job = job
+    if worker is not None:
+        worker.reader.send(job)
+
+def worker_main(conn):
+    """
+    Main loop of worker process.  Note: don't log from here, as logging 
+    locks may have been held by other threads when process was forked
+    """
+    cache = {}
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        func_ref, items, evict = msg
+        for key in evict:
+            cache.pop(key, None)
+        try:
+            args = []
+            for item in items:
+                if item[0] == 'ref':
+                    args.append(cache[item[1]])
+                elif item[0] == 'store':
+                    val = cPickle.loads(item[2])
+                    cache[item[1]] = val
+                    args.append(val)
+                else:
+                    args.append(cPickle.loads(item[1]))
+            result = (True, resolve_func(func_ref)(*args))
+        except Exception, e:
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception, e:
+            # Result or exception could not be pickled
+            conn.send((False, Exception("Could not return result of %s: %s"
+                                        % (repr(func_ref), repr(e)))))
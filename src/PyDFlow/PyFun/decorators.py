@@ -17,7 +17,7 @@
 '''
 
 from PyDFlow.base.decorators import task_decorator
-from flowgraph import FuncTask
+from flowgraph import FuncTask, EXECUTORS
 
 class func(task_decorator):
     """
@@ -31,7 +31,27 @@ class func(task_decorator):
     @func((Int), (Int, Int))
     def add (a, b):
         return a + b
+
+    executor chooses where the function is run: 'thread' to run it
+    in a PyDFlow worker thread, or 'process' to run it in a separate
+    worker process, bypassing the GIL.  The function, its arguments and
+    its return value must then be picklable.  If not provided, the 
+    default executor set by PyDFlow.configure_funcs(executor=...) is used.
+
+    If cache is True, results are saved in an on-disk cache and reused
+    when the function is run again with the same inputs, even by a later
+    run of the script.  The inputs and return value must be picklable.
+    The function's code is part of the cache key, but any global state it
+    reads is not.  See PyDFlow.PyFun.memo.
     """
-    def __init__(self, output_types, input_types):
-        super(func, self).__init__(output_types, input_types)
+    def __init__(self, output_types, input_types, executor=None, cache=False):
+        if executor is not None and executor not in EXECUTORS:
+            raise ValueError("Invalid func executor %s, expected one of %s" 
+                             % (repr(executor), repr(EXECUTORS)))
+        task_options = {}
+        if executor is not None:
+            task_options['_executor'] = executor
+        if cache:
+            task_options['_cache'] = True
+        super(func, self).__init__(output_types, input_types, **task_options)
         self.task_class = FuncTask
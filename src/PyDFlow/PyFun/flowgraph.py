@@ -22,13 +22,35 @@ from PyDFlow.base.mutex import graph_mutex
 from PyDFlow.base.states import *
 from PyDFlow.writeonce import *
 import PyDFlow.base.LocalExecutor as LocalExecutor
+from PyDFlow.base import trace
+from PyDFlow.base import logflags
+from PyDFlow.base import history
+import ProcessExecutor
+import memo
 
 
 import logging
 import threading
+import time
 from PyDFlow.types.check import FlTypeError
 
+# Run func tasks in a worker thread, or ship them to a worker process
+EXEC_THREAD = 'thread'
+EXEC_PROCESS = 'process'
+EXECUTORS = (EXEC_THREAD, EXEC_PROCESS)
+
+# Executor used for func tasks which don't specify one
+default_executor = EXEC_THREAD
+
+def set_default_executor(executor):
+    global default_executor
+    if executor not in EXECUTORS:
+        raise ValueError("Invalid func executor %s, expected one of %s" 
+                         % (repr(executor), repr(EXECUTORS)))
+    default_executor = executor
+
 class PyIvar(AtomicIvar):
+    __slots__ = ()
 
     def __init__(self, *args, **kwargs):
         super(PyIvar, self).__init__(*args, **kwargs)
@@ -52,23 +74,40 @@ class PyIvar(AtomicIvar):
         ivar now
         """
         return self._future.isSet()
-        
+
+    def _checkpoint_binding(self):
+        if self._future.isSet():
+            return self._future.get()
+        else:
+            return None
     
 
+
 class FuncTask(AtomicTask):
+    __slots__ = ('_func', '_executor', '_cache')
+
     def __init__(self, func, *args, **kwargs):
+        executor = kwargs.pop('_executor', None)
+        # Whether to use memo cache
+        cache = kwargs.pop('_cache', False)
         super(FuncTask, self).__init__(*args, **kwargs)
         self._func = func
+        if executor is None:
+            executor = default_executor
+        self._executor = executor
+        self._cache = cache
 
 
 
-    def _exec(self, continuation, failure_continuation):
+    def _exec(self, continuation, failure_continuation, contstack=None):
         """
         Just run the task in the current thread, 
-        assuming it is ready
+        assuming it is ready.  If the task uses the process executor,
+        hand it off to a worker process and return immediately.
         """
-        logging.debug("%s: Starting a FuncTask %s" % (threading.currentThread().getName(), 
-                                                      repr(self)))
+        if logflags.DEBUG:
+            logging.debug("%s: Starting a FuncTask %s" % (threading.currentThread().getName(), 
+                                                          repr(self)))
         
         #TODO: select execution backend, run me!
         
@@ -77,19 +116,48 @@ class FuncTask(AtomicTask):
             # Check state again to be sure it is sensible
             if self._state in (T_QUEUED, T_CONTINUATION):
                 self._prep_ivars()
-                input_values = self._gather_input_values()
-                logging.debug("%s: FuncTask %s changing state to T_RUNNING" % (
-                                                threading.currentThread().getName(), 
-                                              repr(self)))
+                if self._executor == EXEC_PROCESS:
+                    input_items = self._gather_input_items()
+                else:
+                    input_values = self._gather_input_values()
+                if logflags.DEBUG:
+                    logging.debug("%s: FuncTask %s changing state to T_RUNNING" % (
+                                                    threading.currentThread().getName(), 
+                                                  repr(self)))
                 self._state = T_RUNNING
-                logging.debug("%s: Started a FuncTask %s" % (threading.currentThread().getName(), 
-                                              repr(self)))
+                if trace.ACTIVE:
+                    trace.task_running(self)
+                if logflags.DEBUG:
+                    logging.debug("%s: Started a FuncTask %s" % (threading.currentThread().getName(), 
+                                                  repr(self)))
             else:
                 # Bad state
                 # TODO: better logic
                 raise Exception("Invalid task state %s encountered by worker thread" % 
                                     (repr(self)))
         
+        if self._cache:
+            if self._executor == EXEC_PROCESS:
+                key = memo.make_key(self._func, [v for i, v in input_items])
+            else:
+                key = memo.make_key(self._func, input_values)
+            if key is not None:
+                found, return_val = memo.lookup(key)
+                if found:
+                    if logflags.DEBUG:
+                        logging.debug("%s: using cached result" % repr(self))
+                    if self._executor == EXEC_PROCESS:
+                        continuation(self, return_val, contstack)
+                    else:
+                        continuation(self, return_val)
+                    return
+                continuation = memo.storing_continuation(key, continuation)
+
+        if self._executor == EXEC_PROCESS:
+            ProcessExecutor.launch_func(self, self._func, input_items, 
+                            continuation, failure_continuation, contstack)
+            return
+        
         # Update state so we know its running
         #logging.debug("Running %s with inputs %s" %(repr(self), repr(input_values)))
     
@@ -98,11 +166,30 @@ class FuncTask(AtomicTask):
         
         # Run the function in this thread.  If the function raises an exception
         # it will be handled by the caller
-        return_val = self._func(*(input_values))
+        if history.ACTIVE:
+            start = time.time()
+            return_val = self._func(*(input_values))
+            history.record(self, time.time() - start)
+        else:
+            return_val = self._func(*(input_values))
             
         continuation(self, return_val)
         
+    def _gather_input_items(self):
+        """
+        Like _gather_input_values, but returns (ivar, value) pairs so
+        that the process executor can track which worker has which ivar
+        data.  ivar is None for raw inputs.
+        """
+        input_items = []
+        for spec, inp in self._input_iter():
+            if spec.isRaw():
+                input_items.append((None, inp))
+            else:
+                input_items.append((inp, inp._get()))
+        return input_items
+
     def isSynchronous(self):
-        return True
+        return self._executor != EXEC_PROCESS
 
     
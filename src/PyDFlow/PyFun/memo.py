@@ -0,0 +1,255 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+# http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+A persistent cache of func task results, so that rerunning a script
+doesn't recompute tasks whose code and inputs haven't changed.
+
+Results are stored one per file in a cache directory, named by a hash 
+of the function's code object and default arguments and the pickled 
+input values.  Note that globals or other state that the function 
+reads are not part of the key.  File modification times record when 
+entries were last used, so that the least recently used entries are 
+evicted when the cache grows past its size limit.
+
+@author: Tim Armstrong
+'''
+from __future__ import with_statement
+import os
+import errno
+import threading
+import logging
+import tempfile
+import time
+import marshal
+import cPickle
+import hashlib
+
+# Directory to store cached results in
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".pydflow", "memo")
+# Maximum total size of cached results
+MAX_BYTES = 1024 * 1024 * 1024
+
+SUFFIX = ".pkl"
+# Entries are written to temporary files with this suffix then renamed.
+# Temporary files older than STALE_TMP_AGE seconds were left behind by a 
+# process that died while writing, and are removed when the cache is 
+# loaded
+TMP_SUFFIX = ".tmp"
+STALE_TMP_AGE = 3600.0
+
+structure_lock = threading.Lock()
+# Size and last use time of each entry by key, loaded from cache dir
+# on first use.  Protected by structure_lock
+entries = None
+total_bytes = 0
+
+hits = 0
+misses = 0
+stores = 0
+evictions = 0
+
+def configure(cache_dir=None, max_bytes=None):
+    """
+    Set the cache directory and maximum size of the cache in bytes.
+    """
+    global CACHE_DIR, MAX_BYTES, entries
+    with structure_lock:
+        if cache_dir is not None:
+            CACHE_DIR = cache_dir
+            # Reload from new location
+            entries = None
+        if max_bytes is not None:
+            MAX_BYTES = max_bytes
+        if entries is not None:
+            evict()
+
+def stats():
+    """
+    Return a dictionary with counts of cache hits, misses, results
+    stored and entries evicted.
+    """
+    with structure_lock:
+        return {'hits': hits, 'misses': misses, 'stores': stores, 
+                'evictions': evictions}
+
+def ensure_loaded():
+    """
+    Scan the cache directory for existing entries.  If the directory
+    can't be created or read, the cache starts empty, so every lookup
+    misses.  Must hold structure_lock.
+    """
+    global entries, total_bytes
+    if entries is not None:
+        return
+    entries = {}
+    total_bytes = 0
+    try:
+        try:
+            os.makedirs(CACHE_DIR)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        names = os.listdir(CACHE_DIR)
+    except (OSError, IOError), e:
+        logging.warning("Could not use cache directory %s: %s" % 
+                        (CACHE_DIR, e))
+        return
+    now = time.time()
+    for name in names:
+        path = os.path.join(CACHE_DIR, name)
+        if name.endswith(SUFFIX):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries[name[:-len(SUFFIX)]] = (st.st_size, st.st_mtime)
+            total_bytes += st.st_size
+        elif name.endswith(TMP_SUFFIX):
+            try:
+                if now - os.stat(path).st_mtime > STALE_TMP_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+
+def entry_path(key):
+    return os.path.join(CACHE_DIR, key + SUFFIX)
+
+def make_key(func, input_values):
+    """
+    Compute the cache key for running func on input_values, or return
+    None if the inputs can't be pickled.
+    """
+    h = hashlib.sha1()
+    h.update("%s.%s" % (func.__module__, func.__name__))
+    try:
+        h.update(marshal.dumps(func.func_code))
+        h.update(cPickle.dumps(func.func_defaults, 2))
+        h.update(cPickle.dumps(input_values, 2))
+    except (cPickle.PicklingError, TypeError, ValueError), e:
+        logging.debug("Can't cache result of %s: %s" % (func.__name__, e))
+        return None
+    return h.hexdigest()
+
+def lookup(key):
+    """
+    Returns (True, value) if the result for key is cached, 
+    otherwise (False, None).
+    """
+    global hits, misses
+    with structure_lock:
+        ensure_loaded()
+        found = key in entries
+        if not found:
+            misses += 1
+            return False, None
+    try:
+        f = open(entry_path(key), 'rb')
+        try:
+            value = cPickle.load(f)
+        finally:
+            f.close()
+        os.utime(entry_path(key), None)
+        mtime = os.stat(entry_path(key)).st_mtime
+    except Exception, e:
+        # Removed by another process or corrupt
+        logging.debug("Couldn't read cache entry %s: %s" % (key, e))
+        with structure_lock:
+            remove_entry(key)
+            misses += 1
+        return False, None
+    with structure_lock:
+        hits += 1
+        if key in entries:
+            entries[key] = (entries[key][0], mtime)
+    return True, value
+
+def store(key, value):
+    """
+    Save value as the result for key, evicting least recently used
+    entries if the cache is too big.
+    """
+    global stores, total_bytes
+    try:
+        data = cPickle.dumps(value, 2)
+    except (cPickle.PicklingError, TypeError), e:
+        logging.debug("Can't cache unpicklable result: %s" % e)
+        return
+    with structure_lock:
+        ensure_loaded()
+        cache_dir = CACHE_DIR
+    try:
+        # Write to temporary file then rename so that readers never
+        # see partial entry
+        handle, tmppath = tempfile.mkstemp(suffix=TMP_SUFFIX, dir=cache_dir)
+        try:
+            try:
+                os.write(handle, data)
+            finally:
+                os.close(handle)
+            with structure_lock:
+                os.rename(tmppath, entry_path(key))
+                remove_entry(key, delete=False)
+                entries[key] = (len(data), os.stat(entry_path(key)).st_mtime)
+                total_bytes += len(data)
+                stores += 1
+                evict()
+        except (OSError, IOError):
+            try:
+                os.remove(tmppath)
+            except OSError:
+                pass
+            raise
+    except (OSError, IOError), e:
+        # Not fatal, the task has still succeeded
+        logging.warning("Could not save result to cache: %s" % e)
+
+def remove_entry(key, delete=True):
+    """
+    Must hold structure_lock.
+    """
+    global total_bytes
+    entry = entries.pop(key, None)
+    if entry is not None:
+        total_bytes -= entry[0]
+    if delete:
+        try:
+            os.remove(entry_path(key))
+        except OSError:
+            pass
+
+def evict():
+    """
+    Remove least recently used entries until the cache is within its
+    size limit.  Must hold structure_lock.
+    """
+    global evictions
+    if total_bytes <= MAX_BYTES:
+        return
+    by_age = sorted(entries.iteritems(), key=lambda (k, (size, mtime)): mtime)
+    for key, entry in by_age:
+        if total_bytes <= MAX_BYTES:
+            break
+        remove_entry(key)
+        evictions += 1
+
+def storing_continuation(key, continuation):
+    """
+    Wrap a task's continuation so that the result is cached before
+    it is passed on.
+    """
+    def cont(task, return_val, *args):
+        store(key, return_val)
+        return continuation(task, return_val, *args)
+    return cont
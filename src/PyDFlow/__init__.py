@@ -13,6 +13,10 @@
 # limitations under the License.
 
 from PyDFlow.types import flvar, Multiple, Lazy
-from PyDFlow.base.patterns import resultset, treereduce, dynreduce, waitall
+from PyDFlow.base.patterns import resultset, treereduce, dynreduce, lazyreduce, waitall
+from PyDFlow.base.stream import Stream
 from PyDFlow.compound import compound
 from PyDFlow.base.structures import IStruct 
+from PyDFlow.base.config import configure, configure_funcs, configure_apps, \
+        configure_app_paths, configure_app_journal, configure_scheduling, \
+        configure_checkpoint, configure_monitoring
@@ -17,49 +17,243 @@
 '''
 from __future__ import with_statement
 from PyDFlow.app.exceptions import ExitCodeException, AppLaunchException
-import time
 """
-Refactoring plan:
-
-request queue which receives tasks to run.
-notification queue which sends back notifications
-notification thread running in this process which calls continuations.
-
-    This server could run in a separate process using the multiprocessing module.
-    MAX_RUNNING worker threads which correspond to forked processes.
-    
-    
+Apps are launched by a single monitor thread, which sleeps until there is
+an app in the queue that fits in the free cores and memory.  Each running process is
+waited on by a reaper thread blocked in waitpid() for that specific process,
+so completion is noticed as soon as the process exits rather than at the
+next poll.  We don't use waitpid(-1) or a SIGCHLD handler: the former would
+reap children that don't belong to us (e.g. process executor workers or
+the user's own subprocesses) and in Python 2 the latter only runs in the
+main thread, which is often blocked waiting for results.
+Reapers hand finished apps to a small pool of callback threads which fill
+in the outputs and continue the flowgraph, so that contention for the 
+graph lock doesn't hold up reaping or launching of apps.
 """
 
 from PyDFlow.base.mutex import graph_mutex
+from PyDFlow.base.LocalExecutor import cpu_count
+from PyDFlow.base import metrics, priority, history, logflags
 
-import subprocess
+import os
 import threading
+import collections
 import Queue
 import logging
+import time
 import paths
+import journal
+import launch
+
+# Resources available to apps running locally.  Apps declare the cores
+# and memory they need (1 core and no memory by default) and are run 
+# concurrently while they fit.
+# CORES of None means use the number of cpus.  MEMORY (in megabytes) of 
+# None means use the physical memory of this machine. 
+CORES = None
+MEMORY = None
 
-#TODO: no polling?
-POLL_INTERVAL = 0.05 # seconds between polling tasks when active
-#TODO: get info about number of processors
-MAX_RUNNING = 2
+# How far down the queue to look for an app which fits in the free
+# resources when the app at the head of the queue doesn't
+BACKFILL_WINDOW = 32
 
 LIFO = False
 
+# Number of threads to run app callbacks in
+CALLBACK_THREADS = 2
+
+# How to start app processes: see launch.py
+LAUNCHER = launch.LAUNCH_POPEN
+
+# Resource limits in effect and the amount in use by running apps
+total_cores = None
+total_memory = None
+used_cores = 0
+used_memory = 0
+# Most resources in use at once since the limits were last set
+peak_cores = 0
+peak_memory = 0
+
 structure_lock = threading.Lock()
+# Protects work_queue, active_apps and resource usage, signalled when 
+# work is added or resources are freed up
 work_added = threading.Condition()
 init = False
 work_queue = None
 active_apps = None
 monitor_t = None # monitor thread
+reap_queue = None
+reapers = None # reaper threads
+idle_reapers = 0 # reapers free to take a new app, protected by work_added
+callback_queue = None # finished apps waiting for callbacks to run
+callback_threads = None
+
+# Statistics about callbacks, protected by stats_lock
+stats_lock = threading.Lock()
+callbacks_queued = 0 # number waiting now
+max_callbacks_queued = 0
+callbacks_run = 0
+callback_wait = 0.0 # Total time between exit and start of callback
+# Statistics about the monitor thread, protected by stats_lock
+launches = 0
+launch_time = 0.0 # Total time from picking an app to it being launched
+max_launch_time = 0.0
+queue_wait = 0.0 # Total time from queueing an app to it being picked
+# Longest launch time in the previous and current windows of MAX_WINDOW
+# seconds, so that the metric shows recent launches
+MAX_WINDOW = 60.0
+window_start = 0.0
+window_max = [0.0, 0.0]
+
+def rotate_window(now):
+    """
+    Start a new window of launch times if the current one is over.  Must
+    hold stats_lock.
+    """
+    global window_start
+    if now - window_start < MAX_WINDOW:
+        return
+    if now - window_start < 2 * MAX_WINDOW:
+        window_max[0] = window_max[1]
+    else:
+        window_max[0] = 0.0
+    window_max[1] = 0.0
+    window_start = now
+
+def recent_max_launch_time():
+    with stats_lock:
+        rotate_window(time.time())
+        return max(window_max)
+
+def physical_memory():
+    """
+    Physical memory of this machine in megabytes, or None if unknown.
+    """
+    try:
+        return (os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+                    / (1024 * 1024))
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def set_limits():
+    """
+    Recompute resource limits from settings.  Must hold work_added.
+    """
+    global total_cores, total_memory, peak_cores, peak_memory
+    if CORES is None:
+        total_cores = cpu_count()
+    else:
+        total_cores = CORES
+    if MEMORY is None:
+        total_memory = physical_memory()
+    else:
+        total_memory = MEMORY
+    peak_cores, peak_memory = used_cores, used_memory
+    logging.debug("Local app resources: %s cores, %s MB memory" % 
+                  (total_cores, total_memory))
+
+def configure(cores=None, memory=None, callback_threads=None, launcher=None):
+    """
+    Set the cores and memory (in megabytes) available for running apps.
+    Can be changed while apps are running: running apps are not affected.
+    callback_threads is the number of threads that finished apps are 
+    handed off to.
+    launcher is launch.LAUNCH_POPEN or launch.LAUNCH_HELPER.
+    """
+    global CORES, MEMORY, CALLBACK_THREADS, LAUNCHER
+    if launcher is not None:
+        if launcher not in launch.LAUNCHERS:
+            raise ValueError("Invalid app launcher %s, expected one of %s"
+                             % (repr(launcher), repr(launch.LAUNCHERS)))
+        LAUNCHER = launcher
+    if cores is not None:
+        if cores <= 0:
+            raise ValueError("Must have positive number of cores for apps")
+        CORES = cores
+    if memory is not None:
+        if memory <= 0:
+            raise ValueError("Must have positive memory for apps")
+        MEMORY = memory
+    if callback_threads is not None:
+        if callback_threads <= 0:
+            raise ValueError("Must have positive number of callback threads")
+        with structure_lock:
+            CALLBACK_THREADS = callback_threads
+            if init:
+                resize_callback_threads()
+    with work_added:
+        set_limits()
+        # More apps might fit now
+        work_added.notify()
+
+def stats():
+    """
+    Return a dictionary with the number of apps queued and running, and 
+    statistics about the app callback queue: the number of finished apps
+    waiting for callbacks now and at most, the number of callbacks run and
+    mean seconds from app exit until its callback started.  Also has the
+    number of apps the monitor thread launched, and the mean and maximum
+    seconds each monitor loop took from picking an app to launching it,
+    and the mean seconds apps waited in the queue before being picked.
+    peak_cores and peak_memory are the most cores and memory reserved by
+    running apps at once since the resource limits were last set.
+    """
+    with work_added:
+        if init:
+            queued, running = len(work_queue), len(active_apps)
+        else:
+            queued = running = 0
+        peaks = peak_cores, peak_memory
+    with stats_lock:
+        if callbacks_run > 0:
+            mean_wait = callback_wait / callbacks_run
+        else:
+            mean_wait = 0.0
+        if launches > 0:
+            mean_launch = launch_time / launches
+            mean_queue_wait = queue_wait / launches
+        else:
+            mean_launch = mean_queue_wait = 0.0
+        return {'queued': queued, 'running': running, 
+                'callbacks_queued': callbacks_queued, 
+                'max_callbacks_queued': max_callbacks_queued,
+                'callbacks_run': callbacks_run, 
+                'mean_callback_wait': mean_wait,
+                'launches': launches, 'mean_launch_time': mean_launch,
+                'max_launch_time': max_launch_time,
+                'mean_queue_wait': mean_queue_wait,
+                'peak_cores': peaks[0], 'peak_memory': peaks[1]}
+
+def resize_callback_threads():
+    """
+    Start or stop callback threads to match CALLBACK_THREADS.
+    Must hold structure_lock.
+    """
+    while len(callback_threads) < CALLBACK_THREADS:
+        t = CallbackThread()
+        callback_threads.append(t)
+        t.start()
+    while len(callback_threads) > CALLBACK_THREADS:
+        # Any thread which gets this will exit
+        callback_threads.pop()
+        callback_queue.put(None)
 
 def ensure_init():
     global structure_lock, active_apps, monitor_t, init, work_queue
+    global reap_queue, reapers, callback_queue, callback_threads
     structure_lock.acquire()
     if not init:
         logging.debug("Initializing Local app task queue")
+        with work_added:
+            if total_cores is None:
+                set_limits()
         active_apps = set()
-        work_queue = Queue.Queue()
+        work_queue = collections.deque()
+        reap_queue = Queue.Queue()
+        reapers = []
+        callback_queue = Queue.Queue()
+        callback_threads = []
+        resize_callback_threads()
         monitor_t = MonitorThread(work_queue, active_apps)
         init = True
         monitor_t.start()
@@ -73,69 +267,194 @@ class MonitorThread(threading.Thread):
         self.active_apps = active_apps
         self.setDaemon(True) # Ensure threads will exit with application
     
-    def run(self):
+    def next_app(self):
+        """
+        Block until there is an app to run which fits into the free
+        resources, and remove it from the queue.
+        Must hold work_added.
+        """
         while True:
-            # If there are no apps running, we just need to wait for something to
-            # be added
-            if len(self.active_apps) == 0:
-                t = self.queue.get()
+            if priority.ACTIVE:
+                entry = self.pick_by_priority()
             else:
-                # Check for new tasks - don't block because we need to monitor 
-                # existing tasks
-                if len(self.active_apps) >= MAX_RUNNING:
-                    t = None
-                else:
-                    try:
-                        t = self.queue.get_nowait()
-                    except Queue.Empty:
-                        t = None
-
-            while t:
-                #launch task  
-                if t.run():
-                    self.active_apps.add(t)
-
-                if len(self.active_apps) >= MAX_RUNNING:
-                    t = None
-                else:
-                    try:
-                        t = self.queue.get_nowait()
-                    except Queue.Empty:
-                        t = None
-
-
-            # Check to see if any existing tasks have finished, if so need to
-            # invoke callback
-            for app in self.active_apps.copy():
-                if app.is_done():
-                    logging.debug("App done!")
-                    self.active_apps.remove(app)
-                    self.queue.task_done()
-                    # callback: TODO: should I have a separate thread for these?
-                    app.do_callback()
-
-            if len(self.active_apps) >= MAX_RUNNING:
-                t = None
-                time.sleep(POLL_INTERVAL)
+                entry = self.pick_first()
+            if entry is not None:
+                return entry
+            work_added.wait()
+
+    def pick_first(self):
+        """
+        Remove and return the first app in the backfill window which fits,
+        or None.
+        """
+        queue_len = len(self.queue)
+        passed = []
+        for i in xrange(min(queue_len, BACKFILL_WINDOW)):
+            if LIFO:
+                i = queue_len - i - 1
+            entry = self.queue[i]
+            if entry.fits() and (not passed or may_backfill(entry, passed[0])):
+                for p in passed:
+                    p.skipped += 1
+                del self.queue[i]
+                return entry
+            # Stop smaller apps from overtaking this one forever
+            if entry.skipped >= BACKFILL_WINDOW:
+                break
+            passed.append(entry)
+        return None
+
+    def pick_by_priority(self):
+        """
+        Remove and return the app in the backfill window which fits with
+        the longest chain of tasks after it, or None.  Apps which have been
+        passed over BACKFILL_WINDOW times go first.
+        """
+        queue_len = len(self.queue)
+        scanned = []
+        blocked = None
+        best_i = best = None
+        for i in xrange(min(queue_len, BACKFILL_WINDOW)):
+            if LIFO:
+                i = queue_len - i - 1
+            entry = self.queue[i]
+            scanned.append(entry)
+            if entry.fits() and (blocked is None or 
+                                 may_backfill(entry, blocked)):
+                if entry.skipped >= BACKFILL_WINDOW:
+                    best_i, best = i, entry
+                    break
+                if best is None or entry.priority > best.priority:
+                    best_i, best = i, entry
+            elif entry.skipped >= BACKFILL_WINDOW:
+                break
+            elif blocked is None and not entry.fits():
+                blocked = entry
+        if best is None:
+            return None
+        for p in scanned:
+            if p is not best:
+                p.skipped += 1
+        del self.queue[best_i]
+        return best
+
+    def run(self):
+        global launches, launch_time, max_launch_time, queue_wait
+        while True:
+            with work_added:
+                t = self.next_app()
+                picked = time.time()
+                # Reserve resources before launching
+                t.acquire()
+                self.active_apps.add(t)
+
+            #launch task  
+            if t.run():
+                start_reaper(t)
             else:
-                # Wait either the POLL_INTERVAL, or until there is work added to the queue
-                global work_added
-                work_added.acquire()
-                if self.queue.empty():
-                    work_added.wait(POLL_INTERVAL)
-                work_added.release()
+                with work_added:
+                    t.release()
+                    self.active_apps.remove(t)
+                    work_added.notify()
+            took = time.time() - picked
+            with stats_lock:
+                launches += 1
+                launch_time += took
+                queue_wait += picked - t.queued_time
+                if took > max_launch_time:
+                    max_launch_time = took
+                rotate_window(picked)
+                window_max[1] = max(window_max[1], took)
+            # Don't keep task and its outputs alive while we sleep
+            t = None
 
+class ReaperThread(threading.Thread):
+    """
+    Waits for launched apps to exit, then hands them off to have their
+    callbacks run.  Enough reapers are started that every running app 
+    has one waiting on it.
+    """
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.setDaemon(True) # Ensure threads will exit with application
+        
+    def run(self):
+        global idle_reapers
+        while True:
+            app = reap_queue.get()
+            app.wait()
+            logging.debug("App done!")
+            with work_added:
+                app.release()
+                active_apps.remove(app)
+                # Resources freed up: wake the monitor
+                work_added.notify()
+            queue_callback(app)
+            app = None
+            with work_added:
+                idle_reapers += 1
+
+def queue_callback(app):
+    """
+    Queue up callback for finished app to be run by a callback thread.
+    """
+    global callbacks_queued, max_callbacks_queued
+    app.exit_time = time.time()
+    with stats_lock:
+        callbacks_queued += 1
+        if callbacks_queued > max_callbacks_queued:
+            max_callbacks_queued = callbacks_queued
+    callback_queue.put(app)
+
+class CallbackThread(threading.Thread):
+    """
+    Runs callbacks of finished apps, which fill in the app's outputs and
+    carry on evaluating the flowgraph.
+    """
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.setDaemon(True) # Ensure threads will exit with application
+
+    def run(self):
+        global callbacks_queued, callbacks_run, callback_wait
+        while True:
+            app = callback_queue.get()
+            if app is None:
+                return
+            with stats_lock:
+                callbacks_queued -= 1
+                callbacks_run += 1
+                callback_wait += time.time() - app.exit_time
+            try:
+                app.do_callback()
+            except Exception, e:
+                logging.error("Error in callback for app %s: %s" % 
+                              (repr(app.task), repr(e)))
+            app = None
+
+def start_reaper(app):
+    """
+    Hand a launched app to a reaper thread, starting a new one if all
+    existing reapers are busy.
+    """
+    global idle_reapers
+    with work_added:
+        if idle_reapers > 0:
+            # Claim an idle reaper
+            idle_reapers -= 1
+        else:
+            reaper = ReaperThread()
+            reapers.append(reaper)
+            reaper.start()
+    reap_queue.put(app)
 
-def openFile(fp, mode):
-    if fp:
-        return open(fp, mode)
-    else:
-        return None
 
 class AppQueueEntry(object):
-    def __init__(self, task, continuation, failure_continuation, contstack):
+    def __init__(self, task, continuation, failure_continuation, contstack,
+                 command=None):
         """
-        Std*_file should all be file paths
+        command is the result of task._prepare_command() if it was already
+        called, otherwise it is called when the app is run.
         """
         self.continuation = continuation
         self.failure_continuation = failure_continuation
@@ -143,96 +462,189 @@ class AppQueueEntry(object):
         self.task = task
         self.process = None
         self.exit_code = None
+        self.command = command
+        self.exit_time = None
+        self.queued_time = time.time()
+        # When resources were reserved, then when process started
+        self.start_time = None
+        # Length of critical path from app, if priority scheduling
+        self.priority = 0.0
+        self.cores = task._cores
+        self.memory = task._memory
+        # Resources reserved while running
+        self.held_cores = 0
+        self.held_memory = 0
+        # Number of times other apps were launched ahead of this one
+        self.skipped = 0
+
+    def fits(self):
+        """
+        Check if app fits in free resources.  Apps asking for more than
+        the total are allowed to run by themselves.  Must hold work_added. 
+        """
+        if used_cores + min(self.cores, total_cores) > total_cores:
+            return False
+        if self.memory is not None and total_memory is not None:
+            if used_memory + min(self.memory, total_memory) > total_memory:
+                return False
+        return True
+
+    def acquire(self):
+        """
+        Reserve resources for app.  Must hold work_added.
+        """
+        global used_cores, used_memory, peak_cores, peak_memory
+        self.start_time = time.time()
+        self.held_cores = min(self.cores, total_cores)
+        used_cores += self.held_cores
+        if self.memory is not None and total_memory is not None:
+            self.held_memory = min(self.memory, total_memory)
+            used_memory += self.held_memory
+        peak_cores = max(peak_cores, used_cores)
+        peak_memory = max(peak_memory, used_memory)
+
+    def release(self):
+        """
+        Return resources reserved by acquire().  Must hold work_added.
+        """
+        global used_cores, used_memory
+        used_cores -= self.held_cores
+        used_memory -= self.held_memory
+        self.held_cores = self.held_memory = 0
 
     def run(self):
         #TODO: handle errors here!!
         try: 
             task = self.task
     
-            cmd_args, stdin_file, stdout_file, stderr_file = task._prepare_command()
-            logging.info("Running app task %s.  Command line: %s." % (self.task.name(), 
-                                    ' '.join(cmd_args)))
-            if stdin_file is not None:
-                logging.info("stdin redirected from %s" % stdin_file)
-            if stdout_file is not None:
-                logging.info("stdout redirected to %s" % stdout_file)
-            if stderr_file is not None:
-                logging.info("stderr redirected to %s" % stderr_file)
+            if self.command is None:
+                self.command = task._prepare_command()
+            cmd_args, stdin_file, stdout_file, stderr_file = self.command
+            # Keep command as generated for journal
+            cmd_args = list(cmd_args)
+            if logflags.INFO:
+                logging.info("Running app task %s.  Command line: %s." % (
+                                    self.task.name(), ' '.join(cmd_args)))
+                if stdin_file is not None:
+                    logging.info("stdin redirected from %s" % stdin_file)
+                if stdout_file is not None:
+                    logging.info("stdout redirected to %s" % stdout_file)
+                if stderr_file is not None:
+                    logging.info("stderr redirected to %s" % stderr_file)
                 
             if self.process is not None:
                 raise Exception("Tried to run AppQueueEntry twice")
            
-            stdin = stdout = stderr = None
-            try:
-                # Open the file if the path is not None
-                stdin=openFile(stdin_file, 'r')
-                stdout=openFile(stdout_file, 'w')
-                stderr=openFile(stderr_file, 'w')
-        
+            if logflags.DEBUG:
                 logging.debug("Launching %s" % repr(cmd_args))
-                #print "Starting a task"
-                # launch the process
-                
-                exc = paths.lookup(cmd_args[0])
-                if exc is not None:
-                    # Use the binary we just looked up, otherwise
-                    # use the OS's resolution mechanism
-                    cmd_args[0] = exc
-                try:
-                    self.process = subprocess.Popen(cmd_args,
-                        stdin = stdin, stdout = stdout,  
-                        stderr = stderr,
-                        close_fds=True # don't inherit any open files this
-                                       # process may have. TODO: might not
-                                       # work on windows
-                        )
-                except OSError, e:
-                    self.failure_continuation(self.task, AppLaunchException(repr(self.task),                       
-                                        cmd_args[0], e))
-                    return False
-            finally:
-                # Don't need just-opened file descriptors in this process now
-                for f in (stdin, stderr, stdout):
-                    if f is not None:
-                        f.close()
+            # launch the process
+            app_name = cmd_args[0]
+            # Use the catalog or app paths, otherwise use the OS's 
+            # resolution mechanism
+            cmd_args = paths.resolve(cmd_args)
+            try:
+                self.process = launch.spawn(LAUNCHER, cmd_args, stdin_file,
+                                            stdout_file, stderr_file)
+                self.start_time = time.time()
+            except OSError, e:
+                self.failure_continuation(self.task, AppLaunchException(repr(self.task),                       
+                                    app_name, e))
+                return False
             self.task.started_callback()
             return True
         except Exception, e:
             self.failure_continuation(self.task, e)
             return False
 
-    def is_done(self):
-        if self.exit_code:
-            return True
-        self.exit_code = self.process.poll() # will be none if not finished
-        return (self.exit_code is not None)
+    def wait(self):
+        """
+        Block until the process exits
+        """
+        self.exit_code = self.process.wait()
+        return self.exit_code
     
     def do_callback(self):
         if self.process is None:
             #TODO: how to handle
             raise Exception("Process has not yet been run, can't callback")
-        #handle_cont = (self.contstack is not None and len(self.contstack) > 0  
-        #        and self.contstack[0].__class__.__name__ == "AppTask") #TODO: temporary hack
-        
         if self.exit_code != 0:
             # Error code
             self.failure_continuation(self.task, ExitCodeException(repr(self.task), self.exit_code))
             return
-        
-        handle_cont = False
+        if history.ACTIVE:
+            history.record(self.task, self.exit_time - self.start_time)
         with graph_mutex:
             if len(self.task._outputs) == 1:
                 retval = self.task._outputs[0]._bound
             else: 
                 retval = [ch._bound for ch in self.task._outputs]
-        if handle_cont:
-            self.continuation(self.task, retval, None) # Handle own contstack
-        else:
-            self.continuation(self.task, retval, self.contstack) # Handle own contstack
-        if handle_cont:
-            launch_app(self.contstack[0], self.continuation, self.contstack[1:])
+            outputs = None
+            if journal.enabled():
+                outputs = journal.output_paths(self.task)
+                inputs = journal.input_paths(self.task)
+        if outputs is not None:
+            journal.record(outputs, inputs, self.command)
+        self.continuation(self.task, retval, self.contstack)
 
 
+def may_backfill(entry, blocked):
+    """
+    Check if entry can be launched ahead of blocked, an app waiting for 
+    cores, without delaying it, going by the runtimes predicted from 
+    history of entry and of the running apps.  Allowed if entry should
+    finish before enough cores are free for blocked, or only uses cores
+    blocked won't need, or if there isn't enough history to tell.
+    Must hold work_added.
+    """
+    if not history.ACTIVE:
+        return True
+    runtime = history.predict(entry.task)
+    if runtime is None:
+        return True
+    ends = []
+    for app in active_apps:
+        predicted = history.predict(app.task)
+        if predicted is None:
+            return True
+        ends.append((app.start_time + predicted, app.held_cores))
+    ends.sort()
+    needed = min(blocked.cores, total_cores)
+    free = total_cores - used_cores
+    now = time.time()
+    # Predicted time when blocked can start
+    shadow = now
+    for end, cores in ends:
+        if free >= needed:
+            break
+        free += cores
+        shadow = end
+    if free < needed:
+        return True
+    return (now + runtime <= shadow or 
+            min(entry.cores, total_cores) <= free - needed)
+
+def skip_if_done(task, command, continuation, contstack):
+    """
+    If the journal shows that the task's outputs are already up to date,
+    fill them in without running the app.  Returns True if the app was 
+    skipped.
+    """
+    with graph_mutex:
+        outputs = journal.output_paths(task)
+        if outputs is None:
+            return False
+        inputs = journal.input_paths(task)
+    if not journal.up_to_date(outputs, inputs, command):
+        return False
+    if logflags.INFO:
+        logging.info("Skipping app task %s: outputs up to date" % task.name())
+    if len(outputs) == 1:
+        retval = outputs[0]
+    else:
+        retval = outputs
+    continuation(task, retval, contstack)
+    return True
+
 def launch_app(task, continuation, failure_continuation, contstack):
     """
     Launch a process using Popen, with cmd_args
@@ -244,10 +656,52 @@ def launch_app(task, continuation, failure_continuation, contstack):
     output is redirected to/from the file paths specified by the 
     options std*_file arguments.
     """
+    command = None
+    if journal.enabled():
+        # Generate the command once, to check the journal and to run it
+        try:
+            command = task._prepare_command()
+        except Exception, e:
+            failure_continuation(task, e)
+            return
+        if skip_if_done(task, command, continuation, contstack):
+            return
     ensure_init()
-    logging.debug("Added app %s to work queue" % repr(task))
-    entry = AppQueueEntry(task, continuation, failure_continuation, contstack)
-    work_added.acquire()
-    work_queue.put(entry)
-    work_added.notify()
-    work_added.release()
+    if logflags.DEBUG:
+        logging.debug("Added app %s to work queue" % repr(task))
+    entry = AppQueueEntry(task, continuation, failure_continuation, contstack,
+                          command)
+    if priority.ACTIVE:
+        with graph_mutex:
+            entry.priority = priority.bottom_level(task)
+    with work_added:
+        work_queue.append(entry)
+        work_added.notify()
+
+def stat_metric(key):
+    return lambda: stats()[key]
+
+metrics.register('pydflow_apps_queued', metrics.GAUGE,
+        "Apps waiting for resources to run", stat_metric('queued'))
+metrics.register('pydflow_apps_running', metrics.GAUGE,
+        "Apps running now", stat_metric('running'))
+metrics.register('pydflow_app_callbacks_queued', metrics.GAUGE,
+        "Finished apps waiting for their callbacks to run",
+        stat_metric('callbacks_queued'))
+metrics.register('pydflow_app_callbacks_total', metrics.COUNTER,
+        "App callbacks run", lambda: callbacks_run)
+metrics.register('pydflow_app_callback_wait_seconds_total', metrics.COUNTER,
+        "Total time from apps exiting to their callbacks starting",
+        lambda: callback_wait)
+metrics.register('pydflow_app_launches_total', metrics.COUNTER,
+        "Apps launched by the monitor thread", lambda: launches)
+metrics.register('pydflow_app_launch_seconds_total', metrics.COUNTER,
+        "Total time the monitor thread took from picking apps to "
+        "launching them", lambda: launch_time)
+metrics.register('pydflow_app_launch_seconds_max', metrics.GAUGE,
+        "Longest time the monitor thread took from picking an app to "
+        "launching it in the last one to two minutes", 
+        recent_max_launch_time)
+metrics.register('pydflow_app_queue_wait_seconds_total', metrics.COUNTER,
+        "Total time apps waited in the queue before the monitor thread "
+        "picked them", lambda: queue_wait)
@@ -19,7 +19,7 @@ import flowgraph
 from flowgraph import App, outfiles
 from decorator import app
 from PyDFlow.compound import compound
-from paths import add_path, set_paths
+from paths import add_path, set_paths, add_app, load_catalog
 from PyDFlow.app.mappers import SimpleMapper, GlobMapper, SubMapper
 
 
@@ -25,7 +25,21 @@ class app(task_decorator):
 
     E.g.
     @app((Image), (Image, _))
+
+    cores and memory (in megabytes) declare the resources the app needs
+    when run, so that the local executor only runs as many apps at once 
+    as fit on the machine.  By default an app takes 1 core and no memory
+    is reserved. 
+    E.g.
+    @app((Image), (Image), cores=4, memory=2048)
     """
-    def __init__(self, output_types, input_types):
-        super(app, self).__init__(output_types, input_types)
+    def __init__(self, output_types, input_types, cores=1, memory=None):
+        if cores <= 0:
+            raise ValueError("App must need positive number of cores, not %s"
+                             % repr(cores))
+        if memory is not None and memory <= 0:
+            raise ValueError("App must need positive memory, not %s"
+                             % repr(memory))
+        super(app, self).__init__(output_types, input_types, 
+                                  _cores=cores, _memory=memory)
         self.task_class = AppTask
@@ -19,6 +19,9 @@ from __future__ import with_statement
 
 from PyDFlow.base.atomic import AtomicIvar, AtomicTask, Unbound
 from PyDFlow.base.mutex import graph_mutex
+from PyDFlow.base.checkpoint import NoCheckpoint
+from PyDFlow.base import trace
+from PyDFlow.base import logflags
 from PyDFlow.base.exceptions import *
 from PyDFlow.base.states import *
 import LocalExecutor as localexec
@@ -134,6 +137,8 @@ class FileIvar(AtomicIvar):
     typically specified by a path string (although the exact
     details depend on the subclass).
     """
+    __slots__ = ('_temp_created',)
+
     def __init__(self, *args, **kwargs):
         super(FileIvar, self).__init__(*args, **kwargs)
         self._temp_created=False
@@ -201,6 +206,28 @@ class FileIvar(AtomicIvar):
         else:
             return False
 
+    def _checkpoint_location(self):
+        if self._bound is Unbound or self._temp_created:
+            return None
+        return self._bound
+
+    def _checkpoint_value(self, val):
+        # Temporary files won't outlive this process
+        if self._temp_created:
+            return NoCheckpoint
+        return val
+
+    def _restorable(self, val):
+        return self._fileExists(val)
+
+    def _data_size(self):
+        if self._bound is Unbound:
+            return None
+        try:
+            return os.path.getsize(self._bound)
+        except OSError:
+            return None
+
     def __del__(self):
         """
         When garbage collection happens, clean up temporary files.
@@ -247,6 +274,8 @@ class FileIvar(AtomicIvar):
 
 
 class LocalFileIvar(FileIvar):
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         #TODO: expand bound path
         super(LocalFileIvar, self).__init__(*args, **kwargs)
@@ -299,6 +328,9 @@ class LocalFileIvar(FileIvar):
 
 
 class AppTask(AtomicTask):
+    __slots__ = ('_func', '_input_data', '_in_exec_queue', '_cores', 
+                 '_memory')
+
     # By default, use local executor
     # TODO: need to dynamically choose executor based on:
     #   a) availability of required binary
@@ -306,6 +338,9 @@ class AppTask(AtomicTask):
     launch_app = localexec.launch_app
 
     def __init__(self, func, *args, **kwargs):
+        # Resources needed to run app
+        self._cores = kwargs.pop('_cores', 1)
+        self._memory = kwargs.pop('_memory', None)
         super(AppTask, self).__init__(*args, **kwargs)
         self._func = func
         self._input_data = None
@@ -314,8 +349,9 @@ class AppTask(AtomicTask):
     def _exec(self, continuation, failure_continuation,  contstack):
         
         # Lock while we gather up the input and output ivars
-        logging.debug("Gathering input values for %s" % repr(self))
-        logging.debug("Inputs: %s" %(repr(self._inputs)))
+        if logflags.DEBUG:
+            logging.debug("Gathering input values for %s" % repr(self))
+            logging.debug("Inputs: %s" %(repr(self._inputs)))
         with graph_mutex:
             # Ensure only run once
             if self._in_exec_queue:
@@ -325,7 +361,9 @@ class AppTask(AtomicTask):
             else:
                 self._in_exec_queue = True
             self._input_data = self._gather_input_values()
-        logging.debug("Starting apptask - input values were %s" % repr(self._input_data))
+        if logflags.DEBUG:
+            logging.debug("Starting apptask - input values were %s" % 
+                          repr(self._input_data))
         #logging.info("Queuing app task %s with inputs %s" % (self.name(), 
         #                            ' '.join([repr(arg) for arg in self._input_data])))
         # Launch the executable using backend module, attach a callback
@@ -350,8 +388,10 @@ class AppTask(AtomicTask):
           
         call_args, stdin_file, stdout_file, stderr_file = app_object.gen_command(out_paths)
         
-        logging.debug("Generated command %s with redirections in=%s, out=%s, err=%s"
-                      % (repr(call_args), stdin_file, stdout_file, stderr_file))
+        if logflags.DEBUG:
+            logging.debug("Generated command %s with redirections in=%s, "
+                          "out=%s, err=%s" % (repr(call_args), stdin_file, 
+                                              stdout_file, stderr_file))
         return call_args, stdin_file, stdout_file, stderr_file
 
     def started_callback(self):
@@ -359,5 +399,7 @@ class AppTask(AtomicTask):
         # Don't acquire lock: the timing of this state
         # change is not critical
         self._state = T_RUNNING
+        if trace.ACTIVE:
+            trace.task_running(self, trace.APP_THREAD)
 
 
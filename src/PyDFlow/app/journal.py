@@ -0,0 +1,322 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+A journal of the commands which produced app outputs, used to avoid 
+rerunning apps.
+
+For each bound output file, the journal records a signature of the 
+command line and redirections that produced it along with digests of 
+the contents of the app's input files, and the size and modification 
+time of the output when it was written.  Digests of files are also 
+recorded along with the size and modification time they were computed
+at, so a file only needs to be rehashed if it has changed.  The journal
+is an append-only log where later entries supersede earlier ones, which
+is compacted when it is loaded if most entries are superseded.
+
+There are two modes that use the journal:
+incremental: make-style.  An app task is not run if all of its outputs 
+    are bound to files which exist, are at least as new as all of the 
+    app's input files, and were produced by the same command from the
+    same input data.  Because downstream tasks compare against the
+    modification times of the files their inputs were produced in,
+    rerunning a script after changing some inputs only reruns the apps 
+    which depend on the changed files.
+skip: an app task is not run if the journal shows that the same command
+    was already run on the same input data and the outputs have not been
+    modified since.  File times of inputs are not compared, so this also
+    works if inputs were copied or touched, e.g. when restarting a long
+    workflow.
+In either mode outputs with no journal entry are assumed to be out of date
+and skipped apps have their outputs filled with the existing files.
+
+Only apps whose outputs are all bound to files can be skipped.  Apps 
+writing to temporary files, such as the intermediate stages of a 
+pipeline, are always rerun because the temporary files get new paths on 
+every run and are deleted afterwards.  The apps reading those files are 
+then rerun too, since their command lines name the new paths.  Bind 
+intermediate outputs to files to make them skippable.
+
+@author: Tim Armstrong
+'''
+from __future__ import with_statement
+import os
+import errno
+import threading
+import logging
+import hashlib
+
+# Whether to skip apps with outputs newer than their inputs
+INCREMENTAL = False
+# Whether to skip apps whose command was already run
+SKIP = False
+# File to record commands in.  By default it is kept in the directory the
+# script was started from, so that separate projects have separate journals
+JOURNAL_PATH = os.path.abspath(os.path.join(".pydflow", "app_journal"))
+
+# Entry types in journal
+OUTPUT = 'O'
+DIGEST = 'D'
+
+HASH_BLOCK = 1024 * 1024
+
+structure_lock = threading.Lock()
+# Loaded from journal on first use and protected by structure_lock
+# output path -> (signature, size, mtime) of command that last wrote it
+output_entries = None
+# file path -> (digest, size, mtime) of file contents
+digest_entries = None
+
+skipped = 0
+recorded = 0
+hashed = 0
+
+def enabled():
+    return INCREMENTAL or SKIP
+
+def configure(incremental=None, skip=None, journal_path=None):
+    """
+    Turn incremental or skip mode on or off and set the journal file 
+    location.
+    """
+    global INCREMENTAL, SKIP, JOURNAL_PATH, output_entries, digest_entries
+    with structure_lock:
+        if incremental is not None:
+            INCREMENTAL = incremental
+        if skip is not None:
+            SKIP = skip
+        if journal_path is not None:
+            JOURNAL_PATH = journal_path
+            # Reload from new location
+            output_entries = digest_entries = None
+
+def stats():
+    """
+    Return a dictionary with counts of apps skipped because their
+    outputs were up to date, of outputs recorded in the journal and 
+    of files hashed.
+    """
+    with structure_lock:
+        return {'skipped': skipped, 'recorded': recorded, 'hashed': hashed}
+
+def ensure_loaded():
+    """
+    Read the journal.  Must hold structure_lock.
+    """
+    global output_entries, digest_entries
+    if output_entries is not None:
+        return
+    output_entries = {}
+    digest_entries = {}
+    try:
+        f = open(JOURNAL_PATH, 'r')
+    except IOError, e:
+        if e.errno != errno.ENOENT:
+            logging.warning("Could not read app journal %s: %s" %
+                            (JOURNAL_PATH, str(e)))
+        return
+    lines = 0
+    try:
+        for line in f:
+            lines += 1
+            # Ignore any line truncated by a crash
+            if not line.endswith('\n'):
+                continue
+            fields = line[:-1].split('\t', 4)
+            if len(fields) != 5:
+                continue
+            kind, hash, size, mtime, path = fields
+            try:
+                entry = (hash, int(size), float(mtime))
+            except ValueError:
+                continue
+            if kind == OUTPUT:
+                output_entries[path] = entry
+            elif kind == DIGEST:
+                digest_entries[path] = entry
+    finally:
+        f.close()
+    logging.debug("Loaded %d outputs and %d digests from app journal %s" %
+                  (len(output_entries), len(digest_entries), JOURNAL_PATH))
+    if lines > 2 * (len(output_entries) + len(digest_entries)) + 100:
+        compact()
+
+def compact():
+    """
+    Rewrite the journal with only the latest entry for each file, so 
+    that it doesn't keep growing as files are rewritten and rehashed.  
+    The new journal replaces the old one atomically.  Must hold 
+    structure_lock.
+    """
+    tmp_path = JOURNAL_PATH + ".tmp"
+    try:
+        f = open(tmp_path, 'w')
+        try:
+            for kind, entries in ((OUTPUT, output_entries), 
+                                  (DIGEST, digest_entries)):
+                for path, entry in entries.iteritems():
+                    f.write(entry_line(kind, path, entry))
+        finally:
+            f.close()
+        os.rename(tmp_path, JOURNAL_PATH)
+    except (IOError, OSError), e:
+        logging.warning("Could not compact app journal %s: %s" %
+                        (JOURNAL_PATH, str(e)))
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def append(lines):
+    """
+    Append lines to the journal file.  Must hold structure_lock.
+    """
+    if not lines:
+        return
+    try:
+        dir = os.path.dirname(JOURNAL_PATH)
+        if not os.path.isdir(dir):
+            os.makedirs(dir)
+        f = open(JOURNAL_PATH, 'a')
+        try:
+            f.write(''.join(lines))
+        finally:
+            f.close()
+    except (IOError, OSError), e:
+        logging.warning("Could not write to app journal %s: %s" %
+                        (JOURNAL_PATH, str(e)))
+
+def entry_line(kind, path, entry):
+    # repr keeps full precision of float
+    hash, size, mtime = entry
+    return "%s\t%s\t%d\t%r\t%s\n" % (kind, hash, size, mtime, path)
+
+def file_digest(path):
+    """
+    Digest of file contents.  Uses digest in journal if the file's size
+    and modification time haven't changed since it was computed.
+    Raises OSError or IOError if file can't be read.
+    """
+    global hashed
+    st = os.stat(path)
+    with structure_lock:
+        ensure_loaded()
+        entry = digest_entries.get(path)
+    if entry is not None and entry[1:] == (st.st_size, st.st_mtime):
+        return entry[0]
+    h = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        while True:
+            block = f.read(HASH_BLOCK)
+            if not block:
+                break
+            h.update(block)
+    finally:
+        f.close()
+    digest = h.hexdigest()
+    with structure_lock:
+        hashed += 1
+        entry = (digest, st.st_size, st.st_mtime)
+        digest_entries[path] = entry
+        append([entry_line(DIGEST, path, entry)])
+    return digest
+
+def signature(command, inputs):
+    """
+    command is a (args, stdin, stdout, stderr) tuple as returned by
+    AppTask._prepare_command, inputs is a list of input file paths.
+    Raises OSError or IOError if an input can't be read.
+    """
+    h = hashlib.sha1(repr(command))
+    for p in inputs:
+        h.update(file_digest(p))
+    return h.hexdigest()
+
+def output_paths(task):
+    """
+    Paths of the task's output files, or None if any of them isn't a
+    bound file.  Must hold graph_mutex.
+    """
+    from flowgraph import FileIvar
+    paths = []
+    for o in task._outputs:
+        if (not isinstance(o, FileIvar) or o._temp_created
+                or not isinstance(o._bound, basestring)):
+            return None
+        paths.append(o._bound)
+    return paths
+
+def input_paths(task):
+    """
+    Paths of the task's input files.  Must hold graph_mutex.
+    """
+    from flowgraph import FileIvar
+    return [inp._bound for spec, inp in task._input_iter()
+            if not spec.isRaw() and isinstance(inp, FileIvar)
+            and isinstance(inp._bound, basestring)]
+
+def up_to_date(outputs, inputs, command):
+    """
+    Check whether the app which would write the output files by running 
+    command can be skipped in the current mode.
+    """
+    global skipped
+    if not outputs:
+        return False
+    try:
+        output_stats = [os.stat(p) for p in outputs]
+        if not SKIP:
+            oldest_output = min([st.st_mtime for st in output_stats])
+            for p in inputs:
+                if os.stat(p).st_mtime > oldest_output:
+                    return False
+        sig = signature(command, inputs)
+    except (OSError, IOError):
+        # Some file missing
+        return False
+    with structure_lock:
+        ensure_loaded()
+        for p, st in zip(outputs, output_stats):
+            entry = output_entries.get(p)
+            if entry is None or entry[0] != sig:
+                return False
+            if SKIP and entry[1:] != (st.st_size, st.st_mtime):
+                # Modified since written
+                return False
+        skipped += 1
+    return True
+
+def record(outputs, inputs, command):
+    """
+    Record that the command produced the output files from the inputs.
+    """
+    global recorded
+    try:
+        sig = signature(command, inputs)
+        output_stats = [os.stat(p) for p in outputs]
+    except (OSError, IOError), e:
+        logging.warning("Could not record outputs %s in app journal: %s" %
+                        (repr(outputs), str(e)))
+        return
+    with structure_lock:
+        ensure_loaded()
+        lines = []
+        for p, st in zip(outputs, output_stats):
+            entry = (sig, st.st_size, st.st_mtime)
+            if output_entries.get(p) != entry:
+                output_entries[p] = entry
+                lines.append(entry_line(OUTPUT, p, entry))
+        recorded += len(lines)
+        append(lines)
@@ -0,0 +1,194 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Ways of starting app processes.
+
+popen: fork this process and exec the app with subprocess.Popen.  Forking
+    gets slower as the heap of this process grows, and close_fds has
+    to close every possible file descriptor in the child.
+helper: hand the command to a small helper process (see spawn_helper.py)
+    which is started once and forks and execs the app itself, then
+    reports back when it exits.  Apps launched this way have stdin
+    redirected from /dev/null if it isn't redirected to a file.
+
+Each launcher's spawn function takes the command line and the paths to
+redirect stdin, stdout and stderr to (or None) and returns an object with
+a pid and a wait() method that returns the exit code.  If the app can't
+be started, OSError is raised, or IOError if a redirect file couldn't be
+opened.
+
+@author: Tim Armstrong
+'''
+from __future__ import with_statement
+import os
+import sys
+import socket
+import subprocess
+import threading
+import itertools
+import logging
+
+import spawn_helper
+
+LAUNCH_POPEN = 'popen'
+LAUNCH_HELPER = 'helper'
+LAUNCHERS = (LAUNCH_POPEN, LAUNCH_HELPER)
+
+HELPER_SCRIPT = os.path.splitext(spawn_helper.__file__)[0] + '.py'
+
+def openFile(fp, mode):
+    if fp:
+        return open(fp, mode)
+    else:
+        return None
+
+def popen_spawn(cmd_args, stdin_file, stdout_file, stderr_file):
+    stdin = stdout = stderr = None
+    try:
+        # Open the file if the path is not None
+        stdin=openFile(stdin_file, 'r')
+        stdout=openFile(stdout_file, 'w')
+        stderr=openFile(stderr_file, 'w')
+        return subprocess.Popen(cmd_args,
+                stdin = stdin, stdout = stdout,
+                stderr = stderr,
+                close_fds=True # don't inherit any open files this
+                               # process may have. TODO: might not
+                               # work on windows
+                )
+    finally:
+        # Don't need just-opened file descriptors in this process now
+        for f in (stdin, stderr, stdout):
+            if f is not None:
+                f.close()
+
+class HelperProcess(object):
+    """
+    Handle for an app launched by the spawn helper.
+    """
+    def __init__(self, id):
+        self.id = id
+        self.pid = None
+        self.returncode = None
+        self.error = None
+        self.started = threading.Event()
+        self.exited = threading.Event()
+
+    def wait(self):
+        self.exited.wait()
+        return self.returncode
+
+class SpawnHelper(object):
+    """
+    Connection to a spawn helper process
+    """
+    def __init__(self):
+        parent_sock, child_sock = socket.socketpair()
+        try:
+            self.process = subprocess.Popen([sys.executable, HELPER_SCRIPT],
+                                            stdin=child_sock.fileno(),
+                                            close_fds=True)
+        finally:
+            child_sock.close()
+        self.sock = parent_sock
+        self.fd = parent_sock.fileno()
+        spawn_helper.set_cloexec(self.fd)
+        self.write_lock = threading.Lock()
+        # Apps started or starting: id -> HelperProcess.  Protected
+        # by write_lock
+        self.handles = {}
+        self.ids = itertools.count()
+        self.last_env = None
+        self.alive = True
+        self.reader = threading.Thread(target=self.read_replies)
+        self.reader.setDaemon(True)
+        self.reader.start()
+        logging.debug("Started app spawn helper process %d" % self.process.pid)
+
+    def spawn(self, cmd_args, stdin_file, stdout_file, stderr_file):
+        with self.write_lock:
+            if not self.alive:
+                raise OSError("App spawn helper process died")
+            h = HelperProcess(self.ids.next())
+            self.handles[h.id] = h
+            env = dict(os.environ)
+            if env == self.last_env:
+                env = None
+            else:
+                self.last_env = env
+            spawn_helper.write_message(self.fd, ('spawn', h.id,
+                        list(cmd_args), stdin_file, stdout_file, stderr_file,
+                        os.getcwd(), env))
+        h.started.wait()
+        if h.error is not None:
+            err, strerror, filename = h.error
+            if filename is not None:
+                raise IOError(err, strerror, filename)
+            else:
+                raise OSError(err, strerror)
+        return h
+
+    def read_replies(self):
+        try:
+            while True:
+                msg = spawn_helper.read_message(self.fd)
+                if msg is None:
+                    break
+                kind, id = msg[0], msg[1]
+                with self.write_lock:
+                    if kind == 'started':
+                        h = self.handles[id]
+                    else:
+                        h = self.handles.pop(id)
+                if kind == 'started':
+                    h.pid = msg[2]
+                    h.started.set()
+                elif kind == 'error':
+                    h.error = msg[2:]
+                    h.started.set()
+                elif kind == 'exit':
+                    h.returncode = msg[2]
+                    h.exited.set()
+        except Exception, e:
+            logging.error("Error reading from app spawn helper: %s" % repr(e))
+        logging.error("App spawn helper process exited")
+        # Fail anything still waiting
+        with self.write_lock:
+            self.alive = False
+            handles = self.handles.values()
+            self.handles = {}
+        for h in handles:
+            if not h.started.isSet():
+                h.error = (None, "App spawn helper process died", None)
+                h.started.set()
+            h.returncode = -1
+            h.exited.set()
+
+# Spawn helper, started when first needed
+helper = None
+helper_lock = threading.Lock()
+
+def helper_spawn(cmd_args, stdin_file, stdout_file, stderr_file):
+    global helper
+    with helper_lock:
+        if helper is None or not helper.alive:
+            helper = SpawnHelper()
+        h = helper
+    return h.spawn(cmd_args, stdin_file, stdout_file, stderr_file)
+
+spawners = {LAUNCH_POPEN: popen_spawn, LAUNCH_HELPER: helper_spawn}
+
+def spawn(launcher, cmd_args, stdin_file, stdout_file, stderr_file):
+    return spawners[launcher](cmd_args, stdin_file, stdout_file, stderr_file)
@@ -1,11 +1,11 @@
 # Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
-# 
+#
 # Licensed under the Apache License, Version 2.0 (the "License");
 # you may not use this file except in compliance with the License.
 # You may obtain a copy of the License at
-# 
+#
 # http://www.apache.org/licenses/LICENSE-2.0
-# 
+#
 # Unless required by applicable law or agreed to in writing, software
 # distributed under the License is distributed on an "AS IS" BASIS,
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
@@ -16,56 +16,276 @@
 Manage locations where we will search for app executables.
 
 This module does not try to use the os's built in path mechanism, that is up to the
-executor to decide if it wants to do that.  
+executor to decide if it wants to do that.
 
-TODO: only support local execution, want to extend with something like Swift's tc.data
-mechanism.
+Results of searching the app paths are cached, including failures to find
+an executable, until the paths are changed.  If REVALIDATE is set, cached
+results are checked against the file system each time: found executables
+must still exist and for executables that weren't found, none of the
+search directories can have been modified.  The cache can also be saved
+to a file so that the paths needn't be searched again next run.  Found
+executables loaded from the file are checked once before use.
+
+There is also a catalog of apps, similar to Swift's tc.data, which maps
+the names apps are called by to the executable to run and optionally a
+site-specific wrapper command, e.g. to run the app under a job launcher.
+The catalog file has one app per line with the fields:
+    site  name  path  [wrapper command ...]
+Lines starting with # are comments.  Only entries whose site is SITE or
+* are used.
 
 TODO: it is worth thinking about just using the OS's resolution mechanism and manipulating the
 PATH environment variable, but this is a bit ugly.
 @author: Tim Armstrong
 """
+from __future__ import with_statement
 from PyDFlow.util.args import is_iterable
+import os
 import os.path
+import threading
+import tempfile
+import cPickle
+import logging
 
 paths = [""]
+
+# Check cached lookups against file system before using them
+REVALIDATE = False
+# File to save cache in, or None
+CACHE_FILE = None
+# Site to use catalog entries for
+SITE = "localhost"
+
+# Protects all of the below
+cache_lock = threading.Lock()
+# exec_name -> (path, validation info).  Path is None if not found.
+# For found executables, validation info is True, or None if loaded 
+# from the cache file and not checked yet.  For executables not found,
+# it is the modification times of the search directories if REVALIDATE
+# was set
 cache = {}
+# Whether cache file was loaded
+cache_loaded = False
+# Working directory which relative paths were searched from
+cache_cwd = None
+# name -> (path, wrapper args) of catalog entries
+catalog = {}
+
+hits = 0
+misses = 0
+
+def configure(revalidate=None, cache_file=None):
+    """
+    Set whether cached results are revalidated, and the file that
+    the cache is saved in.
+    """
+    global REVALIDATE, CACHE_FILE, cache_loaded
+    with cache_lock:
+        if revalidate is not None:
+            REVALIDATE = revalidate
+        if cache_file is not None:
+            CACHE_FILE = cache_file
+            cache_loaded = False
+
+def stats():
+    """
+    Return a dictionary with counts of cache hits and misses.
+    """
+    with cache_lock:
+        return {'hits': hits, 'misses': misses}
+
+def dir_times():
+    """
+    Modification times of the search directories, which change if
+    files are added to or removed from them.
+    """
+    res = []
+    for p in paths:
+        try:
+            res.append(os.stat(p or os.curdir).st_mtime)
+        except OSError:
+            res.append(None)
+    return tuple(res)
+
+def search(exec_name):
+    for p in paths:
+        f = os.path.join(p, exec_name)
+        if os.path.exists(f):
+            return f
+    return None
+
+def load_cache():
+    """
+    Load saved cache entries if they were saved with the same paths.
+    Must hold cache_lock.
+    """
+    global cache_loaded
+    cache_loaded = True
+    try:
+        f = open(CACHE_FILE, 'rb')
+        try:
+            saved_paths, saved_cwd, entries = cPickle.load(f)
+        finally:
+            f.close()
+    except IOError:
+        return
+    except Exception, e:
+        logging.warning("Could not load app path cache from %s: %s" %
+                        (CACHE_FILE, repr(e)))
+        return
+    if saved_paths != paths or saved_cwd != cache_cwd:
+        logging.debug("App paths changed since path cache %s was saved"
+                      % CACHE_FILE)
+        return
+    for name, path in entries.iteritems():
+        # Don't override anything already looked up
+        if name not in cache:
+            cache[name] = (path, None)
+
+def save_cache():
+    """
+    Save found executables to cache file.  Must hold cache_lock.
+    """
+    entries = dict([(name, entry[0]) for name, entry in cache.iteritems()
+                    if entry[0] is not None])
+    try:
+        dir = os.path.dirname(os.path.abspath(CACHE_FILE))
+        handle, tmp = tempfile.mkstemp(dir=dir)
+        f = os.fdopen(handle, 'wb')
+        try:
+            cPickle.dump((paths, cache_cwd, entries), f, 2)
+        finally:
+            f.close()
+        os.rename(tmp, CACHE_FILE)
+    except (IOError, OSError), e:
+        logging.warning("Could not save app path cache to %s: %s" %
+                        (CACHE_FILE, repr(e)))
 
 def lookup(exec_name):
-    res = cache.get(exec_name, None)
-    if res is None:
-        for p in paths:
-            f = os.path.join(p, exec_name)
-            if os.path.exists(f):
-                return f
-    else:
-        return res
-    return None 
+    """
+    Find the executable for an app in the catalog or the app paths.
+    Returns None if it wasn't found.
+    """
+    global hits, misses, cache_cwd
+    with cache_lock:
+        entry = catalog.get(exec_name)
+        if entry is not None:
+            return entry[0]
+        if not all([os.path.isabs(p) for p in paths]):
+            # Relative paths are searched from working directory
+            cwd = os.getcwd()
+            if cwd != cache_cwd:
+                cache.clear()
+                cache_cwd = cwd
+        if CACHE_FILE is not None and not cache_loaded:
+            load_cache()
+        entry = cache.get(exec_name)
+        if entry is not None:
+            path, valid = entry
+            if path is not None:
+                if valid is None or REVALIDATE:
+                    # Still there?
+                    if os.path.exists(path):
+                        cache[exec_name] = (path, True)
+                        hits += 1
+                        return path
+                else:
+                    hits += 1
+                    return path
+            elif not REVALIDATE or valid == dir_times():
+                hits += 1
+                return None
+        misses += 1
+        times = None
+        if REVALIDATE:
+            times = dir_times()
+        path = search(exec_name)
+        if path is None:
+            cache[exec_name] = (None, times)
+        else:
+            cache[exec_name] = (path, True)
+            if CACHE_FILE is not None:
+                save_cache()
+        return path
+
+def resolve(cmd_args):
+    """
+    Work out the command line to run for an app.  If the app is in the
+    catalog, this is its wrapper command and executable, otherwise the
+    executable found in the app paths.  If the app isn't found anywhere,
+    the command line is returned unchanged so that the OS's resolution
+    mechanism can be used.
+    """
+    name = cmd_args[0]
+    with cache_lock:
+        entry = catalog.get(name)
+    if entry is not None:
+        path, wrapper = entry
+        return wrapper + [path] + list(cmd_args[1:])
+    exc = lookup(name)
+    if exc is not None:
+        return [exc] + list(cmd_args[1:])
+    return cmd_args
+
+def add_app(name, path, wrapper=None):
+    """
+    Add an app to the catalog.  When an app called name is run, path is
+    executed, run under the wrapper command if one is given.
+    E.g. add_app("mProject", "/opt/montage/bin/mProject", ["nice", "-n5"])
+    """
+    if wrapper is None:
+        wrapper = []
+    elif not is_iterable(wrapper):
+        raise TypeError("Wrapper command for app must be iterable")
+    with cache_lock:
+        catalog[name] = (path, list(wrapper))
+
+def load_catalog(filename):
+    """
+    Add the apps for this site from a catalog file to the catalog.
+    """
+    f = open(filename, 'r')
+    try:
+        for lineno, line in enumerate(f):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split()
+            if len(fields) < 3:
+                raise ValueError("%s line %d: expected site, name and path"
+                                 % (filename, lineno + 1))
+            site, name, path = fields[:3]
+            if site in (SITE, '*'):
+                add_app(name, path, fields[3:])
+    finally:
+        f.close()
+
+def clear_cache():
+    global cache_loaded
+    with cache_lock:
+        cache.clear()
+        # Entries in file are used if they match the new paths
+        cache_loaded = False
 
 def set_paths(new_paths):
     """
     Override the existing app path settings.
     """
-    global cache
-    cache = {}
     if is_iterable(new_paths):
         global paths
-        paths = new_paths
+        paths = list(new_paths)
     else:
         raise TypeError("Argument to set_app_paths must be iterable")
+    clear_cache()
 
 def add_path(path, top=True):
     """
     Add a new location to the app paths.
-    if top is true, the new path will be given the 
+    if top is true, the new path will be given the
     highest priority and therefore betried before all the
-    existing paths. Otherwise, it will be given the 
+    existing paths. Otherwise, it will be given the
     lowest priority
     """
-    if top:
-        # only need to flush cache if higher priority than existing
-        global cache
-        cache = {}
     global paths
     if is_iterable(path):
         if top:
@@ -77,4 +297,11 @@ def add_path(path, top=True):
             paths.insert(0, path)
         else:
             paths.append(path)
-
+    if top:
+        clear_cache()
+    else:
+        # Only executables that weren't found before could be affected
+        with cache_lock:
+            for name, entry in cache.items():
+                if entry[0] is None:
+                    del cache[name]
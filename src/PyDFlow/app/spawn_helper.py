@@ -0,0 +1,186 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Helper process which launches apps on behalf of PyDFlow.
+
+Forking a process costs time in proportion to the size of the parent,
+so rather than forking the PyDFlow process, which may have a large heap,
+for every app, this small process is started once and launches
+the apps for it.  It is run as a script so that it doesn't import any of
+PyDFlow.
+
+The PyDFlow process talks to the helper over a unix socket which is
+passed in as stdin.  Each message is a marshalled tuple preceded by its
+length.  Requests are:
+    ('spawn', id, args, stdin, stdout, stderr, cwd, env)
+where stdin, stdout and stderr are file paths or None and env is None
+if unchanged since the last request.  Replies are:
+    ('started', id, pid)
+    ('error', id, errno, strerror, filename)
+    ('exit', id, exit code)
+Exit codes are negative signal numbers if the app was killed by a signal,
+like with subprocess.
+
+@author: Tim Armstrong
+'''
+from __future__ import with_statement
+import os
+import errno
+import fcntl
+import marshal
+import struct
+import subprocess
+import threading
+
+HEADER = struct.Struct('!I')
+
+def set_cloexec(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+def read_exact(fd, n):
+    """
+    Read n bytes from fd.  Returns None at end of file.
+    """
+    chunks = []
+    while n > 0:
+        try:
+            data = os.read(fd, n)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if not data:
+            return None
+        chunks.append(data)
+        n -= len(data)
+    return ''.join(chunks)
+
+def read_message(fd):
+    header = read_exact(fd, HEADER.size)
+    if header is None:
+        return None
+    data = read_exact(fd, HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return marshal.loads(data)
+
+def write_message(fd, msg):
+    data = marshal.dumps(msg)
+    data = HEADER.pack(len(data)) + data
+    while data:
+        try:
+            n = os.write(fd, data)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        data = data[n:]
+
+def open_redirect(path, mode):
+    if path is None:
+        return None
+    return open(path, mode)
+
+class Helper(object):
+    def __init__(self, sock_fd):
+        self.sock_fd = sock_fd
+        self.write_lock = threading.Lock()
+        # Running children: pid -> request id.  Launching and registering
+        # a child is done holding this so the reaper can't miss it
+        self.children = {}
+        self.children_cond = threading.Condition()
+        self.env = None
+
+    def send(self, msg):
+        with self.write_lock:
+            write_message(self.sock_fd, msg)
+
+    def spawn(self, id, args, stdin, stdout, stderr, cwd, env):
+        if env is not None:
+            self.env = env
+        files = []
+        try:
+            try:
+                for path, mode in ((stdin, 'r'), (stdout, 'w'),
+                                   (stderr, 'w')):
+                    files.append(open_redirect(path, mode))
+                with self.children_cond:
+                    # The only fds open in this process are the socket,
+                    # which is close-on-exec, and the redirect files, so
+                    # we don't need to pay for close_fds
+                    p = subprocess.Popen(args, stdin=files[0],
+                                stdout=files[1], stderr=files[2],
+                                cwd=cwd, env=self.env, close_fds=False)
+                    # Reaped by reaper thread, not by Popen object
+                    p.returncode = 0
+                    self.children[p.pid] = id
+                    self.children_cond.notify()
+                    # Must be sent before reaper can report exit
+                    self.send(('started', id, p.pid))
+            finally:
+                for f in files:
+                    if f is not None:
+                        f.close()
+        except (OSError, IOError), e:
+            self.send(('error', id, e.errno, e.strerror,
+                       getattr(e, 'filename', None)))
+
+    def reap(self):
+        while True:
+            with self.children_cond:
+                while not self.children:
+                    self.children_cond.wait()
+            try:
+                pid, status = os.wait()
+            except OSError, e:
+                if e.errno in (errno.EINTR, errno.ECHILD):
+                    continue
+                raise
+            with self.children_cond:
+                id = self.children.pop(pid, None)
+            if id is None:
+                # Popen already reported it failed to run
+                continue
+            if os.WIFSIGNALED(status):
+                code = -os.WTERMSIG(status)
+            else:
+                code = os.WEXITSTATUS(status)
+            self.send(('exit', id, code))
+
+    def run(self):
+        reaper = threading.Thread(target=self.reap)
+        reaper.setDaemon(True)
+        reaper.start()
+        while True:
+            msg = read_message(self.sock_fd)
+            if msg is None:
+                # PyDFlow process went away.  Leave apps to finish.
+                return
+            if msg[0] == 'spawn':
+                self.spawn(*msg[1:])
+
+def main():
+    # Move socket off stdin so it isn't inherited by apps, which get
+    # /dev/null as stdin if it isn't redirected
+    sock_fd = os.dup(0)
+    set_cloexec(sock_fd)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    Helper(sock_fd).run()
+
+if __name__ == "__main__":
+    main()
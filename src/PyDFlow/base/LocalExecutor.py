@@ -25,8 +25,14 @@ at some point, a task should be executed.
 Each thread has a deque of tasks to execute which it uses as a stack. 
 Threads steal work from each other's deques. 
 
+Threads which cannot find any work park themselves until another thread
+adds work, at which point exactly one parked thread is woken per
+item of work.
+
+The number of threads can be fixed, or can be adapted to the amount
+of work queued: see configure().
+
 TODO:
-* Smarter thread pool - configurable/adaptive # of workers
 * Convert as much code as possible to C
 
 @author: Tim Armstrong
@@ -34,10 +40,16 @@ TODO:
 import threading
 import Queue
 import logging
+import time
 from collections import deque 
 from PyDFlow.writeonce import WriteOnceVar
 from PyDFlow.base.states import *
 from PyDFlow.base.mutex import graph_mutex
+import checkpoint
+import trace
+import logflags
+import metrics
+import priority
  
 import random
 from PyDFlow.base.exceptions import NoDataException
@@ -46,10 +58,6 @@ from PyDFlow.base.exceptions import NoDataException
 #==============================================#
 # INPUT QUEUE
 #==============================================#
-# Maximum time to wait before trying to steal work
-#QUEUE_TIMEOUT = 0.02
-QUEUE_TIMEOUT = 0.05
-
 # Work first arrives in this queue from other threads
 in_queue = None
 
@@ -64,34 +72,200 @@ resume_queue = None
 
 PYFUN_THREAD_NAME = "pyfun_thread"
 
+# Number of threads started when the pool is initialised, and the
+# fixed size of the pool unless adaptive sizing is enabled.
 #NUM_THREADS = 8
 NUM_THREADS = 1
 
+# Adaptive pool sizing: the pool is kept between MIN_THREADS and
+# MAX_THREADS workers.  A worker is added when the number of frames
+# queued exceeds GROW_BACKLOG per worker, and a worker retires
+# when it has found no work for IDLE_RETIRE_TIME seconds.
+ADAPTIVE = False
+MIN_THREADS = 1
+MAX_THREADS = NUM_THREADS
+# Limits passed to configure(), or None to use the defaults
+MIN_WORKERS = None
+MAX_WORKERS = None
+GROW_BACKLOG = 2
+IDLE_RETIRE_TIME = 1.0
+
+# The workers and their deques.  These lists are replaced rather than
+# modified in place when the pool is resized so that other threads can
+# safely iterate over them without holding pool_lock.
 workers = []
 
 # These deques store the work remaining to be done
-work_deques = None
+work_deques = []
 ReturnMarker = object()
 
+# Protects resizing of the pool
+pool_lock = threading.Lock()
+next_worker_num = 0
+# Largest the pool has been since configure() was last called
+peak_pool_size = 0
+# Statistics of workers that were removed from the pool, so that totals
+# over all workers never go down.  Protected by pool_lock
+WORKER_STATS = ('steal_attempts', 'steals', 'mutex_contended', 'mutex_wait')
+retired_stats = dict([(attr, 0) for attr in WORKER_STATS])
+
 # Use these variables to gracefully let threads go idle
-# without them missing out on workstealing opportunities
-# The number of workers which were unsuccessful in finding work
-# recently
+# without them missing out on workstealing opportunities.
+# Workers which were unsuccessful in finding work wait on their own
+# wakeup event after adding themselves to parked_workers.  Any thread 
+# which adds work to a queue or deque wakes up one parked worker.
+# Work is only added to the queues with idle_lock held. 
+idle_lock = threading.Lock()
+parked_workers = []
+# The number of parked workers
 idle_worker_count = 0
-idle_worker_cvar = threading.Condition() 
+
+def cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
 
 def init():
-    global in_queue, resume_queue, workers, work_deques
+    global in_queue, resume_queue
+    logflags.refresh()
     logging.debug("Initialising thread pool")
     in_queue = Queue.Queue()
     resume_queue = Queue.Queue()
+    with pool_lock:
+        for i in range(NUM_THREADS):
+            add_worker()
+
+def add_worker():
+    """
+    Start a new worker thread.  pool_lock should be held.
+    """
+    global workers, work_deques, next_worker_num, peak_pool_size
     #TODO: this may not be a good memory layout, likely
     # to cause cache conflict
-    work_deques = [deque() for i in range(NUM_THREADS)]
-    for i in range(NUM_THREADS):
-        t = WorkerThread(in_queue, resume_queue, i, work_deques[i])
-        workers.append(t)
-        t.start()
+    work_deque = deque()
+    t = WorkerThread(in_queue, resume_queue, next_worker_num, work_deque)
+    next_worker_num += 1
+    work_deques = work_deques + [work_deque]
+    workers = workers + [t]
+    peak_pool_size = max(peak_pool_size, len(workers))
+    logging.debug("Added worker %s, %d workers in pool" % (t.getName(), 
+                                                           len(workers)))
+    t.start()
+
+def remove_worker(worker):
+    """
+    Remove a worker from the pool.  It is up to the worker to exit once it is
+    removed.  pool_lock should be held. 
+    """
+    global workers, work_deques
+    workers = [w for w in workers if w is not worker]
+    work_deques = [d for d in work_deques if d is not worker.deque]
+    for attr in WORKER_STATS:
+        retired_stats[attr] += getattr(worker, attr)
+    logging.debug("Removed worker %s, %d workers in pool" % (worker.getName(),
+                                                             len(workers)))
+
+def pool_size():
+    return len(workers)
+
+def maybe_grow():
+    """
+    Add a worker if the pool is below its minimum size, or if the
+    backlog of queued work is too large.
+    idle_lock should be held.
+    """
+    nworkers = len(workers)
+    if nworkers >= MAX_THREADS:
+        return
+    if nworkers < MIN_THREADS or (ADAPTIVE and 
+            in_queue.qsize() + resume_queue.qsize() > GROW_BACKLOG * nworkers):
+        with pool_lock:
+            if len(workers) < MAX_THREADS:
+                add_worker()
+
+def should_retire(idle_time):
+    """
+    Check if a worker which has not found work for idle_time seconds
+    should leave the pool.  pool_lock should be held.
+    """
+    nworkers = len(workers)
+    if nworkers > MAX_THREADS:
+        return True
+    return ADAPTIVE and nworkers > MIN_THREADS and idle_time >= IDLE_RETIRE_TIME
+
+def configure(workers=None, adaptive=None, min_workers=None, max_workers=None):
+    """
+    Set the number of worker threads.  This can be called before or after
+    the pool starts running, in which case the pool is resized. 
+    
+    workers: the number of threads to start with.  If not adaptive,
+            the pool will be fixed at this size
+    adaptive: if True, the number of threads varies between min_workers
+            and max_workers depending on the backlog of work
+    min_workers: minimum size of an adaptive pool (default 1)
+    max_workers: maximum size of an adaptive pool (default: cpu count or
+            workers if larger)
+    min_workers and max_workers are kept until they are passed again.
+    Passing 0 for either goes back to the default.  Raises ValueError
+    if the limits are inconsistent, in which case nothing is changed.
+    """
+    global NUM_THREADS, ADAPTIVE, MIN_THREADS, MAX_THREADS
+    global MIN_WORKERS, MAX_WORKERS, peak_pool_size
+    if workers is not None and workers < 1:
+        raise ValueError("Must have at least one worker thread")
+    for name, val in (('min_workers', min_workers), 
+                      ('max_workers', max_workers)):
+        if val is not None and val < 0:
+            raise ValueError("%s must be at least 1, or 0 for the default, "
+                             "not %d" % (name, val))
+    new_adaptive, new_threads = ADAPTIVE, NUM_THREADS
+    new_min, new_max = MIN_WORKERS, MAX_WORKERS
+    if adaptive is not None:
+        new_adaptive = adaptive
+    if workers is not None:
+        new_threads = workers
+    if min_workers is not None:
+        new_min = min_workers or None
+    if max_workers is not None:
+        new_max = max_workers or None
+    if new_adaptive:
+        min_threads = new_min or 1
+        if new_max is not None:
+            max_threads = new_max
+        else:
+            max_threads = max(cpu_count(), new_threads)
+        if min_threads > max_threads:
+            raise ValueError("min_workers %d is more than max_workers %d"
+                             % (min_threads, max_threads))
+        if workers is not None and not (min_threads <= workers <= max_threads):
+            raise ValueError("workers %d is not between min_workers %d and "
+                             "max_workers %d" % (workers, min_threads, 
+                                                 max_threads))
+        # Start size carried over from before may be outside new limits
+        new_threads = max(min_threads, min(new_threads, max_threads))
+    else:
+        min_threads = max_threads = new_threads
+
+    ADAPTIVE = new_adaptive
+    MIN_WORKERS, MAX_WORKERS = new_min, new_max
+    NUM_THREADS, MIN_THREADS, MAX_THREADS = (new_threads, min_threads, 
+                                             max_threads)
+    with pool_lock:
+        peak_pool_size = pool_size()
+    logging.debug("Thread pool configured: %d threads, adaptive=%s, min=%d, max=%d"
+                  % (NUM_THREADS, ADAPTIVE, MIN_THREADS, MAX_THREADS))
+    
+    if initFuture.isSet():
+        # Resize running pool: extra workers will retire once they
+        # are idle
+        with idle_lock:
+            with pool_lock:
+                while pool_size() < NUM_THREADS:
+                    add_worker()
+            while wake_worker():
+                pass
 
 # Use future to ensure init() run exactly once
 initFuture = WriteOnceVar(function=init)
@@ -101,13 +275,40 @@ def exec_async(ivar):
     Takes a ivar and fills it at some point in the future
     """
     # Ensure workers are initialized
-    logging.debug("Entered exec_async")
+    if logflags.DEBUG:
+        logging.debug("Entered exec_async")
     initFuture.get()
-    logging.debug("Added ivar to work queue")
-    with idle_worker_cvar:
+    if logflags.DEBUG:
+        logging.debug("Added ivar to work queue")
+    with idle_lock:
         in_queue.put(ivar)
-        idle_worker_cvar.notifyAll()
-    logging.debug("Exiting exec_async")
+        if not wake_worker():
+            maybe_grow()
+    if logflags.DEBUG:
+        logging.debug("Exiting exec_async")
+
+def wake_worker():
+    """
+    Wake up one parked worker, if there are any.  idle_lock should be held.
+    Returns True if a worker was woken.
+    """
+    global idle_worker_count
+    if len(parked_workers) == 0:
+        return False
+    # Most recently parked worker is likely to have the warmest cache
+    worker = parked_workers.pop()
+    idle_worker_count -= 1
+    worker.wakeup.set()
+    return True
+
+def work_added():
+    """
+    Notify parked workers that some work was added to a deque.
+    idle_lock should not be held.
+    """
+    if len(parked_workers) > 0:
+        with idle_lock:
+            wake_worker()
 
 def fail_task(task, continuation, exceptions):
     # assume holding lock
@@ -152,6 +353,12 @@ def makeframe(ivar, continuation):
         # If input ivar can't be read
         fail_ivar(ivar, [ex])
         return None
+    # Stored last-to-first so that finished dependencies can be popped
+    # off the end
+    deps.reverse()
+    if priority.ACTIVE:
+        # Search the longest chain first
+        deps.sort(key=priority.upstream)
     return (ivar, deps, continuation)
 
 class WorkerThread(threading.Thread):
@@ -166,8 +373,9 @@ class WorkerThread(threading.Thread):
         (ivar_that_needs_filling, dependency_list, continuation_list)
         ivar_that_needs_filling: a ivar object which has been suspended due to dependencies
         dependency_list: a list of input ivars which need to be filled in order to allow
-                    task to run to file the above ivar
-                    each entry is replaced by None when finished.
+                    task to run to file the above ivar, in reverse order.
+                    each entry is replaced by None or popped off the end 
+                    when finished.
         continuation_list: a sequence of tasks that can be run from last-to-first once
                 the ivar is filled
     """
@@ -180,16 +388,34 @@ class WorkerThread(threading.Thread):
         self.worker_num = worker_num
         self.setDaemon(True) # Ensure threads will exit with application
         self.last_steal = worker_num
-        self.idle = False
+        # Set when thread is woken up from parked state
+        self.wakeup = threading.Event()
+        # Time at which this thread last stopped finding work
+        self.idle_since = None
+        # Set once the thread has been removed from the pool
+        self.retired = False
+        # Where the frame being evaluated came from, for tracing
+        self.frame_source = None
+        # Statistics, only modified by this thread
+        self.steal_attempts = 0
+        self.steals = 0
+        self.mutex_contended = 0
+        self.mutex_wait = 0.0
     
     def run(self, recursive=False):
-        logging.debug("Thread %s starting up" % self.getName())
+        if logflags.DEBUG:
+            logging.debug("Thread %s starting up" % self.getName())
         while True:
-            logging.debug("Thread %s\n  Deque: %s" % (self.getName(), repr(self.deque)))
+            if logflags.DEBUG:
+                # Deque can hold frames with huge dependency lists
+                logging.debug("Thread %s\n  Deque: %s" % (self.getName(), 
+                                                          repr(self.deque)))
             
             # Try to run own work
+            self.frame_source = trace.SOURCE_DEQUE
             if self.run_from_deque():
-                logging.debug("%s ran from deque" % self.getName())
+                if logflags.DEBUG:
+                    logging.debug("%s ran from deque" % self.getName())
                 continue
             
             if recursive:
@@ -198,35 +424,46 @@ class WorkerThread(threading.Thread):
                 # work has either been finished or stolen 
                 return
             
-            logging.debug("%s try to resume" % self.getName())
+            if logflags.DEBUG:
+                logging.debug("%s try to resume" % self.getName())
             # Try to get a frame from the resume queue
-            frame = self.get_from_queue(self.resume_queue, random.random() > 0.5, QUEUE_TIMEOUT * random.random())
+            frame = self.get_from_queue(self.resume_queue)
             if frame is not None:
+                self.frame_source = trace.SOURCE_RESUME
                 self.eval_frame(frame)
-                logging.debug("%s ran from resume" % self.getName())
+                if logflags.DEBUG:
+                    logging.debug("%s ran from resume" % self.getName())
                 continue
             
-            logging.debug("%s try to run from new work queue" % self.getName())
-            # Try to get work from global queue (until timeout) 
-            iv = self.get_from_queue(self.in_queue, random.random() > 0.5, 
-                                        QUEUE_TIMEOUT * random.random())
+            if logflags.DEBUG:
+                logging.debug("%s try to run from new work queue" % self.getName())
+            # Try to get work from global queue
+            iv = self.get_from_queue(self.in_queue)
             
                 
             if iv is not None:
-                with graph_mutex:
+                self.lock_graph()
+                try:
                     frame = makeframe(iv, [])
+                finally:
+                    graph_mutex.release()
                 if frame is not None:
-                    logging.debug("%s running from new work queue" % self.getName())
+                    if logflags.DEBUG:
+                        logging.debug("%s running from new work queue" % self.getName())
+                    self.frame_source = trace.SOURCE_NEW
                     self.eval_frame(frame)
-                    logging.debug("%s ran from new work queue" % self.getName())
+                    if logflags.DEBUG:
+                        logging.debug("%s ran from new work queue" % self.getName())
                     continue
-            else:
+            elif logflags.DEBUG:
                 logging.debug("frame was none")
             
-            logging.debug("%s try to steal work" % self.getName())
+            if logflags.DEBUG:
+                logging.debug("%s try to steal work" % self.getName())
             # Try to steal work
             if self.steal_work():
-                logging.debug("%s stole work" % self.getName())
+                if logflags.DEBUG:
+                    logging.debug("%s stole work" % self.getName())
                 continue
             
             # If there was no work, see if we can establish consensus 
@@ -235,6 +472,10 @@ class WorkerThread(threading.Thread):
             frame = self.try_idle()
             if frame is not None:
                 self.eval_frame(frame)
+            elif self.retired:
+                if logflags.DEBUG:
+                    logging.debug("Thread %s exiting" % self.getName())
+                return
             
     def exec_task(self, frame):
         """
@@ -249,9 +490,13 @@ class WorkerThread(threading.Thread):
         task = iv._in_tasks[0]
         contstack = frame[2]
 
-        logging.debug("%s starting task %s" % (self.getName(), repr(task)))
-        logging.info("Queueing task %s " % task.name())
+        if logflags.DEBUG:
+            logging.debug("%s starting task %s" % (self.getName(), repr(task)))
+        if logflags.INFO:
+            logging.info("Queueing task %s " % task.name())
         assert(task._state == T_QUEUED)
+        if trace.ACTIVE:
+            trace.task_queued(task, self.frame_source)
         #TODO: what if continuation called before exception
         if task.isSynchronous():
             callback = lambda task, return_val: success_continuation(task, return_val, None)
@@ -266,10 +511,21 @@ class WorkerThread(threading.Thread):
                 return
             error = None
             if contstack is not None:
-                for nexttask in reversed(contstack):
+                for i in xrange(len(contstack) - 1, -1, -1):
+                    nexttask = contstack[i]
                     if error is None:
                         try:
-                            nexttask._exec(callback, failure_continuation)
+                            if trace.ACTIVE:
+                                trace.task_queued(nexttask, 
+                                                  trace.SOURCE_CONTINUATION)
+                            if nexttask.isSynchronous():
+                                nexttask._exec(callback, failure_continuation)
+                            else:
+                                # Hand off remainder of continuation to 
+                                # asynchronous task
+                                nexttask._exec(success_continuation, 
+                                        failure_continuation, contstack[:i])
+                                return
                         except Exception, e:
                             error = e
                     if error is not None:
@@ -282,6 +538,16 @@ class WorkerThread(threading.Thread):
                 with graph_mutex:
                     fail_task(task, contstack, [e])
             
+    def lock_graph(self):
+        """
+        Acquire graph_mutex, recording how long this thread waited for it
+        """
+        if not graph_mutex.acquire(False):
+            start = time.time()
+            graph_mutex.acquire()
+            self.mutex_wait += time.time() - start
+            self.mutex_contended += 1
+
     def run_from_deque(self):
         try:
             frame = self.deque.pop()
@@ -290,104 +556,153 @@ class WorkerThread(threading.Thread):
             self.eval_frame(frame)
             return True
         except IndexError:
-            logging.debug("Thread %s - nothing in Deque" % (self.getName()))
+            if logflags.DEBUG:
+                logging.debug("Thread %s - nothing in Deque" % (self.getName()))
             return False
         
     
-    def get_from_queue(self, queue, block, timeout):
+    def get_from_queue(self, queue):
         """
-        Trys to get some new work from the queue provided
-        Returns True if found, false otherwise
+        Trys to get some new work from the queue provided without blocking
+        Returns the item if found, None otherwise
         """
         try:
-            frame = queue.get(block, timeout)
+            frame = queue.get_nowait()
             
             queue.task_done()
             
-            logging.debug("%s got %s from queue" % (threading.currentThread().getName(),
-                                                    repr(frame)))
+            if logflags.DEBUG:
+                logging.debug("%s got %s from queue" % (threading.currentThread().getName(),
+                                                        repr(frame)))
             # Note: makeframe could have returned none if there was an error
             # processing the input... we just need to return None
             # to let error propagate 
             return frame
         except Queue.Empty:
-            logging.debug("Thread %s queue timeout" % (self.getName()))
+            if logflags.DEBUG:
+                logging.debug("Thread %s queue empty" % (self.getName()))
             return None
         
     def try_idle(self):
         """
-        Try to see if work is exhausted and threads can go idle.
-        The threads keep on polling until there is a consensus
-        that there is no work.
+        Park this thread until there is more work to do.  
+        The thread is added to parked_workers before checking for work
+        one last time, so a thread adding work concurrently will either
+        see that this thread is parked, or this thread will see the work.
+        Therefore threads only sleep when there is a consensus that there
+        is no work for them.
+
+        Returns a frame if one was found, or None if the thread was woken
+        up and should look for work again.
         """
-        global idle_worker_count, idle_worker_cvar
+        global idle_worker_count
+        if logflags.DEBUG:
+            logging.debug("Thread %s try_idle" % (self.getName()))
+        if self.idle_since is None:
+            self.idle_since = time.time()
         res = None
-        logging.debug("Thread %s try_idle" % (self.getName()))
-        with idle_worker_cvar:
-            if not self.idle:
-                self.idle = True
-                idle_worker_count += 1
-            while idle_worker_count == NUM_THREADS:
-                # all threads idle
-                # with idle_worker_cvar, try to get something from 
-                # queue, if there is genuinely nothing there, block on
-                # condition
-                
-                res = self.get_from_queue(self.resume_queue, False, None)
-                if res is not None:
-                    # got a task: wake up all
-                    must_frame=False
-                    self.idle = False
-                    idle_worker_count = 0
-                    idle_worker_cvar.notifyAll()
-                    break
-                
-                res = self.get_from_queue(self.in_queue, False, None)
-                
-                if res is not None:
-                    must_frame=True
-                    self.idle = False
-                    idle_worker_count = 0
-                    idle_worker_cvar.notifyAll()
-                    break
-                
-                idle_worker_cvar.wait()
-        self.idle = False
-        
+        with idle_lock:
+            if self.check_retire():
+                return None
+            self.wakeup.clear()
+            parked_workers.append(self)
+            idle_worker_count += 1
             
+            res = self.get_from_queue(self.resume_queue)
+            must_frame = False
+            if res is None:
+                res = self.get_from_queue(self.in_queue)
+                must_frame = True
+            if res is not None or self.work_to_steal():
+                # Don't need to park
+                parked_workers.remove(self)
+                idle_worker_count -= 1
+            else:
+                res = None
+                
         if res is not None:
             if must_frame:
+                self.frame_source = trace.SOURCE_NEW
                 with graph_mutex:
                     frame = makeframe(res, [])
             else:
+                self.frame_source = trace.SOURCE_RESUME
                 frame = res
             return frame
+        elif self in parked_workers:
+            if logflags.DEBUG:
+                logging.debug("Thread %s parked" % (self.getName()))
+            if ADAPTIVE:
+                # Wake up periodically to check if we should retire
+                self.wakeup.wait(IDLE_RETIRE_TIME)
+            else:
+                self.wakeup.wait()
+            if not self.wakeup.isSet():
+                # Timed out: nobody else will remove us
+                with idle_lock:
+                    if self in parked_workers:
+                        parked_workers.remove(self)
+                        idle_worker_count -= 1
+            if logflags.DEBUG:
+                logging.debug("Thread %s woken up" % (self.getName()))
+        return None
+
+    def work_to_steal(self):
+        """
+        Check if there is work in other threads' deques
+        """
+        for d in work_deques:
+            if d is not self.deque and len(d) > 0:
+                return True
+        return False
     
+    def check_retire(self):
+        """
+        Remove this thread from the pool if it is no longer needed.
+        Returns True if the thread should exit
+        """
+        with pool_lock:
+            if should_retire(time.time() - self.idle_since):
+                remove_worker(self)
+                self.retired = True
+        return self.retired
+
     def steal_work(self):
         """
         Attempts to steal work using a round robin scheme.
         Returns True if succeeds in stealing one task
         returns False if unsuccessful
         """
-        thread_ids = range(NUM_THREADS - 1)
-        random.shuffle(thread_ids)
+        self.steal_attempts += 1
+        # Take a snapshot, as list may be replaced if pool is resized
+        deques = work_deques
+        victims = range(len(deques))
+        random.shuffle(victims)
+        if priority.ACTIVE:
+            victims.sort(key=lambda v: oldest_priority(deques[v]), 
+                         reverse=True)
         # try each of the threads in a randomised order
-        for victim in thread_ids:
-            if victim >= self.worker_num:
-                # adjust so that don't try to steal from self
-                victim += 1
+        for victim in victims:
+            victim_deque = deques[victim]
+            if victim_deque is self.deque:
+                # don't try to steal from self
+                continue
             try:
-                frame = work_deques[victim].popleft()
+                frame = victim_deque.popleft()
                 while frame is ReturnMarker:
-                    frame = work_deques[victim].popleft()
+                    frame = victim_deque.popleft()
                 # Run and then go back to normal loop
-                logging.debug("Thread %s stole frame %s from thread #%d" % (
-                            self.getName(), repr(frame), victim))
+                if logflags.DEBUG:
+                    logging.debug("Thread %s stole frame for %s from deque #%d" % (
+                                self.getName(), repr(frame[0]), victim))
+                self.frame_source = trace.SOURCE_STEAL
+                self.steals += 1
                 self.eval_frame(frame)
                 return True
             except IndexError:
                 pass
-        logging.debug("Thread %s couldn't find work to steal" % (self.getName()))
+        if logflags.DEBUG:
+            logging.debug("Thread %s couldn't find work to steal" % (self.getName()))
         return False
             
     def eval_frame(self, frame):
@@ -399,20 +714,26 @@ class WorkerThread(threading.Thread):
          If not, it searches the graph until it finds a runnable task, adding branches to the deque. 
         """        
     
-        logging.debug("%s: looking at frame %s " % (self.getName(), repr(frame)))
+        if logflags.DEBUG:
+            logging.debug("%s: looking at frame for %s " % (self.getName(), 
+                                                             repr(frame[0])))
+        self.idle_since = None
         ch = frame[0]
                 
-        graph_mutex.acquire()
+        self.lock_graph()
         # Expand the ivar as needed
         while hasattr(ch, '_proxy_for'):
             #TODO: handle non-lazy arguments
             ch = ch._expand()
-            logging.debug("expanded ivar to %s " % repr(ch))
+            if logflags.DEBUG:
+                logging.debug("expanded ivar to %s " % repr(ch))
         frame = (ch, frame[1], frame[2])
         
         chstate = ch._state
         if chstate in (IVAR_DONE_FILLED, IVAR_OPEN_W, IVAR_OPEN_R, IVAR_OPEN_RW):
             # Ivar is filled or will be filled by something else 
+            if frame[2]:
+                continue_after(ch, frame[2])
             graph_mutex.release()
             return
         elif chstate == IVAR_ERROR:
@@ -436,6 +757,8 @@ class WorkerThread(threading.Thread):
             self.exec_task(frame)
         elif state in (T_DONE_SUCCESS, T_RUNNING, T_QUEUED, T_CONTINUATION):
             # already started elsewhere
+            if frame[2]:
+                continue_after(ch, frame[2])
             graph_mutex.release()
             return
         elif state in (T_DATA_WAIT, T_INACTIVE):
@@ -471,7 +794,8 @@ class WorkerThread(threading.Thread):
         with all tasks set to T_CONTINUATION
         or None if nothing to run
         """
-        logging.debug("%s: find_runnable_task" % (self.getName()))
+        if logflags.DEBUG:
+            logging.debug("%s: find_runnable_task" % (self.getName()))
         found_runnable = False
         first_iter = True
         
@@ -485,7 +809,8 @@ class WorkerThread(threading.Thread):
             next_ch = None
             
             # Looks at inputs that might not yet be ready
-            for i, ch in enumerate(deps):
+            for i in xrange(len(deps) - 1, -1, -1):
+                ch = deps[i]
                 # TODO: check for placeholder ivar and expand it at this point
                 # TODO: this is assuming atomic ivar
                 # don't need to check if we just created frame while we were holding lock
@@ -498,12 +823,14 @@ class WorkerThread(threading.Thread):
                     ch = ch._expand()
                     while hasattr(ch, '_proxy_for'):
                         ch = ch._expand()
-                    logging.debug("expanded ivar to %s " % repr(ch))
+                    if logflags.DEBUG:
+                        logging.debug("expanded ivar to %s " % repr(ch))
                     deps[i] = ch
                 # Recheck state
                 if ch._readable():                          
                     # is ready.. don't do anything
-                    logging.debug("%s became readable" % repr(ch))
+                    if logflags.DEBUG:
+                        logging.debug("%s became readable" % repr(ch))
                     deps[i] = None
                     continue
                 elif ch._state == IVAR_ERROR:
@@ -513,7 +840,8 @@ class WorkerThread(threading.Thread):
                     ch._state = IVAR_CLOSED_WAITING 
                 
                 # Next task to look at
-                logging.debug("%s, %s" % (repr(ch), repr(ch._in_tasks)))
+                if logflags.DEBUG:
+                    logging.debug("%s, %s" % (repr(ch), repr(ch._in_tasks)))
                 assert(len(ch._in_tasks) == 1)
                 in_t = ch._in_tasks[0]
                 state = in_t._state
@@ -527,8 +855,9 @@ class WorkerThread(threading.Thread):
                 elif state == T_DATA_READY:
                     # This task could be run now
                     if next_ch is None:
-                        logging.debug("selected %s to run for thread %s" % 
-                                  (repr(in_t), self.getName()))
+                        if logflags.DEBUG:
+                            logging.debug("selected %s to run for thread %s" % 
+                                      (repr(in_t), self.getName()))
                         next_ch = ch
                         found_runnable = True
                     dep_count += 1
@@ -545,8 +874,12 @@ class WorkerThread(threading.Thread):
                                     (repr(taskframe)))
                 if next_ch and dep_count > 1:
                     break
+            # Discard finished dependencies so they aren't checked again
+            while deps and deps[-1] is None:
+                deps.pop()
             
-            logging.debug("Depends on %d more ivars, next ivar is %s" % (dep_count, next_ch))
+            if logflags.DEBUG:
+                logging.debug("Depends on %d more ivars, next ivar is %s" % (dep_count, next_ch))
             if dep_count == 0:
                 if task._state == T_DATA_READY:
                     # it is possible that the task became runnable if it was a compound
@@ -567,9 +900,11 @@ class WorkerThread(threading.Thread):
                     else:
                         # This task depends on multiple tasks, add frame to deque  
                         # so other tasks can be run later
-                        logging.debug("%s: saving task frame %s to deque"
-                                      % (self.getName(), repr(taskframe)))
+                        if logflags.DEBUG:
+                            logging.debug("%s: saving task frame for %s to deque"
+                                          % (self.getName(), repr(taskframe[0])))
                         self.deque.append(taskframe)
+                        work_added()
                         # fresh frame with new task
                         continuation = []
                     # build the frame for the next iteration 
@@ -582,8 +917,9 @@ class WorkerThread(threading.Thread):
                         found_runnable = True
                 else:
                     # All dependencies already being executed, so need to suspend
-                    logging.debug("Suspending task frame %s until dependencies avail"
-                                  % repr(taskframe))
+                    if logflags.DEBUG:
+                        logging.debug("Suspending task frame for %s until dependencies avail"
+                                      % repr(taskframe[0]))
                     #TODO: really need to think about how this will work in presence of multiple
                     #     ivars
                     # constraints:
@@ -594,22 +930,30 @@ class WorkerThread(threading.Thread):
                     #  - 
                     
                     # Make callback closure
+                    resumed = [False]
                     def task_resumer(ivar):
                         # graph mutex will be held when this called
-                        try:
-                            ch_index = taskframe[1].index(ivar)
-                            taskframe[1][ch_index] = None
-                        except ValueError:
-                            pass
-                        for ch in taskframe[1]:
+                        # Pop off dependencies from the end until we hit one
+                        # that isn't ready.  Ivars don't stop being readable,
+                        # so each is only checked once it is ready
+                        deps = taskframe[1]
+                        while deps:
+                            ch = deps[-1]
                             if ch is not None and not ch._readable():
-                                logging.debug("task resumer can't yet resume taskframe:%s" % (
-                                                        repr(taskframe)))
+                                if logflags.DEBUG:
+                                    logging.debug("task resumer can't yet resume taskframe for %s" % (
+                                                            repr(taskframe[0])))
                                 return
-                        logging.debug("task resumer resuming taskframe:%s" % (repr(taskframe)))
+                            deps.pop()
+                        if resumed[0]:
+                            return
+                        resumed[0] = True
+                        if logflags.DEBUG:
+                            logging.debug("task resumer resuming taskframe for %s" % (repr(taskframe[0])))
                         resume_taskframe(taskframe)
                         
-                    for ivar in taskframe[1]:
+                    # Copy, as callbacks modify list
+                    for ivar in list(taskframe[1]):
                         if ivar is not None:
                             #TODO: assuming atomic?
                             # All ivars are already being evaluated by other threads:
@@ -636,7 +980,8 @@ def spark_recursive(ivar):
     Assume we are holding the global mutex when this is called
     """
     thread = threading.currentThread()
-    logging.debug("spark_recursive %s" % thread.getName())
+    if logflags.DEBUG:
+        logging.debug("spark_recursive %s" % thread.getName())
     if not isWorkerThread(threading.currentThread()):
         raise Exception("Non-worker thread running spark_recursive")
      
@@ -676,7 +1021,8 @@ def failure_continuation(task, exception):
     """
     Assume mutex not held by caller
     """
-    logging.info("task %s failed" % task.name())
+    if logflags.INFO:
+        logging.info("task %s failed" % task.name())
     with graph_mutex:
         fail_task(task, None, [exception])
     
@@ -684,15 +1030,22 @@ def success_continuation(task, return_val, contstack):
     """
     Assume mutex not held by caller
     """
-    logging.info("task %s finished successfully" % task.name())
+    if logflags.INFO:
+        logging.info("task %s finished successfully" % task.name())
+    entries = None
+    if trace.ACTIVE:
+        trace.task_done(task, True)
     with graph_mutex:
-        logging.debug("%s finished" % repr(task))
+        if logflags.DEBUG:
+            logging.debug("%s finished" % repr(task))
         if return_val is None:
             #TODO: exception type
             raise Exception("Got None return value")
         
         # Fill in all the output ivars
         if len(task._outputs) == 1:
+            if checkpoint.ACTIVE:
+                entries = checkpoint.task_entries(task, (return_val,))
             # Update current state, then pass data to ivars
             task._state = T_DONE_SUCCESS
             task._outputs[0]._set(return_val)
@@ -705,20 +1058,105 @@ def success_continuation(task, return_val, contstack):
             if len(return_vals) != len(task._outputs):
                 raise Exception("Expected tuple or list of length %d as output, but got something of length" % (len(task._outputs), len(return_vals)))
     
+            if checkpoint.ACTIVE:
+                entries = checkpoint.task_entries(task, return_vals)
             # Update current state, then pass data to ivars
             task._state = T_DONE_SUCCESS
             for val, iv in zip(return_vals, task._outputs) :
                 iv._set(val)
         if contstack is not None and len(contstack) > 0:
-            contstack[0]._state = T_DATA_READY # revert from T_CONTINUATION
-            with idle_worker_cvar:
-                resume_queue.put((contstack[0]._outputs[0], None, contstack[1:]))
-                idle_worker_cvar.notifyAll()
+            # Continuation tasks are run from last to first
+            nexttask = contstack[-1]
+            nexttask._state = T_DATA_READY # revert from T_CONTINUATION
+            with idle_lock:
+                resume_queue.put((nexttask._outputs[0], None, contstack[:-1]))
+                if not wake_worker():
+                    maybe_grow()
+    if entries:
+        checkpoint.record(entries)
 
             
+def continue_after(ivar, continuation):
+    """
+    Run the continuation of a frame once ivar is filled, for when the task
+    that fills ivar was started from a different frame, e.g. by another 
+    thread through another of its output tasks.  Graph mutex should be held.
+    """
+    def resume(ivar):
+        if not ivar._readable():
+            # Failed: continuation tasks fail with it
+            return
+        # Continuation tasks are run from last to first
+        nexttask = continuation[-1]
+        nexttask._state = T_DATA_READY # revert from T_CONTINUATION
+        resume_taskframe((nexttask._outputs[0], None, continuation[:-1]))
+    if ivar._readable():
+        resume(ivar)
+    elif ivar._state != IVAR_ERROR:
+        ivar._spark(done_callback=resume)
+
 def resume_taskframe(taskframe):
-    with idle_worker_cvar:
-        logging.debug("Put %s on resume queue" % repr(taskframe))
+    with idle_lock:
+        if logflags.DEBUG:
+            logging.debug("Put frame for %s on resume queue" % repr(taskframe[0]))
         resume_queue.put(taskframe)
-        idle_worker_cvar.notifyAll()
-            
+        if not wake_worker():
+            maybe_grow()
+
+def oldest_priority(deque):
+    """
+    Upstream length of the oldest frame on a deque, which would be stolen
+    next.  Doesn't take any locks, so may be out of date by the time it
+    is stolen.
+    """
+    try:
+        frame = deque[0]
+    except IndexError:
+        return -1.0
+    if frame is ReturnMarker:
+        return 0.0
+    return priority.cached_upstream(frame[0])
+
+def queue_depth(queue):
+    if queue is None:
+        return 0
+    return queue.qsize()
+
+def per_worker(attr):
+    """
+    Function to collect a statistic for each worker, plus the total for
+    workers that were removed from the pool
+    """
+    def collect():
+        with pool_lock:
+            return ([({'worker': w.getName()}, getattr(w, attr)) 
+                     for w in workers] + 
+                    [({'worker': 'retired'}, retired_stats[attr])])
+    return collect
+
+metrics.register('pydflow_in_queue_depth', metrics.GAUGE,
+        "Ivars sparked by other threads waiting for a worker",
+        lambda: queue_depth(in_queue))
+metrics.register('pydflow_resume_queue_depth', metrics.GAUGE,
+        "Frames whose dependencies finished waiting for a worker",
+        lambda: queue_depth(resume_queue))
+metrics.register('pydflow_worker_deque_length', metrics.GAUGE,
+        "Frames in each worker's deque",
+        lambda: [({'worker': w.getName()}, len(w.deque)) for w in workers])
+metrics.register('pydflow_workers', metrics.GAUGE,
+        "Worker threads in the pool", pool_size)
+metrics.register('pydflow_idle_workers', metrics.GAUGE,
+        "Worker threads parked waiting for work", 
+        lambda: idle_worker_count)
+metrics.register('pydflow_steal_attempts_total', metrics.COUNTER,
+        "Times each worker looked for work to steal",
+        per_worker('steal_attempts'))
+metrics.register('pydflow_steals_total', metrics.COUNTER,
+        "Frames each worker stole from other workers",
+        per_worker('steals'))
+metrics.register('pydflow_graph_mutex_contended_total', metrics.COUNTER,
+        "Times each worker found the graph mutex held when evaluating "
+        "a frame", per_worker('mutex_contended'))
+metrics.register('pydflow_graph_mutex_wait_seconds_total', metrics.COUNTER,
+        "Time each worker spent waiting for the graph mutex when "
+        "evaluating a frame", per_worker('mutex_wait'))
@@ -0,0 +1,60 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Files of pickled entries which are appended to as a program runs, used
+for the checkpoint and runtime history files.  Entries are only ever
+appended, so if the process dies while writing, only the last entry
+can be incomplete.
+
+@author: Tim Armstrong
+'''
+import os
+import logging
+import cPickle
+
+def open_log(path):
+    """
+    Open the log at path for reading and appending, creating it and its
+    directory if needed.
+    """
+    dir = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(dir):
+        os.makedirs(dir)
+    return open(path, 'a+b')
+
+def read(f, name):
+    """
+    Return a list of all entries in the log file f.  Anything after the
+    last complete entry, which may have been partly written when the
+    process died, is truncated so that new entries can be appended.
+    name describes the log in warnings.
+    """
+    entries = []
+    f.seek(0)
+    good_end = 0
+    try:
+        while True:
+            entries.append(cPickle.load(f))
+            good_end = f.tell()
+    except EOFError:
+        pass
+    except Exception, e:
+        logging.warning("Ignoring corrupt entry at end of %s: %s"
+                        % (name, repr(e)))
+    f.seek(0, os.SEEK_END)
+    if f.tell() != good_end:
+        f.truncate(good_end)
+    f.seek(0, os.SEEK_END)
+    return entries
@@ -20,16 +20,21 @@ from flowgraph import Task, Ivar, Unbound
 from states import *
 from PyDFlow.writeonce import WriteOnceVar
 from PyDFlow.base.exceptions import *
-from PyDFlow.base.mutex import graph_mutex
+from PyDFlow.base.mutex import graph_mutex, ivar_lock
 
 
 import logging
 
 import LocalExecutor
+import checkpoint
+import trace
+import logflags
 from PyDFlow.base.flowgraph import ErrorVal
 
 
 class AtomicTask(Task):
+    __slots__ = ()
+
     """
     An atomic task can be bound to a future variable.
     The state of the Ivar is synchronized with the state of
@@ -40,6 +45,8 @@ class AtomicTask(Task):
         super(AtomicTask, self).__init__(*args, **kwargs)
         if self._all_inputs_ready():
             self._state = T_DATA_READY
+        if trace.ACTIVE:
+            trace.task_created(self, self._state == T_DATA_READY)
 
     def _input_readable(self, input, oldstate, newstate):
         """
@@ -54,7 +61,10 @@ class AtomicTask(Task):
             elif self._state == T_DATA_WAIT:
                 #TODO: valid transition?
                 self._state = T_DATA_READY
-            logging.debug("%s changed state" % repr(self))
+            if trace.ACTIVE:
+                trace.task_ready(self)
+            if logflags.DEBUG:
+                logging.debug("%s changed state" % repr(self))
 
     def _gather_input_values(self):
         """
@@ -84,6 +94,8 @@ class AtomicTask(Task):
         
 
 class AtomicIvar(Ivar):
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super(AtomicIvar, self).__init__(*args, **kwargs)
 
@@ -109,7 +121,7 @@ class AtomicIvar(Ivar):
         elif self._state != IVAR_CLOSED:
             raise Exception("Adding an input to an open AtomicIvar")
         else:
-            self._in_tasks.append(input_task)
+            self._in_tasks = [input_task]
 
     def _register_output(self, output_task):
         """
@@ -118,10 +130,12 @@ class AtomicIvar(Ivar):
         done = self._state in [IVAR_OPEN_RW, IVAR_OPEN_R, IVAR_DONE_FILLED]
         if done and self._reliable:
             return True
-        else:
+        if self._out_tasks:
             self._out_tasks.append(output_task)
-            #TODO: right?
-            return done
+        else:
+            self._out_tasks = [output_task]
+        #TODO: right?
+        return done
 
     def _replacewith(self, other):
         # Merge the futures to handle the case where a thread
@@ -134,7 +148,8 @@ class AtomicIvar(Ivar):
         """
         Set up the future variable to be written into.
         """
-        logging.debug("%s prepared" % (repr(self)))
+        if logflags.DEBUG:
+            logging.debug("%s prepared" % (repr(self)))
         if mode == M_READWRITE:
             #TODO: exception type
             raise Exception("M_READWRITE is not valid for atomic Ivars")
@@ -198,15 +213,21 @@ class AtomicIvar(Ivar):
         if oldstate in (IVAR_OPEN_W, IVAR_OPEN_RW):
             self._future.set(val)
             
-            self._state = IVAR_DONE_FILLED
-            logging.debug("%s set" % repr(self))
+            # Once the state is changed, no more output tasks will
+            # be registered, so we can notify those already registered
+            # without holding the ivar lock
+            with ivar_lock(self):
+                self._state = IVAR_DONE_FILLED
+                out_tasks = self._out_tasks
+                if self._reliable:
+                    self._in_tasks = None
+                    self._out_tasks = None # Don't need to provide notification of any changes'
+            if logflags.DEBUG:
+                logging.debug("%s set" % repr(self))
             #update the state and notify output tasks
-            for t in self._out_tasks:
+            for t in out_tasks:
                 t._input_readable(self, oldstate, IVAR_DONE_FILLED)
 
-            if self._reliable:
-                self._in_tasks = None
-                self._out_tasks = None # Don't need to provide notification of any changes'
             self._notify_done()
         else:
             #TODO: exception type
@@ -250,7 +271,8 @@ class AtomicIvar(Ivar):
         raise UnimplementedException("_has_data not overridden")
 
     def _try_readable(self):
-        logging.debug("_try_readable on %s" % repr(self))
+        if logflags.DEBUG:
+            logging.debug("_try_readable on %s" % repr(self))
         if self._state in (IVAR_DONE_FILLED, IVAR_OPEN_R, IVAR_OPEN_RW):
             return True
         elif self._state in (IVAR_CLOSED, IVAR_DONE_DESTROYED):
@@ -267,6 +289,8 @@ class AtomicIvar(Ivar):
                         raise NoDataException(("Bound Ivar with no input tasks " + 
                                               "and no associated data was forced. " +
                                              "Ivar was bound to" + repr(self._bound)))
+            elif checkpoint.ACTIVE:
+                return checkpoint.restore(self)
                         
         elif self._state in (IVAR_ERROR,):
             return False
@@ -280,9 +304,13 @@ class AtomicIvar(Ivar):
         Should be called with lock held
         Ensure that at some point in the future this Ivar will be filled
         """
-        logging.debug("Atomic Ivar sparked")
+        if logflags.DEBUG:
+            logging.debug("Atomic Ivar sparked")
         if done_callback is not None:
-            self._done_callbacks.append(done_callback)
+            if self._done_callbacks:
+                self._done_callbacks.append(done_callback)
+            else:
+                self._done_callbacks = [done_callback]
 
         if self._state in (IVAR_CLOSED, IVAR_DONE_DESTROYED):
             if self._bound is not Unbound and len(self._in_tasks) == 0:
@@ -295,6 +323,9 @@ class AtomicIvar(Ivar):
                     self._notify_done()
                 
             elif len(self._in_tasks) > 0:
+                if checkpoint.ACTIVE and checkpoint.restore(self):
+                    # Filled from checkpoint, done callbacks already run
+                    return
                 # Enable task to be run, but
                 # input tasks should be run first
                 self._state = IVAR_CLOSED_WAITING
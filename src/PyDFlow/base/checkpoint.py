@@ -0,0 +1,272 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Checkpointing of finished tasks, so that a script which crashed or was
+killed partway through can be rerun without redoing the work that was
+already done.
+
+While checkpointing is on, the output values of each task that finishes
+are appended to a checkpoint file: pickled values for python ivars and
+paths for file ivars bound to a location (outputs in temporary files
+aren't kept, as the files are deleted on exit).  When a script that
+builds the same graph is run with the same checkpoint file, tasks whose
+outputs are all in the checkpoint are marked as done and have their
+outputs filled in without being run, and the tasks they depend on are
+never run at all.
+
+Tasks are identified by a key computed from the task's function, its
+non-ivar arguments and the keys of its input ivars.  The key of an ivar
+is computed from the key of the task that writes to it, or for ivars with
+no input tasks, the data the ivar is bound to.  Tasks which take
+unpicklable arguments, or which don't have a function (e.g. compound
+tasks), and anything downstream of them, aren't checkpointed.  Note that
+the contents of bound input files are not part of the key: the
+checkpoint is meant for resuming the same run, not for detecting changed
+inputs.
+
+@author: Tim Armstrong
+'''
+from __future__ import with_statement
+from states import *
+import appendlog
+import trace
+
+import threading
+import logging
+import weakref
+import marshal
+import cPickle
+import hashlib
+
+# Whether checkpointing is on.  Only modify with structure_lock held
+ACTIVE = False
+# Path of checkpoint file
+CHECKPOINT_PATH = None
+
+structure_lock = threading.Lock()
+# Saved output values by ivar key
+saved = {}
+# Checkpoint file open for appending
+checkpoint_file = None
+
+# Keys of ivars seen so far: must be computed before the ivar is filled
+# as the links to input tasks may be dropped then
+ivar_keys = weakref.WeakKeyDictionary()
+
+restored = 0
+recorded = 0
+
+# Returned by Ivar._checkpoint_value if value shouldn't be checkpointed
+NoCheckpoint = object()
+
+def configure(path):
+    """
+    Start checkpointing to path, resuming from the checkpoints already
+    in the file if it exists.  If path is None, checkpointing is turned
+    off.
+    """
+    global ACTIVE, CHECKPOINT_PATH, saved, checkpoint_file
+    with structure_lock:
+        if checkpoint_file is not None:
+            checkpoint_file.close()
+            checkpoint_file = None
+        ACTIVE = False
+        saved = {}
+        CHECKPOINT_PATH = path
+        if path is None:
+            return
+        checkpoint_file = appendlog.open_log(path)
+        saved = dict(appendlog.read(checkpoint_file, "checkpoint file"))
+        logging.debug("Loaded %d checkpointed values from %s" %
+                      (len(saved), path))
+        ACTIVE = True
+
+def stats():
+    """
+    Return a dictionary with counts of tasks restored from and recorded
+    in the checkpoint
+    """
+    with structure_lock:
+        return {'restored': restored, 'recorded': recorded}
+
+def func_key(task):
+    """
+    Identify the function the task runs.
+    """
+    func = getattr(task, '_func', None)
+    if func is None:
+        return None
+    h = hashlib.sha1()
+    h.update(type(task).__name__)
+    try:
+        h.update("%s.%s" % (func.__module__, func.__name__))
+        h.update(marshal.dumps(func.func_code))
+        h.update(cPickle.dumps(func.func_defaults, 2))
+    except (AttributeError, ValueError, TypeError, cPickle.PicklingError), e:
+        logging.debug("Can't checkpoint %s: %s" % (repr(task), e))
+        return None
+    return h.hexdigest()
+
+def ivar_key(ivar):
+    """
+    Compute the key of the ivar, or None if it can't be checkpointed.
+    Keys of ivars further up the graph are computed and saved along the
+    way.  Must hold graph_mutex.
+    """
+    key = ivar_keys.get(ivar, NoCheckpoint)
+    if key is not NoCheckpoint:
+        return key
+    # Work up the graph iteratively to avoid recursing down long chains
+    stack = [ivar]
+    while stack:
+        iv = stack[-1]
+        if iv in ivar_keys:
+            stack.pop()
+            continue
+        if not iv._in_tasks:
+            ivar_keys[iv] = source_key(iv)
+            stack.pop()
+            continue
+        task = iv._in_tasks[0]
+        missing = [inp for spec, inp in task._input_iter()
+                   if not spec.isRaw() and inp not in ivar_keys]
+        if missing:
+            stack.extend(missing)
+            continue
+        ivar_keys[iv] = output_key(task, iv)
+        stack.pop()
+    return ivar_keys[ivar]
+
+def source_key(ivar):
+    """
+    Key for ivar with no input tasks
+    """
+    binding = ivar._checkpoint_binding()
+    if binding is None:
+        return None
+    try:
+        return hashlib.sha1(type(ivar).__name__ +
+                            cPickle.dumps(binding, 2)).hexdigest()
+    except (TypeError, cPickle.PicklingError), e:
+        logging.debug("Can't checkpoint from %s: %s" % (repr(ivar), e))
+        return None
+
+def output_key(task, ivar):
+    """
+    Key for ivar written to by task.  The keys of all the task's input
+    ivars must already be known.
+    """
+    fkey = func_key(task)
+    if fkey is None:
+        return None
+    h = hashlib.sha1(fkey)
+    for spec, inp in task._input_iter():
+        if spec.isRaw():
+            try:
+                h.update(cPickle.dumps(inp, 2))
+            except (TypeError, cPickle.PicklingError), e:
+                logging.debug("Can't checkpoint %s: %s" % (repr(task), e))
+                return None
+        else:
+            key = ivar_keys[inp]
+            if key is None:
+                return None
+            h.update(key)
+    h.update(repr((task._outputs.index(ivar), ivar._checkpoint_location())))
+    return h.hexdigest()
+
+def restore(ivar):
+    """
+    If all of the outputs of the task which writes to ivar were
+    checkpointed, fill them in and mark the task as done.  Returns True
+    if the task was restored.  Must hold graph_mutex.
+    """
+    global restored
+    task = ivar._in_tasks[0]
+    if task._state not in (T_INACTIVE, T_DATA_WAIT, T_DATA_READY):
+        return False
+    vals = []
+    for o in task._outputs:
+        if o._state not in (IVAR_CLOSED, IVAR_CLOSED_WAITING):
+            return False
+        key = ivar_key(o)
+        if key is None:
+            return False
+        val = saved.get(key, NoCheckpoint)
+        if val is NoCheckpoint or not o._restorable(val):
+            return False
+        vals.append(val)
+    logging.debug("Restoring %s from checkpoint" % repr(task))
+    task._state = T_DONE_SUCCESS
+    for o, val in zip(task._outputs, vals):
+        o._prepare(M_WRITE)
+        o._set(val)
+    if trace.ACTIVE:
+        trace.task_done(task, True)
+    with structure_lock:
+        restored += 1
+    return True
+
+def task_entries(task, vals):
+    """
+    Work out checkpoint entries for the values the task is about to write
+    to its outputs.  Must hold graph_mutex, and should be called before
+    the outputs are set.
+    """
+    entries = []
+    for o, val in zip(task._outputs, vals):
+        key = ivar_key(o)
+        if key is None:
+            return []
+        val = o._checkpoint_value(val)
+        if val is NoCheckpoint:
+            return []
+        entries.append((key, val))
+    return entries
+
+def record(entries):
+    """
+    Append the entries to the checkpoint file.  If the file can't be 
+    written to, checkpointing is turned off.  Should be called without 
+    graph_mutex held.
+    """
+    global recorded, ACTIVE, checkpoint_file
+    if not entries:
+        return
+    try:
+        data = ''.join([cPickle.dumps(e, 2) for e in entries])
+    except (TypeError, cPickle.PicklingError), e:
+        logging.debug("Can't checkpoint values %s: %s" % (repr(entries), e))
+        return
+    with structure_lock:
+        if checkpoint_file is None:
+            return
+        for key, val in entries:
+            saved[key] = val
+        try:
+            checkpoint_file.write(data)
+            checkpoint_file.flush()
+        except IOError, e:
+            logging.error("Could not write to checkpoint file %s, "
+                          "checkpointing turned off: %s" % 
+                          (CHECKPOINT_PATH, repr(e)))
+            ACTIVE = False
+            try:
+                checkpoint_file.close()
+            except IOError:
+                pass
+            checkpoint_file = None
+            return
+        recorded += 1
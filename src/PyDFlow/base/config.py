@@ -0,0 +1,207 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+# http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Runtime configuration of PyDFlow.  Each part of the runtime has its own
+configure function, and options not passed to it are left unchanged.
+
+@author: Tim Armstrong
+'''
+from PyDFlow.base import mutex
+from PyDFlow.base import checkpoint as checkpointing
+from PyDFlow.base import trace as tracing
+from PyDFlow.base import logflags
+from PyDFlow.base import metrics
+from PyDFlow.base import priority as prioritising
+from PyDFlow.base import history as runtime_history
+import PyDFlow.base.LocalExecutor as LocalExecutor
+
+def configure(workers=None, adaptive=None, min_workers=None, max_workers=None,
+              lock_mode=None):
+    """
+    Set up the threads that evaluate the flowgraph.  Options that are not
+    provided are left unchanged.  Changes to the logging level since
+    the last call to this or any of the other configure functions are
+    also picked up (see PyDFlow.base.logflags).
+
+    workers: number of threads used to evaluate the flowgraph and run
+            @func tasks
+    adaptive: if True, grow and shrink the thread pool between min_workers
+            and max_workers according to the amount of work queued
+    min_workers, max_workers: limits of an adaptive pool, kept until
+            they are passed again.  0 goes back to the default of 1 and
+            the number of cpus respectively
+    lock_mode: mutex.LOCK_GLOBAL or mutex.LOCK_STRIPED, which lets new 
+            tasks be added without taking the global lock.  Should be set 
+            before any tasks are created
+    """
+    logflags.refresh()
+    if lock_mode is not None:
+        mutex.set_lock_mode(lock_mode)
+    if (workers is not None or adaptive is not None or
+            min_workers is not None or max_workers is not None):
+        LocalExecutor.configure(workers=workers, adaptive=adaptive,
+                                min_workers=min_workers, max_workers=max_workers)
+
+def configure_funcs(executor=None, processes=None, memo_dir=None,
+                    memo_max_bytes=None):
+    """
+    Set options for running @func tasks.  Options that are not provided
+    are left unchanged.
+
+    executor: 'thread' or 'process': where to run @func tasks which
+            don't specify an executor
+    processes: number of worker processes for the 'process' executor.
+            Must be set before any tasks are run in worker processes
+    memo_dir: directory for the cache of @func(cache=True) results
+    memo_max_bytes: size limit for the cache of @func results
+    """
+    logflags.refresh()
+    # Import here to avoid circular dependency
+    if executor is not None:
+        import PyDFlow.PyFun.flowgraph as funflowgraph
+        funflowgraph.set_default_executor(executor)
+    if processes is not None:
+        import PyDFlow.PyFun.ProcessExecutor as ProcessExecutor
+        ProcessExecutor.configure(processes=processes)
+    if memo_dir is not None or memo_max_bytes is not None:
+        import PyDFlow.PyFun.memo as memo
+        memo.configure(cache_dir=memo_dir, max_bytes=memo_max_bytes)
+
+def configure_apps(cores=None, memory=None, callback_threads=None,
+                   launcher=None):
+    """
+    Set options for running @app tasks locally.  Options that are not
+    provided are left unchanged.
+
+    cores: number of cores available to run @app tasks locally
+            (default: the number of cpus)
+    memory: memory in megabytes available to run @app tasks locally
+            (default: physical memory)
+    callback_threads: number of threads that run the callbacks of 
+            finished @app tasks
+    launcher: 'popen' to fork and exec each @app task from this 
+            process, or 'helper' to have a separate small process start 
+            them, which is faster when this process is large
+    """
+    logflags.refresh()
+    if (cores is not None or memory is not None or
+            callback_threads is not None or launcher is not None):
+        import PyDFlow.app.LocalExecutor as AppExecutor
+        AppExecutor.configure(cores=cores, memory=memory,
+                              callback_threads=callback_threads,
+                              launcher=launcher)
+
+def configure_app_paths(cache_file=None, revalidate=None, catalog=None):
+    """
+    Set how the executables for @app tasks are found.  Options that are
+    not provided are left unchanged.  See PyDFlow.app.paths.
+
+    cache_file: file to save the locations of @app executables in
+    revalidate: if True, check that cached locations of @app
+            executables are still correct before using them
+    catalog: file listing the executables and wrapper commands to 
+            use for @app tasks
+    """
+    logflags.refresh()
+    if cache_file is not None or revalidate is not None or catalog is not None:
+        import PyDFlow.app.paths as app_paths
+        app_paths.configure(revalidate=revalidate, cache_file=cache_file)
+        if catalog is not None:
+            app_paths.load_catalog(catalog)
+
+def configure_app_journal(incremental=None, skip=None, path=None):
+    """
+    Set whether @app tasks are rerun if their outputs are already up to
+    date.  Options that are not provided are left unchanged.  See
+    PyDFlow.app.journal.
+
+    incremental: if True, don't rerun @app tasks whose bound output
+            files are newer than their input files and were produced
+            by the same command line from the same input data
+    skip: if True, don't rerun @app tasks if the same command was
+            already run on the same input data and the bound output files
+            haven't been modified since
+    path: file to record the commands that produced @app outputs 
+            in.  Defaults to .pydflow/app_journal under the working 
+            directory the script started in
+    """
+    logflags.refresh()
+    if incremental is not None or skip is not None or path is not None:
+        import PyDFlow.app.journal as journal
+        journal.configure(incremental=incremental, skip=skip,
+                          journal_path=path)
+
+def configure_scheduling(priority=None, history=None, history_by_size=None):
+    """
+    Set how the order of tasks is chosen.  Options that are not provided
+    are left unchanged.
+
+    priority: if True, run tasks on the longest chains of unfinished
+            tasks first (see PyDFlow.base.priority)
+    history: file to keep a history of task runtimes in, used to predict
+            runtimes of tasks for scheduling (see PyDFlow.base.history).
+            False turns history off
+    history_by_size: if True, keep runtime history by size of task 
+            inputs as well as by task name
+    """
+    logflags.refresh()
+    if priority is not None:
+        prioritising.configure(priority)
+    if history is not None:
+        if history is False:
+            runtime_history.configure(None, by_size=history_by_size)
+        else:
+            runtime_history.configure(history, by_size=history_by_size)
+    elif history_by_size is not None:
+        runtime_history.BY_SIZE = history_by_size
+
+def configure_checkpoint(path):
+    """
+    Save the outputs of finished tasks in the file path, so that if the
+    script is rerun after a crash, tasks that already finished are not
+    rerun.  False or None turns checkpointing off.  See
+    PyDFlow.base.checkpoint.
+    """
+    logflags.refresh()
+    if path is False:
+        path = None
+    checkpointing.configure(path)
+
+def configure_monitoring(trace=None, metrics_port=None):
+    """
+    Set how the running workflow can be observed.  Options that are not
+    provided are left unchanged.
+
+    trace: True to record when each task became ready, started and 
+            finished, and which thread ran it (see PyDFlow.base.trace), 
+            or a file to also write the trace to in Chrome trace format 
+            on exit.  False turns tracing off
+    metrics_port: local port to serve metrics about the scheduler on in 
+            Prometheus text format (see PyDFlow.base.metrics).  
+            False stops serving them
+    """
+    logflags.refresh()
+    if trace is not None:
+        if trace is True or trace is False:
+            tracing.configure(trace)
+        else:
+            tracing.configure(True, trace)
+    if metrics_port is not None:
+        if metrics_port is False:
+            metrics.stop()
+        else:
+            # Register app metrics too
+            import PyDFlow.app.LocalExecutor
+            metrics.serve(metrics_port)
@@ -18,7 +18,7 @@ from __future__ import with_statement
 @author: Tim Armstrong
 '''
 from PyDFlow.types.check import InputSpec, TaskDescriptor
-from PyDFlow.base.mutex import graph_mutex
+from PyDFlow.base.mutex import graph_mutex, ivar_lock, construction_lock
 import inspect
 from functools import wraps
 
@@ -100,7 +100,8 @@ class magictuple(tuple):
         
         with graph_mutex:
             for o, s in zip(oth, self):
-                o._replacewith(s)
+                with ivar_lock(o, s):
+                    o._replacewith(s)
         return self
     
     def __rshift__(self, oth):
@@ -112,7 +113,8 @@ class magictuple(tuple):
         
         with graph_mutex:
             for o, s in zip(oth, self):
-                s._replacewith(o)
+                with ivar_lock(o, s):
+                    s._replacewith(o)
         return oth
     
 
@@ -123,20 +125,49 @@ class magictuple(tuple):
 
 
 class TaskWrapper(object):
-    def __init__(self, func, task_class, descriptor):
+    def __init__(self, func, task_class, descriptor, **task_options):
         self.func = func
         self.descriptor = descriptor
         self.task_class = task_class
         self._taskname = func.__name__
+        # Keyword arguments passed to every task constructed, e.g. _executor
+        self.task_options = task_options
 
     def __call__(self, *args, **kwargs):
         # Set up the input/output Ivars and the tasks, plugging
         # them all together and validating types
 
         kwargs['_taskname']=self._taskname
+        kwargs.update(self.task_options)
 
         task = self.task_class(self.func, self.descriptor,
                                 *args, **kwargs)
+        return self._task_outputs(task)
+
+    def map(self, *iterables):
+        """
+        Create one task for each item in iterables, like the builtin map.  
+        E.g. sort.map(files) is equivalent to [sort(f) for f in files], 
+        and add.map(xs, ys) to [add(x, y) for x, y in zip(xs, ys)].
+        This is faster for large numbers of tasks as the arguments are
+        type checked in one pass and the tasks are all added to the graph
+        in one go with the lock held.
+        Returns a list with the output(s) of each task.
+        """
+        if len(iterables) == 0:
+            raise TypeError("map() requires at least one iterable")
+        checked = self.descriptor.validate_many(zip(*iterables))
+        kwargs = dict(self.task_options)
+        kwargs['_taskname'] = self._taskname
+        res = []
+        with construction_lock(*checked):
+            for inputs in checked:
+                task = self.task_class(self.func, self.descriptor,
+                                       _checked_inputs=inputs, **kwargs)
+                res.append(self._task_outputs(task))
+        return res
+
+    def _task_outputs(self, task):
         # Unpack the tuple if necessary
         if len(task._outputs) == 1:
             return task._outputs[0]
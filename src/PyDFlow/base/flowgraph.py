@@ -29,7 +29,10 @@ assume that any locks are held.
 
 import logging
 from PyDFlow.types import flvar
-from PyDFlow.base.mutex import graph_mutex
+from PyDFlow.base.mutex import graph_mutex, construction_lock, ivar_lock
+from PyDFlow.base import trace
+from PyDFlow.base import logflags
+from PyDFlow.base import priority
 
 from states import *
 from exceptions import *
@@ -43,6 +46,13 @@ ErrorVal = object()
 
 
 class Task(object):
+    # Tasks and ivars use slots rather than a per-instance dict to save
+    # memory in large graphs.  Subclasses must declare __slots__ for any
+    # additional fields to get the benefit.
+    __slots__ = ('_state', '_taskname', '_descriptor', '_inputs', '_outputs',
+                 '_inputs_notready_count', '_inputs_waiting', 
+                 '_ready_callbacks', '_cpath')
+
     def __init__(self, descriptor, *args, **kwargs):
         # Set the state to this value, however it can be overwritten
         # by child classes, as it migh tbe possible for some task
@@ -56,11 +66,22 @@ class Task(object):
         self._taskname = taskname
         self._descriptor = descriptor
         
+        checked_inputs = kwargs.pop('_checked_inputs', None)
+        if checked_inputs is not None:
+            # Inputs were already validated and the construction lock is 
+            # held by the caller, e.g. when building many tasks at once
+            self._inputs = checked_inputs
+            self._setup_inputs()
+            self._setup_outputs(**kwargs)
+            return
 
         # Validate the function inputs.  note: this will consume
         # kwargs that match task input arguments
         self._inputs = descriptor.validate_inputs(args, kwargs)
-        with graph_mutex: 
+        outputs = kwargs.get("_outputs", kwargs.get("_out", ()))
+        if not isinstance(outputs, (list, tuple)):
+            outputs = (outputs,)
+        with construction_lock(self._inputs, outputs): 
             self._setup_inputs()
             self._setup_outputs(**kwargs)
         
@@ -78,16 +99,24 @@ class Task(object):
     
     def _setup_inputs(self):
         not_ready_count = 0
-        inputs_ready = []
+        # Map from input ivars that aren't ready to the number of
+        # input positions they occupy.  Only allocated if needed
+        waiting = None
         for s, c in self._input_iter():
             ready = s.isRaw() or c._register_output(self)
-            inputs_ready.append(ready)
             if not ready: 
                 not_ready_count += 1
-        logging.debug("%d inputs, %d not ready for task %s" % (
-                len(self._inputs), not_ready_count, repr(self)))
+                if waiting is None:
+                    waiting = {c: 1}
+                else:
+                    waiting[c] = waiting.get(c, 0) + 1
+        if logflags.DEBUG:
+            logging.debug("%d inputs, %d not ready for task %s" % (
+                    len(self._inputs), not_ready_count, repr(self)))
         self._inputs_notready_count = not_ready_count
-        self._inputs_ready = inputs_ready
+        self._inputs_waiting = waiting
+        # Inputs have a new consumer
+        priority.invalidate(priority.DOWN)
 
     def _all_inputs_ready(self, callback=None):
         """
@@ -123,6 +152,8 @@ class Task(object):
 
         if outputs is not None:
             self._descriptor.validate_outputs(outputs)
+            # Tasks reading outputs may now have a new producer
+            priority.invalidate(priority.UP)
         else:
             outputs = self._descriptor.make_outputs()
         self._outputs = outputs
@@ -148,6 +179,8 @@ class Task(object):
         The task failed with some exception
         """
         self._state = T_ERROR
+        if trace.ACTIVE:
+            trace.task_done(self, False)
     
     def _input_readable(self, input, oldstate, newstate):
         """
@@ -159,16 +192,14 @@ class Task(object):
         
         Can be overridden in a child class but this version must be called 
         """
-        # Check may be overly defensive here
-        for ix, inp in enumerate(self._inputs):
-            if inp == input:
-                if not self._inputs_ready[ix]:
-                    self._inputs_notready_count -= 1
-                    self._inputs_ready[ix] = True
+        waiting = self._inputs_waiting
+        if waiting is not None:
+            # Input might have already been marked as readable
+            self._inputs_notready_count -= waiting.pop(input, 0)
         
         # Callback all registered functions 
         if self._inputs_notready_count == 0:
-            # TODO: delete _inputs_ready?
+            self._inputs_waiting = None
             if hasattr(self, '_ready_callbacks'):
                 for c in self._ready_callbacks:
                     c(self)
@@ -178,6 +209,7 @@ class Task(object):
         """
         Swap out an old output Ivar with a new one.
         """
+        priority.invalidate(priority.UP, priority.DOWN)
         for i, o in enumerate(self._outputs):
             if o is old:
                 self._outputs[i] = new
@@ -186,12 +218,20 @@ class Task(object):
         """
         Swap out an old output Ivar with a new one.
         """
+        priority.invalidate(priority.UP, priority.DOWN)
+        found = False
         for i, o in enumerate(self._inputs):
             if o is old:
                 self._inputs[i] = new
-                #TODO: need t ensure that state is corectly updated
-                if new._readable():
-                    self._input_readable(new, old._state, new._state)
+                found = True
+        if not found:
+            return
+        waiting = self._inputs_waiting
+        if waiting is not None and old in waiting:
+            waiting[new] = waiting.get(new, 0) + waiting.pop(old)
+        #TODO: need t ensure that state is corectly updated
+        if new._readable():
+            self._input_readable(new, old._state, new._state)
                     
                 
 
@@ -223,17 +263,23 @@ class Ivar(flvar):
     This class is an abstract base class for all other Ivars to derive 
     from
     """
+    __slots__ = ('_in_tasks', '_out_tasks', '_state', '_bound', 
+                 '_done_callbacks', '_reliable', '_exception', '_future',
+                 '_replaced_with', '__weakref__')
+
     def __init__(self, bound=Unbound):
         """
         bound_to is a location that the data will come from
         or will be written to.
         """
         super(Ivar, self).__init__()
-        self._in_tasks = []
-        self._out_tasks = []
+        # The task and callback lists start off as the shared empty 
+        # tuple, and a list is only allocated once something is added
+        self._in_tasks = ()
+        self._out_tasks = ()
         self._state = IVAR_CLOSED
         self._bound = bound
-        self._done_callbacks = []
+        self._done_callbacks = ()
         self._reliable = False
         # NOTE: self._exception will used to be store
         #    exceptions in case of an error
@@ -253,7 +299,8 @@ class Ivar(flvar):
         retains all the same settings as the LHS Ivar.
         """
         with graph_mutex:
-            oth._replacewith(self)
+            with ivar_lock(self, oth):
+                oth._replacewith(self)
         return self
     
     def __rshift__(self, oth):
@@ -261,7 +308,8 @@ class Ivar(flvar):
         Same as lshift but injecting LHS into RHS
         """
         with graph_mutex:
-            self._replacewith(oth)
+            with ivar_lock(self, oth):
+                self._replacewith(oth)
         return oth
 
     __ilshift__ = __lshift__
@@ -327,7 +375,10 @@ class Ivar(flvar):
 
         TODO: more sophisticated implementation?
         """
-        self._in_tasks.append(input_task)
+        if self._in_tasks:
+            self._in_tasks.append(input_task)
+        else:
+            self._in_tasks = [input_task]
 
     def _register_output(self, output_task):
         """
@@ -339,21 +390,20 @@ class Ivar(flvar):
         implementation that checks that states are legal, etc.
         
         """
-        self._out_tasks.append(output_task)
+        if self._out_tasks:
+            self._out_tasks.append(output_task)
+        else:
+            self._out_tasks = [output_task]
         #TODO: right?
         return self._state in [IVAR_OPEN_RW, IVAR_OPEN_R, IVAR_DONE_FILLED]
 
     def add_input(self, input_task):
-        global graph_mutex
-        graph_mutex.acquire()
-        self._register_output(input_task)
-        graph_mutex.release()
+        with construction_lock((self,)):
+            self._register_output(input_task)
 
     def add_output(self, input_task):
-        global graph_mutex
-        graph_mutex.acquire()
-        self._register_input(input_task)
-        graph_mutex.release()
+        with construction_lock((self,)):
+            self._register_input(input_task)
 
 
 
@@ -383,16 +433,22 @@ class Ivar(flvar):
     def _notify_done(self): 
         for cb in self._done_callbacks:
             cb(self)
-        self._done_callbacks = []
+        self._done_callbacks = ()
 
     def _fail(self, exceptions):
-        logging.debug("%s failed with exceptions %s" % (repr(self), 
-                                                        repr(exceptions)))
-        if self._state == IVAR_ERROR:
-            self._exception.add_exceptions(exceptions)
-        else:
-            self._state = IVAR_ERROR
-            self._exception = ExecutionException(exceptions)
+        if logflags.DEBUG:
+            logging.debug("%s failed with exceptions %s" % (repr(self), 
+                                                            repr(exceptions)))
+        # Check and change state under the lock, so that tasks registering
+        # concurrently never see IVAR_ERROR without the exception set
+        with ivar_lock(self):
+            already_failed = self._state == IVAR_ERROR
+            if already_failed:
+                self._exception.add_exceptions(exceptions)
+            else:
+                self._state = IVAR_ERROR
+                self._exception = ExecutionException(exceptions)
+        if not already_failed:
             # Should not be possible to call if future already set
             # TODO: set future? 
             self._future.set(ErrorVal)
@@ -417,6 +473,42 @@ class Ivar(flvar):
 
     def _try_readable(self):
         raise UnimplementedException("_try_readable is not implemented")
+
+    def _checkpoint_binding(self):
+        """
+        Data this ivar is bound to, used to identify it in checkpoints
+        if it has no input tasks.  None if unbound.
+        """
+        if self._bound is Unbound:
+            return None
+        return self._bound
+
+    def _checkpoint_location(self):
+        """
+        Location that output ivar will be written to, used to identify it
+        in checkpoints.  None if it doesn't matter where data goes.
+        """
+        return None
+
+    def _checkpoint_value(self, val):
+        """
+        Value to save in checkpoint when val is written to ivar, or
+        checkpoint.NoCheckpoint if it can't be saved.
+        """
+        return val
+
+    def _restorable(self, val):
+        """
+        Check if a value from a checkpoint can be used to fill ivar.
+        """
+        return True
+
+    def _data_size(self):
+        """
+        Size in bytes of the data in the ivar, used to predict runtimes
+        of tasks that read it, or None if unknown.
+        """
+        return None
     
     def set_state(self, state):
         with graph_mutex:
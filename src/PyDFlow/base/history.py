@@ -0,0 +1,324 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+History of task runtimes, kept across runs, used to predict how long
+tasks will take.
+
+While history is on, the runtime of each @func and @app task that
+succeeds is recorded under the task's name, and optionally the size of
+its inputs: the total size in bytes of input files and raw string
+arguments, rounded down to a power of two.  The count, mean, variance,
+minimum and maximum runtime are kept for each name and size, and for
+each name across all sizes.  Statistics are appended to a history file
+as tasks finish and merged when the file is loaded.
+
+Predictions are used:
+ - by priority scheduling (see PyDFlow.base.priority), as the cost of
+   each task, unless another estimator was set.
+ - by the app executor, to only let apps overtake an app waiting for
+   resources if they are predicted to finish before the resources it is
+   waiting for are predicted to be free.
+ - by remaining(), to estimate how long it will take to fill some ivars.
+
+@func tasks run in worker processes are timed from when they are sent
+to a worker process until the result comes back, so the time includes
+sending inputs and results between processes.
+
+@author: Tim Armstrong
+'''
+from __future__ import with_statement
+from states import *
+
+import os
+import math
+import threading
+import logging
+import cPickle
+
+import priority
+import appendlog
+
+# Whether history is on
+ACTIVE = False
+# Path of history file
+HISTORY_PATH = None
+# Whether to keep statistics by input size as well as by name
+BY_SIZE = False
+
+structure_lock = threading.Lock()
+# (name, size bucket or None) -> Stats of runs recorded under that key
+recorded = {}
+# As above, but totals for each name include runs recorded by size
+stats = {}
+# History file open for appending
+history_file = None
+
+class Stats(object):
+    """
+    Summary statistics of runtimes
+    """
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+    def __init__(self, count=0, mean=0.0, m2=0.0, min=None, max=None):
+        self.count = count
+        self.mean = mean
+        # Sum of squared differences from the mean
+        self.m2 = m2
+        self.min = min
+        self.max = max
+
+    def add(self, other):
+        """
+        Merge in the statistics of other runs
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def stddev(self):
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    def as_tuple(self):
+        return (self.count, self.mean, self.m2, self.min, self.max)
+
+    def __repr__(self):
+        return "<Stats n=%d mean=%.3fs sd=%.3fs min=%.3fs max=%.3fs>" % (
+                self.count, self.mean, self.stddev(), self.min, self.max)
+
+def configure(path, by_size=None):
+    """
+    Start recording runtimes in path, loading the history already in the
+    file if it exists.  If path is None, history is turned off.
+    by_size: if True, keep statistics by input size too
+    """
+    global ACTIVE, HISTORY_PATH, BY_SIZE, recorded, stats, history_file
+    with structure_lock:
+        if by_size is not None:
+            BY_SIZE = by_size
+        if history_file is not None:
+            history_file.close()
+            history_file = None
+        ACTIVE = False
+        recorded = {}
+        stats = {}
+        HISTORY_PATH = path
+        if path is None:
+            if priority.ESTIMATOR is predict:
+                priority.set_estimator(None)
+            return
+        history_file = appendlog.open_log(path)
+        entries = load(history_file)
+        if entries > 2 * len(recorded) + 100:
+            compact()
+        logging.debug("Loaded runtime history of %d tasks from %s" %
+                      (len(stats), path))
+        ACTIVE = True
+        if priority.ESTIMATOR is None:
+            priority.set_estimator(predict)
+
+def load(f):
+    """
+    Merge all entries in the history file into stats, returning the
+    number of entries.
+    """
+    entries = appendlog.read(f, "history file")
+    for key, counts in entries:
+        merge(key, Stats(*counts))
+    return len(entries)
+
+def compact():
+    """
+    Rewrite history file with one entry per key.  Must hold structure_lock.
+    """
+    global history_file
+    tmp_path = HISTORY_PATH + ".tmp"
+    f = open(tmp_path, 'wb')
+    try:
+        for key, s in recorded.items():
+            cPickle.dump((key, s.as_tuple()), f, 2)
+    finally:
+        f.close()
+    history_file.close()
+    os.rename(tmp_path, HISTORY_PATH)
+    history_file = open(HISTORY_PATH, 'a+b')
+
+def merge(key, s):
+    """
+    Add statistics s for key.  An entry by size counts towards the total
+    for the name too.  Must hold structure_lock.
+    """
+    for table, keys in ((recorded, [key]),
+                        (stats, set([key, (key[0], None)]))):
+        for k in keys:
+            old = table.get(k)
+            if old is None:
+                old = table[k] = Stats()
+            old.add(s)
+
+def size_bucket(size):
+    """
+    Round size down to a power of two
+    """
+    if size <= 0:
+        return 0
+    return 1 << (int(size).bit_length() - 1)
+
+def input_size(task):
+    """
+    Total size in bytes of the task's inputs that have a known size,
+    or None if none do.
+    """
+    total = None
+    for spec, inp in task._input_iter():
+        if spec.isRaw():
+            size = isinstance(inp, basestring) and len(inp) or None
+        else:
+            size = inp._data_size()
+        if size is not None:
+            total = (total or 0) + size
+    return total
+
+def task_key(task):
+    """
+    Key to look up the task's statistics by size, or None
+    """
+    if not BY_SIZE:
+        return None
+    size = input_size(task)
+    if size is None:
+        return None
+    return (task._taskname, size_bucket(size))
+
+def record(task, seconds):
+    """
+    Record that task ran successfully in seconds.  Should be called
+    without graph_mutex held.
+    """
+    name = task._taskname
+    if name is None:
+        return
+    key = task_key(task) or (name, None)
+    s = Stats(1, seconds, 0.0, seconds, seconds)
+    data = cPickle.dumps((key, s.as_tuple()), 2)
+    with structure_lock:
+        if history_file is None:
+            return
+        merge(key, s)
+        history_file.write(data)
+        history_file.flush()
+
+def lookup(name, size=None):
+    """
+    Return statistics for name, for inputs of roughly size bytes if
+    known, or None if it never ran
+    """
+    with structure_lock:
+        if size is not None:
+            s = stats.get((name, size_bucket(size)))
+            if s is not None:
+                return s
+        return stats.get((name, None))
+
+def predict(task):
+    """
+    Predicted runtime of task in seconds, or None if unknown.  Used as
+    priority estimator.
+    """
+    name = task._taskname
+    if name is None or not ACTIVE:
+        return None
+    key = task_key(task)
+    with structure_lock:
+        s = None
+        if key is not None:
+            s = stats.get(key)
+        if s is None:
+            s = stats.get((name, None))
+        if s is None:
+            return None
+        return s.mean
+
+def remaining(ivars, parallelism=None):
+    """
+    Estimate how long it will take to fill ivars, from the predicted
+    runtimes of the unfinished tasks they depend on.  Tasks that never
+    ran before are assumed to take the mean of the predictions of those
+    that did.  Running tasks are counted in full.  Returns a dictionary
+    with:
+        tasks: number of unfinished tasks
+        unknown: number with no history
+        total: sum of predicted runtimes
+        critical_path: predicted runtime of longest chain of tasks
+        estimate: the greater of critical_path and total / parallelism,
+            where parallelism defaults to the number of worker threads
+    Must be called without graph_mutex held.
+    """
+    from PyDFlow.base.mutex import graph_mutex
+    import LocalExecutor
+    if parallelism is None:
+        parallelism = LocalExecutor.NUM_THREADS
+    with graph_mutex:
+        # Find unfinished tasks upstream of ivars
+        tasks = []
+        seen = set()
+        stack = [priority.producer(iv) for iv in ivars]
+        while stack:
+            t = stack.pop()
+            if t is None or t in seen:
+                continue
+            seen.add(t)
+            tasks.append(t)
+            stack.extend(priority.producers(t))
+        predicted = dict([(t, predict(t)) for t in tasks])
+        known = [p for p in predicted.values() if p is not None]
+        default = known and sum(known) / len(known) or 0.0
+        for t in tasks:
+            if predicted[t] is None:
+                predicted[t] = default
+        # Longest path to each task, visiting inputs before outputs
+        finish = {}
+        for t in tasks:
+            if t in finish:
+                continue
+            stack = [t]
+            while stack:
+                u = stack[-1]
+                if u in finish:
+                    stack.pop()
+                    continue
+                ps = priority.producers(u)
+                pending = [p for p in ps if p not in finish]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                finish[u] = predicted[u] + max([0.0] + [finish[p]
+                                                        for p in ps])
+                stack.pop()
+    total = sum(predicted.values())
+    critical_path = max([0.0] + finish.values())
+    return {'tasks': len(tasks), 'unknown': len(tasks) - len(known),
+            'total': total, 'critical_path': critical_path,
+            'estimate': max(critical_path, total / max(parallelism, 1))}
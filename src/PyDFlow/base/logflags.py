@@ -0,0 +1,42 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Flags saying whether debug and info logging are enabled, for guarding
+log calls in the scheduler's hot paths, e.g.
+    if logflags.DEBUG:
+        logging.debug("%s finished" % repr(task))
+Checking a flag costs much less than formatting a message only for the
+logging module to throw it away.
+
+The flags follow the level of the root logger at the time refresh() was
+last called.  This is done when the worker pool starts and whenever
+PyDFlow.configure() or one of the other configure functions in
+PyDFlow.base.config is called, so if the logging level is changed after
+tasks have started running, call configure() to pick up the change.
+
+@author: Tim Armstrong
+'''
+import logging
+
+DEBUG = False
+INFO = False
+
+def refresh():
+    global DEBUG, INFO
+    root = logging.getLogger()
+    DEBUG = root.isEnabledFor(logging.DEBUG)
+    INFO = root.isEnabledFor(logging.INFO)
+
+refresh()
@@ -0,0 +1,162 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Registry of metrics about the state of the PyDFlow runtime, e.g. queue
+depths, work stealing and app launching.
+
+Metrics are registered with a function that reads the current value
+when the metrics are collected, so nothing is done to maintain them
+between collections apart from the counters the executors keep anyway.
+A collect function returns either a number, or a list of (labels, value)
+pairs, where labels is a dictionary, for metrics with a value per
+worker thread, etc.
+
+The metrics can be read with snapshot(), formatted in the Prometheus
+text format with prometheus_text(), or served over HTTP with serve().
+
+@author: Tim Armstrong
+'''
+from __future__ import with_statement
+import threading
+import logging
+import BaseHTTPServer
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+
+registry_lock = threading.Lock()
+# name -> (kind, help, collect function), in order of registration
+registry = {}
+names = []
+
+server = None
+server_thread = None
+
+def register(name, kind, help, collect):
+    """
+    Add a metric to the registry, replacing any with the same name
+    """
+    if kind not in (COUNTER, GAUGE):
+        raise ValueError("Invalid metric kind %s" % repr(kind))
+    with registry_lock:
+        if name not in registry:
+            names.append(name)
+        registry[name] = (kind, help, collect)
+
+def unregister(name):
+    with registry_lock:
+        if name in registry:
+            del registry[name]
+            names.remove(name)
+
+def collect():
+    """
+    Read all metrics.  Returns a list of (name, kind, help, samples),
+    where samples is a list of (labels, value).
+    """
+    with registry_lock:
+        metrics = [(name,) + registry[name] for name in names]
+    res = []
+    for name, kind, help, fn in metrics:
+        try:
+            value = fn()
+        except Exception, e:
+            logging.error("Could not collect metric %s: %s" % (name,
+                                                             repr(e)))
+            continue
+        if isinstance(value, list):
+            samples = value
+        else:
+            samples = [({}, value)]
+        res.append((name, kind, help, samples))
+    return res
+
+def label_string(labels):
+    return ','.join(['%s="%s"' % (k, str(v).replace('\\', '\\\\')
+                                          .replace('"', '\\"'))
+                     for k, v in sorted(labels.items())])
+
+def snapshot():
+    """
+    Return a dictionary of the current value of each metric.  For
+    metrics with labels, the value is a dictionary from the label
+    string, e.g. 'worker="pyfun_thread_0"', to the value.
+    """
+    res = {}
+    for name, kind, help, samples in collect():
+        if len(samples) == 1 and not samples[0][0]:
+            res[name] = samples[0][1]
+        else:
+            res[name] = dict([(label_string(labels), value)
+                              for labels, value in samples])
+    return res
+
+def prometheus_text():
+    """
+    Return all metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for name, kind, help, samples in collect():
+        lines.append("# HELP %s %s" % (name, help))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for labels, value in samples:
+            if labels:
+                lines.append("%s{%s} %s" % (name, label_string(labels),
+                                            repr(float(value))))
+            else:
+                lines.append("%s %s" % (name, repr(float(value))))
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = prometheus_text()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Metrics server: " + format % args)
+
+def serve(port, host='127.0.0.1'):
+    """
+    Serve the metrics in Prometheus format over HTTP on port, replacing
+    any server already running.  Port 0 picks a free port.  Returns the
+    port number.
+    """
+    global server, server_thread
+    stop()
+    server = BaseHTTPServer.HTTPServer((host, port), MetricsHandler)
+    server_thread = threading.Thread(target=server.serve_forever,
+                                     name="pydflow_metrics")
+    server_thread.setDaemon(True)
+    server_thread.start()
+    logging.debug("Serving metrics on %s:%d" % (host, server.server_port))
+    return server.server_port
+
+def stop():
+    """
+    Stop serving metrics
+    """
+    global server, server_thread
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        server_thread.join()
+        server = server_thread = None
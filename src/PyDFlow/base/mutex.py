@@ -53,3 +53,128 @@ class LogLock(object):
 
 graph_mutex = Lock()
 #graph_mutex = LogLock()
+
+
+#==============================================#
+# LOCK STRIPING
+#==============================================#
+# In the default LOCK_GLOBAL mode, every change to the flowgraph is
+# serialized on graph_mutex.  In LOCK_STRIPED mode, wiring new tasks
+# into the graph only takes a small set of per-ivar locks, picked from
+# a fixed table of stripes by object id, so that graph construction can
+# proceed in parallel with execution of unrelated parts of the graph.
+#
+# Striping only covers graph construction.  Execution (_spark, makeframe,
+# _set, _input_readable and the worker search for runnable tasks) still
+# holds graph_mutex in both modes, since it walks arbitrary chains of
+# tasks and ivars.  Execution of unrelated subgraphs is therefore still
+# serialized, and the stripes are only taken inside it around the state
+# changes that race with construction.
+#
+# Lock ordering:
+#   1. graph_mutex
+#   2. stripe locks, in ascending stripe index order
+# A thread holding a stripe lock must never try to acquire graph_mutex.
+LOCK_GLOBAL, LOCK_STRIPED = range(2)
+
+NUM_STRIPES = 64
+
+lock_mode = LOCK_GLOBAL
+
+
+class NullLock(object):
+    """
+    Stands in for a lock when the caller already holds graph_mutex.
+    """
+    def acquire(self, blocking=True):
+        return True
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+null_lock = NullLock()
+
+
+class StripedLocks(object):
+    """
+    A fixed table of locks.  Each object hashes to one of the locks
+    by id.  Multiple objects are locked by acquiring all of their distinct
+    stripes in ascending index order, so that two threads locking
+    overlapping sets of objects can never deadlock.
+    """
+    def __init__(self, nstripes=NUM_STRIPES):
+        self.nstripes = nstripes
+        self.locks = [Lock() for i in range(nstripes)]
+
+    def index(self, obj):
+        # Low bits of id are mostly zero due to alignment
+        return (id(obj) >> 4) % self.nstripes
+
+    def lock_for(self, obj):
+        return self.locks[self.index(obj)]
+
+    def locked(self, objs):
+        """
+        Return a context manager which holds the stripes for all of objs
+        """
+        ixs = sorted(set([self.index(o) for o in objs]))
+        return StripeSet([self.locks[i] for i in ixs])
+
+
+class StripeSet(object):
+    def __init__(self, locks):
+        # locks must already be sorted in stripe order
+        self.locks = locks
+
+    def __enter__(self):
+        for l in self.locks:
+            l.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for l in reversed(self.locks):
+            l.release()
+        return False
+
+stripes = StripedLocks()
+
+
+def set_lock_mode(mode):
+    """
+    Choose between LOCK_GLOBAL and LOCK_STRIPED.  LOCK_STRIPED only lets
+    graph construction run in parallel with execution: execution itself
+    is serialized on graph_mutex in both modes.  This should be called
+    before any tasks are created: switching modes while the graph is being
+    modified by another thread is not safe.
+    """
+    global lock_mode
+    if mode not in (LOCK_GLOBAL, LOCK_STRIPED):
+        raise ValueError("Invalid lock mode %s" % repr(mode))
+    lock_mode = mode
+
+def construction_lock(*obj_lists):
+    """
+    Lock to hold while connecting a new task to the ivars in obj_lists.
+    graph_mutex should not be held when calling.
+    """
+    if lock_mode == LOCK_STRIPED:
+        return stripes.locked([o for objs in obj_lists for o in objs])
+    else:
+        return graph_mutex
+
+def ivar_lock(*ivars):
+    """
+    Lock to hold while modifying the task lists or the state of ivars.
+    graph_mutex should already be held when calling.
+    """
+    if lock_mode == LOCK_STRIPED:
+        if len(ivars) == 1:
+            return stripes.lock_for(ivars[0])
+        return stripes.locked(ivars)
+    else:
+        return null_lock
@@ -19,41 +19,21 @@ from __future__ import with_statement
 import Queue
 from itertools import islice, imap, izip
 import logging
-import heapq
 from PyDFlow.base.mutex import graph_mutex
+from PyDFlow.base.stream import Stream, DEFAULT_MAX_RUNNING
 
 def resultlist(ivars, max_ready=None):
     """
     Take a bunch of ivars, start them running and return results in 
-    in the order provided
+    in the order provided.
+
+    max_ready limits the number of tasks that will be launched at
+    one time, and the number of finished results held until earlier
+    ones finish.  None or 0 means no limit.
     """
-    # Use the resultset as the execution mechanism and reassemble into
-    # correct order here
-    next_id = 0
-    
-    # Heap of results to be returns
-    done = []
-    
-    class HeapObj:
-        def __init__(self, ix, item):
-            self.ix = ix
-            self.item = item
-            
-        def __cmp__(self, oth):
-            return cmp(self.ix, oth.ix)
-    
-    for i, res in resultset(ivars, max_ready=max_ready):
-        if i == next_id:
-            yield res
-            next_id += 1
-            while len(done) > 0 and done[0].ix == next_id:
-                ho = heapq.heappop(done)
-                yield ho.item
-                next_id += 1
-        else:
-            heapq.heappush(done, HeapObj(i, res))
-    while len(done) > 0:
-        yield heapq.heappop(done).item
+    if not max_ready:
+        max_ready = None
+    return iter(Stream(ivars, max_running=max_ready))
         
 def resultset(ivars, ivar_ids=None, max_ready=None):
     """
@@ -171,6 +151,154 @@ def dynreduce(reducefun, args):
     return finishedq.get()
 
 
+class ReduceItem(object):
+    """
+    Partial result of lazyreduce: the reduction of inputs lo..hi-1
+    """
+    __slots__ = ('ivar', 'lo', 'hi', 'level')
+    def __init__(self, ivar, lo, hi, level):
+        self.ivar = ivar
+        self.lo = lo
+        self.hi = hi
+        self.level = level
+
+def lazyreduce(reducefun, args, fanin=2, ordered=True,
+               max_running=DEFAULT_MAX_RUNNING):
+    """
+    Reduce args with reducefun, building the reduction tasks as the
+    inputs and partial results finish.
+
+    reducefun should take between 2 and fanin arguments, e.g. a merge
+    function taking any number of sorted inputs.  It must be
+    associative, and also commutative if ordered is False.  If ordered
+    is True, only partial results of adjacent ranges of args are
+    combined, so the order of args is preserved.  Otherwise whichever
+    partial results are finished are combined.  In both cases partial
+    results at the same level of the tree are preferred, so that
+    siblings are combined and the tree stays balanced.
+
+    args can be any iterable of ivars, including a generator: only
+    max_running inputs and partial results (None for no limit) are
+    evaluated at once, and args is only consumed as there is room.
+    The same ivar may appear more than once in args.
+
+    The reduction is driven from the calling thread, so this blocks
+    until all of args have been consumed and only the final combining
+    task is left to run, which it returns the ivar for.  Call it from
+    another thread to do something else meanwhile.
+    """
+    if fanin < 2:
+        raise ValueError("fanin for lazyreduce must be at least 2")
+    if max_running is not None and max_running <= 0:
+        raise ValueError("max_running must be positive")
+    finishedq = Queue.Queue()
+    def callback(ivar):
+        finishedq.put(ivar)
+
+    args = iter(args)
+    args_done = False
+    nargs = 0
+    # ivar -> ReduceItems for it, as the same ivar can appear more than once
+    running = {}
+    # Number of items running, in a list so that start() can update it
+    nrunning = [0]
+    # Finished items: if ordered, indexed by both lo and hi so that
+    # neighbours can be found.  Otherwise lists by level
+    by_lo = {}
+    by_hi = {}
+    by_level = {}
+
+    def start(item):
+        nrunning[0] += 1
+        running.setdefault(item.ivar, []).append(item)
+        # One callback per spark, so one item finishes per callback
+        item.ivar.spark(done_callback=callback)
+
+    def combine(items):
+        ivar = reducefun(*[it.ivar for it in items])
+        start(ReduceItem(ivar, items[0].lo, items[-1].hi,
+                         max([it.level for it in items]) + 1))
+
+    def add_ordered(item):
+        by_lo[item.lo] = item
+        by_hi[item.hi] = item
+        # Find the run of adjacent finished items containing item
+        run = [item]
+        while run[0].lo in by_hi:
+            run.insert(0, by_hi[run[0].lo])
+        while run[-1].hi in by_lo:
+            run.append(by_lo[run[-1].hi])
+        if len(run) < fanin:
+            return
+        # Combine the fanin adjacent items including this one which
+        # are lowest in the tree
+        pos = run.index(item)
+        first = min(range(max(0, pos - fanin + 1),
+                          min(pos, len(run) - fanin) + 1),
+                    key=lambda i: sum([it.level for it in run[i:i+fanin]]))
+        group = run[first:first+fanin]
+        for it in group:
+            del by_lo[it.lo]
+            del by_hi[it.hi]
+        combine(group)
+
+    def add_unordered(item):
+        siblings = by_level.setdefault(item.level, [])
+        siblings.append(item)
+        if len(siblings) == fanin:
+            del by_level[item.level]
+            combine(siblings)
+
+    def finish_unordered():
+        """
+        Combine the lowest leftover items when nothing else is running
+        """
+        leftover = []
+        for level in sorted(by_level.keys()):
+            leftover.extend(by_level.pop(level))
+        group = leftover[:fanin]
+        for it in leftover[fanin:]:
+            by_level.setdefault(it.level, []).append(it)
+        return group
+
+    while True:
+        while (not args_done and 
+               (max_running is None or nrunning[0] < max_running)):
+            try:
+                arg = args.next()
+            except StopIteration:
+                args_done = True
+                break
+            start(ReduceItem(arg, nargs, nargs + 1, 0))
+            nargs += 1
+
+        if nrunning[0] == 0:
+            if ordered:
+                # Leftovers are a single run shorter than fanin
+                group = [by_lo[lo] for lo in sorted(by_lo.keys())]
+                by_lo.clear()
+                by_hi.clear()
+            else:
+                group = finish_unordered()
+            if len(group) == 0:
+                raise ValueError("Zero length iterable provided to lazyreduce")
+            elif len(group) == 1 and not by_level:
+                return group[0].ivar
+            combine(group)
+            continue
+
+        ivar = finishedq.get()
+        items = running[ivar]
+        item = items.pop()
+        if not items:
+            del running[ivar]
+        nrunning[0] -= 1
+        if ordered:
+            add_ordered(item)
+        else:
+            add_unordered(item)
+
+
 def waitall(*args):
     """
     args can be ivars or iterable containers of ivars
@@ -0,0 +1,190 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Critical path estimates for priority scheduling.
+
+When priority scheduling is on, the length of the longest chain of
+unfinished tasks through each task is used to decide what to run first,
+so that long chains are started early:
+ - the local executor searches first through the input with the longest
+   chain of tasks upstream of it (the upstream length), which also
+   decides which frames are left on the deques, and thieves steal from
+   the deque whose oldest frame has the longest upstream length.
+ - the app executor launches the queued app with the longest chain of
+   tasks downstream of it (its bottom level) out of those that fit.
+
+Each task costs 1 unless an estimator is set with set_estimator(), which
+is called with a task and returns its expected runtime in seconds, or
+None if it doesn't know.  Lengths are computed when first needed and
+cached on the task.  Cached lengths are discarded when the estimator
+changes, when ivars are replaced, and, for bottom levels, when tasks
+are added to the graph.  They are not updated as tasks finish or as
+the estimator's predictions change, so are overestimates until then.
+The graph mutex must be held while computing them.
+
+@author: Tim Armstrong
+'''
+from __future__ import with_statement
+import threading
+
+from PyDFlow.base.states import *
+
+# Whether priority scheduling is on
+ACTIVE = False
+# Function from task to estimated runtime, or None
+ESTIMATOR = None
+DEFAULT_COST = 1.0
+
+# Indices into cached lengths
+UP, DOWN = range(2)
+# Generation of cached lengths of each kind.  A cached length is only
+# valid if it was stored in the current generation.  Only modify with
+# generation_lock held.
+generations = [0, 0]
+generation_lock = threading.Lock()
+
+def configure(active):
+    global ACTIVE
+    ACTIVE = active
+
+def set_estimator(estimator):
+    """
+    Set function used to estimate task runtimes, or None to count each
+    task as 1.
+    """
+    global ESTIMATOR
+    ESTIMATOR = estimator
+    invalidate(UP, DOWN)
+
+def invalidate(*which):
+    """
+    Discard cached lengths of the given kinds, for when the graph changes.
+    Doesn't need the graph mutex.
+    """
+    with generation_lock:
+        for w in which:
+            generations[w] += 1
+
+def cost(task):
+    if ESTIMATOR is not None:
+        est = ESTIMATOR(task)
+        if est is not None:
+            return est
+    return DEFAULT_COST
+
+def cached(task, which, generation=None):
+    if generation is None:
+        generation = generations[which]
+    lengths = getattr(task, '_cpath', None)
+    if lengths is None or lengths[which + 2] != generation:
+        return None
+    return lengths[which]
+
+def store(task, which, value, generation):
+    # [up, down, generation of up, generation of down]
+    lengths = getattr(task, '_cpath', None)
+    if lengths is None:
+        lengths = task._cpath = [None, None, None, None]
+    lengths[which] = value
+    lengths[which + 2] = generation
+
+def producer(ivar):
+    """
+    The task that still has to run to fill ivar, or None
+    """
+    in_tasks = ivar._in_tasks
+    if not in_tasks:
+        return None
+    task = in_tasks[0]
+    if task._state in (T_DONE_SUCCESS, T_ERROR):
+        return None
+    return task
+
+def producers(task):
+    if task._state == T_RUNNING:
+        # Inputs were already used
+        return []
+    res = []
+    for spec, ch in task._input_iter():
+        if not spec.isRaw():
+            p = producer(ch)
+            if p is not None:
+                res.append(p)
+    return res
+
+def consumers(task):
+    res = []
+    for o in task._outputs:
+        # Cleared once ivar is finished
+        res.extend([c for c in (o._out_tasks or ())
+                    if c._state not in (T_DONE_SUCCESS, T_ERROR)])
+    return res
+
+def longest_path(task, which, neighbours):
+    """
+    Length of longest path starting at task through neighbours,
+    including the cost of task.  Iterative to cope with long chains.
+    The whole search uses the generation current when it started, so
+    that lengths invalidated part way through (e.g. by tasks being added
+    in striped lock mode) are consistent, and recomputed next time.
+    """
+    gen = generations[which]
+    value = cached(task, which, gen)
+    if value is not None:
+        return value
+    stack = [task]
+    while stack:
+        t = stack[-1]
+        if cached(t, which, gen) is not None:
+            stack.pop()
+            continue
+        ns = neighbours(t)
+        pending = [n for n in ns if cached(n, which, gen) is None]
+        if pending:
+            stack.extend(pending)
+            continue
+        longest = 0.0
+        for n in ns:
+            longest = max(longest, cached(n, which, gen))
+        store(t, which, cost(t) + longest, gen)
+        stack.pop()
+    return cached(task, which, gen)
+
+def upstream(ivar):
+    """
+    Estimated time for the longest chain of unfinished tasks needed to
+    fill ivar
+    """
+    task = producer(ivar)
+    if task is None:
+        return 0.0
+    return longest_path(task, UP, producers)
+
+def cached_upstream(ivar):
+    """
+    Upstream length of ivar if already computed, otherwise 0.  Doesn't
+    need the graph mutex.
+    """
+    in_tasks = ivar._in_tasks
+    if not in_tasks:
+        return 0.0
+    return cached(in_tasks[0], UP) or 0.0
+
+def bottom_level(task):
+    """
+    Estimated time for the longest chain of unfinished tasks starting
+    with task
+    """
+    return longest_path(task, DOWN, consumers)
@@ -0,0 +1,177 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Streams of ivars which are evaluated a bounded number at a time.
+
+A stream pulls ivars from a source iterable only as they are needed,
+passes them through a pipeline of map and filter stages and yields the
+finished ivars.  At most max_running ivars are being evaluated at a
+time and at most max_buffered finished ivars are held waiting for
+earlier ones to finish (if ordered) or the consumer to ask for them, so
+a pipeline over a huge or infinite generator runs in constant memory.
+If the consumer stops iterating, no more inputs are pulled.  If an ivar
+fails before reaching a filter, the exception is raised by the iterator.
+
+E.g.
+    s = Stream(py_ivar(x) for x in huge_generator(), max_running=16)
+    for result in s.map(process).filter(lambda x: x > 0).map(summarize):
+        print result.get()
+
+@author: Tim Armstrong
+'''
+import Queue
+
+DEFAULT_MAX_RUNNING = 64
+
+class Stage(object):
+    """
+    A run of map functions followed by an optional filter predicate.
+    Ivars only need to be evaluated before a filter or at the end.
+    """
+    def __init__(self, maps, pred):
+        self.maps = maps
+        self.pred = pred
+
+class Stream(object):
+    def __init__(self, source, max_running=DEFAULT_MAX_RUNNING,
+                 max_buffered=None, ordered=True, _stages=None):
+        """
+        source: iterable of ivars.  Streams derived from this one with
+                map or filter share the source, so if it is an
+                iterator, only one of them can be iterated over.
+        max_running: number of ivars to evaluate at once, None for
+                no limit
+        max_buffered: number of finished ivars to hold before they
+                can be returned, None to use max_running
+        ordered: if True, results come out in same order as source,
+                otherwise in order of completion
+        """
+        if max_running is not None and max_running <= 0:
+            raise ValueError("max_running must be positive")
+        if max_buffered is None:
+            max_buffered = max_running
+        elif max_buffered <= 0:
+            raise ValueError("max_buffered must be positive")
+        self.source = source
+        self.max_running = max_running
+        self.max_buffered = max_buffered
+        self.ordered = ordered
+        if _stages is None:
+            _stages = [Stage([], None)]
+        self.stages = _stages
+
+    def _extend(self, stages):
+        return Stream(self.source, self.max_running, self.max_buffered,
+                      self.ordered, stages)
+
+    def map(self, fn):
+        """
+        Return a stream with fn applied to each ivar.  fn should take an
+        ivar and return an ivar, e.g. a @func or @app function.
+        """
+        last = self.stages[-1]
+        if last.pred is None:
+            stages = self.stages[:-1] + [Stage(last.maps + [fn], None)]
+        else:
+            stages = self.stages + [Stage([fn], None)]
+        return self._extend(stages)
+
+    def filter(self, pred):
+        """
+        Return a stream with only the ivars for which pred is true of
+        the ivar's value.
+        """
+        last = self.stages[-1]
+        if last.pred is None:
+            stages = self.stages[:-1] + [Stage(last.maps, pred)]
+        else:
+            stages = self.stages + [Stage([], pred)]
+        return self._extend(stages)
+
+    def values(self):
+        """
+        Iterate over values of the stream's ivars
+        """
+        for iv in self:
+            yield iv.get()
+
+    def __iter__(self):
+        finishedq = Queue.Queue()
+        def callback(ivar):
+            finishedq.put(ivar)
+
+        stages = self.stages
+        max_running = self.max_running
+        max_buffered = self.max_buffered
+        ordered = self.ordered
+        source = iter(self.source)
+        source_done = False
+
+        # Ivars being evaluated: ivar -> (sequence number, stage index)
+        running = {}
+        # Finished results not yet returned: sequence number -> ivar,
+        # or None if filtered out
+        buffered = {}
+        next_in = 0 # sequence number of next input
+        next_out = 0 # sequence number of next output if ordered
+
+        def start(seq, stage_ix, iv):
+            """
+            Apply maps for stage and start ivar running
+            """
+            for fn in stages[stage_ix].maps:
+                iv = fn(iv)
+            running[iv] = (seq, stage_ix)
+            iv.spark(done_callback=callback)
+
+        while True:
+            # Pull in more work while there is room
+            while (not source_done and
+                   (max_running is None or len(running) < max_running) and
+                   (max_buffered is None or len(buffered) < max_buffered)):
+                try:
+                    iv = source.next()
+                except StopIteration:
+                    source_done = True
+                    break
+                start(next_in, 0, iv)
+                next_in += 1
+
+            if ordered:
+                while next_out in buffered:
+                    iv = buffered.pop(next_out)
+                    next_out += 1
+                    if iv is not None:
+                        yield iv
+            else:
+                for iv in buffered.values():
+                    if iv is not None:
+                        yield iv
+                buffered.clear()
+
+            if not running:
+                if source_done:
+                    return
+                continue
+
+            iv = finishedq.get()
+            seq, stage_ix = running.pop(iv)
+            pred = stages[stage_ix].pred
+            if pred is not None and not pred(iv.get()):
+                buffered[seq] = None
+            elif stage_ix + 1 < len(stages):
+                start(seq, stage_ix + 1, iv)
+            else:
+                buffered[seq] = iv
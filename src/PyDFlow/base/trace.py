@@ -0,0 +1,208 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tracing of task execution.
+
+While tracing is on, the times at which each task was created, had all
+of its inputs ready (T_DATA_READY), was picked up by a worker thread
+(T_QUEUED), started running (T_RUNNING) and finished (T_DONE_SUCCESS or
+T_ERROR) are recorded, along with the thread that ran it and how the
+worker got hold of it:
+    new: from the queue of ivars sparked by other threads
+    resume: from the resume queue, after the tasks it was waiting on
+            finished
+    deque: from the worker's own deque
+    steal: stolen from another worker's deque
+    continuation: run straight after the task it was waiting on
+@app tasks are shown as run by the "apps" thread.
+
+The trace can be written as a Chrome trace file, which can be viewed in
+chrome://tracing or Perfetto.  Tasks are kept alive by the trace until
+they finish.
+
+@author: Tim Armstrong
+'''
+from __future__ import with_statement
+import os
+import time
+import json
+import atexit
+import logging
+import threading
+
+# Whether tracing is on
+ACTIVE = False
+# File to write Chrome trace to on exit
+TRACE_PATH = None
+
+APP_THREAD = "apps"
+
+SOURCE_NEW = "new"
+SOURCE_RESUME = "resume"
+SOURCE_DEQUE = "deque"
+SOURCE_STEAL = "steal"
+SOURCE_CONTINUATION = "continuation"
+
+# Indices into in-flight records
+CREATED, READY, QUEUED, RUNNING, THREAD, SOURCE = range(6)
+
+trace_lock = threading.Lock()
+# task -> record of tasks that have not finished
+in_flight = {}
+# Records of finished tasks
+finished = []
+exit_registered = False
+
+def configure(active, path=None):
+    """
+    Turn tracing on or off.  If path is provided, a Chrome trace is
+    written to it when the program exits.
+    """
+    global ACTIVE, TRACE_PATH, exit_registered
+    with trace_lock:
+        ACTIVE = active
+        TRACE_PATH = path
+        if path is not None and not exit_registered:
+            atexit.register(write_at_exit)
+            exit_registered = True
+
+def clear():
+    """
+    Discard everything traced so far
+    """
+    with trace_lock:
+        in_flight.clear()
+        del finished[:]
+
+def task_created(task, ready):
+    rec = [time.time(), None, None, None, None, None]
+    if ready:
+        rec[READY] = rec[CREATED]
+    with trace_lock:
+        in_flight[task] = rec
+
+def task_ready(task):
+    rec = in_flight.get(task)
+    if rec is not None and rec[READY] is None:
+        rec[READY] = time.time()
+
+def task_queued(task, source):
+    rec = in_flight.get(task)
+    if rec is not None:
+        rec[QUEUED] = time.time()
+        rec[SOURCE] = source
+
+def task_running(task, thread=None):
+    rec = in_flight.get(task)
+    if rec is not None:
+        rec[RUNNING] = time.time()
+        if thread is None:
+            thread = threading.currentThread().getName()
+        rec[THREAD] = thread
+
+def task_done(task, success):
+    now = time.time()
+    with trace_lock:
+        rec = in_flight.pop(task, None)
+        if rec is None:
+            return
+        finished.append({'name': task._taskname,
+                         'kind': type(task).__name__,
+                         'created': rec[CREATED], 'ready': rec[READY],
+                         'queued': rec[QUEUED], 'running': rec[RUNNING],
+                         'done': now, 'thread': rec[THREAD],
+                         'source': rec[SOURCE], 'success': success})
+
+def records():
+    """
+    Return a list of dictionaries describing each finished task, in the
+    order they finished.  Times are from time.time(), and are None if
+    the task never reached that state.
+    """
+    with trace_lock:
+        return [dict(r) for r in finished]
+
+def assign_lanes(recs):
+    """
+    Work out the track to show each task on.  Tasks run by a thread go
+    on that thread's track.  Tasks on the app thread may overlap, so are
+    spread over numbered tracks.
+    """
+    lanes = []
+    # End times of the tasks last put on each app track
+    app_tracks = []
+    for r in sorted(recs, key=lambda r: r['running']):
+        if r['thread'] == APP_THREAD:
+            for i, end in enumerate(app_tracks):
+                if end <= r['running']:
+                    break
+            else:
+                i = len(app_tracks)
+                app_tracks.append(None)
+            app_tracks[i] = r['done']
+            lanes.append(("%s_%d" % (APP_THREAD, i), r))
+        else:
+            lanes.append((r['thread'], r))
+    return lanes
+
+def chrome_trace():
+    """
+    Return the trace of finished tasks as a Chrome trace object
+    """
+    recs = [r for r in records() if r['running'] is not None]
+    pid = os.getpid()
+    events = []
+    if not recs:
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+    start = min([r['created'] for r in recs])
+    def us(t):
+        return int((t - start) * 1e6)
+    tids = {}
+    for lane, r in assign_lanes(recs):
+        tid = tids.get(lane)
+        if tid is None:
+            tid = tids[lane] = len(tids) + 1
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                           'tid': tid, 'args': {'name': lane}})
+        args = {'source': r['source'], 'success': r['success'],
+                'created_us': us(r['created'])}
+        if r['ready'] is not None:
+            args['ready_us'] = us(r['ready'])
+        if r['queued'] is not None:
+            args['queued_us'] = us(r['queued'])
+        events.append({'name': r['name'], 'cat': r['kind'], 'ph': 'X',
+                       'pid': pid, 'tid': tid, 'ts': us(r['running']),
+                       'dur': us(r['done']) - us(r['running']),
+                       'args': args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def write_chrome_trace(path):
+    """
+    Write trace of finished tasks to path in Chrome trace format
+    """
+    trace = chrome_trace()
+    f = open(path, 'w')
+    try:
+        json.dump(trace, f)
+    finally:
+        f.close()
+
+def write_at_exit():
+    if TRACE_PATH is not None:
+        try:
+            write_chrome_trace(TRACE_PATH)
+        except (IOError, OSError), e:
+            logging.error("Could not write trace to %s: %s" % (TRACE_PATH,
+                                                             repr(e)))
@@ -19,7 +19,7 @@ from __future__ import with_statement
 import logging
 
 from PyDFlow.types.logical import Placeholder  
-from PyDFlow.base.mutex import graph_mutex
+from PyDFlow.base.mutex import graph_mutex, ivar_lock
 from PyDFlow.writeonce import WriteOnceVar
 from PyDFlow.base.flowgraph import Ivar
 from PyDFlow.base.atomic import AtomicTask
@@ -162,6 +162,8 @@ class IvarPlaceholder(Placeholder, Ivar):
             return False  
         
 class CompoundTask(AtomicTask):
+    __slots__ = ('_func', '_compound', '_return_ivars')
+
     """
     """
     def __init__(self, func, *args, **kwargs):
@@ -208,7 +210,8 @@ class CompoundTask(AtomicTask):
             # TODO: redundant?
             self._return_ivars = return_ivars
             for i, old, new in zip(range(len(self._outputs)), self._outputs, return_ivars):
-                old._replacewith(new) 
+                with ivar_lock(old, new):
+                    old._replacewith(new) 
                 #self._outputs[i] = new
             
             
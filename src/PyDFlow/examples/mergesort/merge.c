@@ -1,75 +1,86 @@
 #include <stdio.h>
 #include <stdlib.h>
-/* Merges two files of integers
+/* Merges any number of sorted files of integers:
+ *      merge in1 [in2 ...] out
+ * The next integer from each input is kept in a heap, so each merge
+ * reads and writes all of the data once regardless of the fan-in.
  * */
+
+struct head {
+    int val;
+    FILE *in;
+};
+
+/* Restore heap order below position i */
+static void sift_down(struct head *heap, int n, int i) {
+    struct head tmp = heap[i];
+    while (1) {
+        int child = 2 * i + 1;
+        if (child >= n) {
+            break;
+        }
+        if (child + 1 < n && heap[child + 1].val < heap[child].val) {
+            child++;
+        }
+        if (tmp.val <= heap[child].val) {
+            break;
+        }
+        heap[i] = heap[child];
+        i = child;
+    }
+    heap[i] = tmp;
+}
+
 int main(int argc, char **argv) {
-    FILE *in1, *in2, *out;
+    FILE *out;
     int count = 0;
-    if (argc != 4) {
-        fprintf(stderr, "Requires 3 arguments\n");
-        exit(1);
-    }
-    if (!(in1 = fopen(argv[1], "r")))  {
-        fprintf(stderr, "Could not open %s\n", argv[1]);
+    int ninputs = argc - 2;
+    int n = 0; // inputs with data left
+    int i;
+    struct head *heap;
+    if (argc < 3) {
+        fprintf(stderr, "Requires at least 2 arguments: inputs and output\n");
         exit(1);
     }
-    if (!(in2 = fopen(argv[2], "r")))  {
-        fprintf(stderr, "Could not open %s\n", argv[2]);
+    if (!(heap = malloc(sizeof(struct head) * ninputs))) {
+        fprintf(stderr, "Out of memory\n");
         exit(1);
     }
-    if (!(out = fopen(argv[3], "w")))  {
-        fprintf(stderr, "Could not open %s\n", argv[3]);
-        exit(1);
-    }
-
-    int n1, n2;
-    FILE *in_rem; // File with remainder of input
-    int both_open = 1;
-    if (fscanf(in1, "%d", &n1) == 1) {
-        if (fscanf(in2, "%d", &n2) == 1) {
-            // Both files open - start merging
-            while (both_open) {
-                if (n1 <= n2) {
-                    fprintf(out, "%d\n", n1);
-                    count ++;
-                    if (fscanf(in1, "%d", &n1) != 1) {
-                        both_open = 0;
-                        fclose(in1);
-                        in_rem = in2;
-                        fprintf(out, "%d\n", n2);
-                        count++;
-                    }
-                }
-                else {
-                    fprintf(out, "%d\n", n2);
-                    count++;
-                    if (fscanf(in2, "%d", &n2) != 1) {
-                        both_open = 0;
-                        fclose(in2);
-                        in_rem = in1;
-                        fprintf(out, "%d\n", n1);
-                        count++;
-                    }
-                }
-            }
+    for (i = 1; i <= ninputs; i++) {
+        FILE *in;
+        if (!(in = fopen(argv[i], "r")))  {
+            fprintf(stderr, "Could not open %s\n", argv[i]);
+            exit(1);
+        }
+        if (fscanf(in, "%d", &heap[n].val) == 1) {
+            heap[n].in = in;
+            n++;
         }
         else {
-            // only in1 has data
-            in_rem = in1;
-            fclose(in2);
+            fclose(in);
         }
     }
-    else {
-        in_rem = in2;
-        fclose(in1);
+    if (!(out = fopen(argv[argc - 1], "w")))  {
+        fprintf(stderr, "Could not open %s\n", argv[argc - 1]);
+        exit(1);
     }
-    while (fscanf(in_rem, "%d", &n1) == 1) {
-        fprintf(out, "%d\n", n1);
+
+    for (i = n / 2 - 1; i >= 0; i--) {
+        sift_down(heap, n, i);
+    }
+    while (n > 0) {
+        fprintf(out, "%d\n", heap[0].val);
         count++;
+        if (fscanf(heap[0].in, "%d", &heap[0].val) != 1) {
+            // Input finished: replace with last
+            fclose(heap[0].in);
+            heap[0] = heap[--n];
+        }
+        sift_down(heap, n, 0);
     }
-    fclose(in_rem);
     fclose(out);
-    
-    fprintf(stderr, "%d items merged\n", count);
+    free(heap);
+
+    fprintf(stderr, "%d items merged from %d files\n", count, ninputs);
     return 0;
 }
@@ -13,8 +13,14 @@
 # limitations under the License.
 
 #!/usr/bin/python
+"""
+Sort files of integers by sorting each file, then merging the sorted
+files together in a tree.  Each merge app merges up to FANIN files, so
+with N files the data is read and written about log_FANIN(N) times.
+"""
 from PyDFlow.app import *
-from PyDFlow.base.patterns import treereduce
+from PyDFlow.types import Multiple
+from PyDFlow.base.patterns import lazyreduce
 import datetime
 import sys
 import logging 
@@ -29,6 +35,9 @@ app_paths.add_path(srcdir)
 
 app_count = 0
 
+# Number of files to merge at once
+FANIN = 2
+
 intfile = localfile.subtype()
 sorted_intfile = intfile.subtype()
 
@@ -37,69 +46,77 @@ sorted_intfile = intfile.subtype()
 def sort(file):
     return App("sort", "-n", file, "-o", outfiles[0])
 
-@app((sorted_intfile), (sorted_intfile, sorted_intfile))
-def merge(f1, f2):
-    return App("merge", f1, f2, outfiles[0])
+@app((sorted_intfile), (Multiple(sorted_intfile)))
+def merge(*files):
+    return App("merge", *(files + (outfiles[0],)))
 
 @app((localfile), (localfile))
 def compile(src):
     return App("gcc", "-o", outfiles[0], src)
 
 def do_compile():
-    bin = localfile(os.path.join(srcdir, "merge")) <<  \
-        compile(localfile(os.path.join(srcdir, "merge.c")))
+    """
+    Compile the merge app if it is missing or out of date
+    """
+    src = os.path.join(srcdir, "merge.c")
+    exe = os.path.join(srcdir, "merge")
+    if (os.path.exists(exe) and 
+            os.path.getmtime(exe) >= os.path.getmtime(src)):
+        return
+    bin = localfile(exe) << compile(localfile(src))
     bin.get()
 
 
-def merge_sort(unsorted):
+def merge_sort(unsorted, fanin=None, merge_fn=None, final_output=None):
+    """
+    Returns a file with the contents of the unsorted files sorted.
+    merge_fn is used in place of merge if provided.  If final_output is
+    provided, the last merge writes straight to it.
+    """
     global app_count
+    if fanin is None:
+        fanin = FANIN
+    if merge_fn is None:
+        merge_fn = merge
+    # Merged file -> number of unsorted files merged into it
+    covered = {}
+    def counted_merge(*files):
+        global app_count
+        app_count += 1
+        merged = merge_fn(*files)
+        count = sum([covered.pop(f, 1) for f in files])
+        if final_output is not None and count == len(unsorted):
+            merged = final_output << merged
+        covered[merged] = count
+        return merged
     print "sorting %d unsorted files" % (len(unsorted))
     # Sort all the individual files
     sorted = [sort(f) for f in unsorted]
     app_count += len(sorted)
-    return treereduce(merge, sorted)
-
-    # Note: could also code as below:.
-    # Merge them all hierarchically
-    """
-    while len(sorted) > 1:
-        odds = sorted[::2]
-        evens = sorted[1::2]
-        app_count += len(evens)
-        next = ([merge(a, b) 
-            for a, b 
-            in zip(odds, evens)])
-
-        # Check if there was an unpaired one
-        if len(sorted) % 2 == 1:
-            sorted = next + sorted[-1:]
-        else:
-            sorted = next
-    return sorted[0]
-    """
+    if final_output is not None and len(sorted) == 1:
+        sorted[0] = final_output << sorted[0]
+    # Merge them hierarchically as they are sorted.
+    # Note: could also merge them in a fixed tree with
+    # treereduce(merge, sorted) if fanin is 2
+    return lazyreduce(counted_merge, sorted, fanin=fanin)
 
 def main():
     do_compile()
 
     filenames = sys.argv[1:]
+    fanin = FANIN
+    if len(filenames) >= 2 and filenames[0] == "-k":
+        fanin = int(filenames[1])
+        filenames = filenames[2:]
     if len(filenames) == 0:
-        print "USAGE: mergesort.py <files of integers>"
+        print "USAGE: mergesort.py [-k <fan-in>] <files of integers>"
         return
     start_t = datetime.datetime.now()
     output = sorted_intfile("mergesorted.txt")
-    output <<= merge_sort([intfile(f) for f in filenames])
-
-    # Need to call get() to initiate the sorting
-    graph_built_t = datetime.datetime.now()
-
-    print "%d apps built into graph in %s" % (app_count, graph_built_t - start_t)
-    
-    output.spark()
-    fill_started_t = datetime.datetime.now()
-    print "Sorted file is being written to at %s" % output.get()
-    output.get()
+    merge_sort([intfile(f) for f in filenames], fanin, final_output=output)
+    print "Sorted file written to %s" % output.get()
     time_done_t = datetime.datetime.now()
-    print "%d apps finished at %s" % (app_count, time_done_t - graph_built_t)
+    print "%d apps finished in %s" % (app_count, time_done_t - start_t)
 
 
 if __name__ == "__main__":
@@ -112,12 +112,28 @@ class TestApp(PyDFlowTest):
                     filehandle.write("%d\n" % random.randint(1, 1000))                     
                 filehandle.close()
             
-            flfiles = map(ms.intfile, files)
-            sorted = ms.merge_sort(flfiles)
-            results = [int(x) for x in sorted.open().readlines()]
-            self.assertEquals(len(results), NUM_FILES*NO_PER_FILE)
-            for i in xrange(len(results) - 1):
-                self.assertTrue(results[i] <= results[i+1])
+            ms.do_compile()
+            for fanin in (2, 3, 16):
+                flfiles = map(ms.intfile, files)
+                sorted = ms.merge_sort(flfiles, fanin)
+                results = [int(x) for x in sorted.open().readlines()]
+                self.assertEquals(len(results), NUM_FILES*NO_PER_FILE)
+                for i in xrange(len(results) - 1):
+                    self.assertTrue(results[i] <= results[i+1])
+
+            # Last merge should write straight to the output file
+            for nfiles in (1, NUM_FILES):
+                handle, outpath = tempfile.mkstemp()
+                os.close(handle)
+                files.append(outpath)
+                output = ms.sorted_intfile(outpath)
+                result = ms.merge_sort(map(ms.intfile, files[:nfiles]), 4,
+                                       final_output=output)
+                self.assertTrue(result is output)
+                results = [int(x) for x in output.open().readlines()]
+                self.assertEquals(len(results), nfiles*NO_PER_FILE)
+                for i in xrange(len(results) - 1):
+                    self.assertTrue(results[i] <= results[i+1])
         finally:
             for f in files:
                 os.remove(f) 
@@ -239,6 +255,531 @@ class TestApp(PyDFlowTest):
             r.get()
             i += 1
         print ''
+
+    def testResources(self):
+        """
+        Check that apps are only run concurrently if they fit into the
+        configured cores and memory.
+        """
+        import PyDFlow.app.LocalExecutor as AppExecutor
+        from PyDFlow import configure_apps, waitall
+        @app((localfile), (), cores=2)
+        def wide():
+            return App("sleep", "0.1", stdout=outfiles[0])
+        @app((localfile), (), memory=60)
+        def big():
+            return App("sleep", "0.1", stdout=outfiles[0])
+        @app((localfile), (), cores=100)
+        def huge():
+            return App("touch", outfiles[0])
+
+        old_cores, old_memory = AppExecutor.CORES, AppExecutor.MEMORY
+        configure_apps(cores=3)
+        try:
+            waitall([wide() for i in range(3)])
+            # Two wide apps would need 4 cores
+            self.assertEquals(AppExecutor.stats()['peak_cores'], 2)
+            # Should be allowed to run by itself
+            huge().get()
+            self.assertEquals(AppExecutor.stats()['peak_cores'], 3)
+
+            configure_apps(memory=100)
+            self.assertEquals(AppExecutor.stats()['peak_memory'], 0)
+            waitall([big() for i in range(3)])
+            self.assertEquals(AppExecutor.stats()['peak_memory'], 60)
+        finally:
+            AppExecutor.CORES, AppExecutor.MEMORY = old_cores, old_memory
+            AppExecutor.configure()
+
+    def testPriority(self):
+        """
+        Check that with priority scheduling on, queued apps with longer
+        chains of tasks after them are launched first.
+        """
+        import tempfile
+        import PyDFlow.app.LocalExecutor as AppExecutor
+        from PyDFlow import configure_apps, configure_scheduling, waitall
+        @app((localfile), ())
+        def block():
+            return App("sleep", "0.3", stdout=outfiles[0])
+        @app((localfile), (None, None))
+        def log(logpath, name):
+            return App("sh", "-c", "echo %s >> %s" % (name, logpath),
+                       stdout=outfiles[0])
+
+        fd, logpath = tempfile.mkstemp()
+        os.close(fd)
+        old_cores = AppExecutor.CORES
+        configure_apps(cores=1)
+        configure_scheduling(priority=True)
+        try:
+            # Keep the one core busy while the others are queued
+            blocker = block()
+            blocker.spark()
+            shorts = [log(logpath, "short") for i in range(3)]
+            for s in shorts:
+                s.spark()
+            chain = cp(cp(log(logpath, "long")))
+            waitall(shorts + [chain, blocker])
+            self.assertEquals(open(logpath).read().split(),
+                              ["long", "short", "short", "short"])
+        finally:
+            os.remove(logpath)
+            configure_scheduling(priority=False)
+            AppExecutor.CORES = old_cores
+            AppExecutor.configure()
+
+    def testHistoryBackfill(self):
+        """
+        Check that app runtimes are recorded, and that with history an app
+        only overtakes an app waiting for cores if it should finish before
+        the cores are free.
+        """
+        import shutil
+        import tempfile
+        import PyDFlow.app.LocalExecutor as AppExecutor
+        from PyDFlow.base import history
+        from PyDFlow import configure_apps, configure_scheduling
+        @app((localfile), ())
+        def train():
+            return App("touch", outfiles[0])
+        @app((localfile), ())
+        def slow():
+            return App("touch", outfiles[0])
+        @app((localfile), ())
+        def slower():
+            return App("touch", outfiles[0])
+        @app((localfile), ())
+        def quick():
+            return App("touch", outfiles[0])
+        @app((localfile), ())
+        def unknown():
+            return App("touch", outfiles[0])
+        @app((localfile), (), cores=2)
+        def wide():
+            return App("touch", outfiles[0])
+        def entry(f):
+            return AppExecutor.AppQueueEntry(f()._in_tasks[0], None, None,
+                                             None)
+
+        tmpdir = tempfile.mkdtemp()
+        hist_path = os.path.join(tmpdir, "history")
+        old_cores = AppExecutor.CORES
+        configure_scheduling(history=hist_path)
+        try:
+            train().get()
+            self.assertEquals(history.lookup('train').count, 1)
+            for f, secs in ((slow, 1.0), (slower, 1.6), (quick, 0.1)):
+                history.record(f()._in_tasks[0], secs)
+            # Should be loaded again from the file
+            configure_scheduling(history=hist_path)
+            self.assertEquals(history.lookup('slower').count, 1)
+            self.assertEquals(history.lookup('slower').mean, 1.6)
+
+            configure_apps(cores=2)
+            AppExecutor.ensure_init()
+            running = entry(slow)
+            blocked = entry(wide)
+            with AppExecutor.work_added:
+                running.acquire()
+                AppExecutor.active_apps.add(running)
+                try:
+                    # slow should finish in about 0.8s: quick fits in
+                    # before then, but slower would still be running when
+                    # wide could start
+                    running.start_time = time.time() - 0.2
+                    self.assertTrue(AppExecutor.may_backfill(entry(quick),
+                                                             blocked))
+                    self.assertFalse(AppExecutor.may_backfill(entry(slower),
+                                                              blocked))
+                    # Can't tell without history
+                    self.assertTrue(AppExecutor.may_backfill(entry(unknown),
+                                                             blocked))
+                finally:
+                    AppExecutor.active_apps.discard(running)
+                    running.release()
+        finally:
+            configure_scheduling(history=False)
+            AppExecutor.CORES = old_cores
+            AppExecutor.configure()
+            shutil.rmtree(tmpdir)
+
+    def testCallbackThreads(self):
+        """
+        Check that app callbacks are run by callback threads and that 
+        the number of callback threads can be changed.
+        """
+        import PyDFlow.app.LocalExecutor as AppExecutor
+        from PyDFlow import configure_apps, waitall
+        @app((localfile), ())
+        def noop():
+            return App("touch", outfiles[0])
+
+        old_threads = AppExecutor.CALLBACK_THREADS
+        try:
+            for nthreads in (1, 3):
+                configure_apps(callback_threads=nthreads)
+                before = AppExecutor.stats()
+                outs = [noop() for i in range(10)]
+                waitall(outs)
+                after = AppExecutor.stats()
+                self.assertEquals(len(AppExecutor.callback_threads), nthreads)
+                self.assertEquals(after['callbacks_run'] - 
+                                  before['callbacks_run'], 10)
+                self.assertEquals(after['callbacks_queued'], 0)
+                self.assertTrue(after['max_callbacks_queued'] >= 1)
+        finally:
+            configure_apps(callback_threads=old_threads)
+
+    def testHelperLauncher(self):
+        """
+        Run apps through the spawn helper process
+        """
+        import PyDFlow.app.LocalExecutor as AppExecutor
+        from PyDFlow import configure_apps, waitall
+        @app((localfile), (localfile))
+        def cat(src):
+            return App("cat", src, stdout=outfiles[0])
+        @app((localfile), ())
+        def missing():
+            return App("cat", "sdfsdfsfsfsfwerwc")
+        @app((localfile), ())
+        def invalid():
+            return App("fssdfsiieke", "sdfsdfsfsfsfwerwc")
+        @app((localfile), ())
+        def bad_redirect():
+            return App("cat", stdin="/sdfsdfsfsfsfwerwc")
+
+        old_launcher = AppExecutor.LAUNCHER
+        configure_apps(launcher='helper')
+        olddir = os.getcwd()
+        try:
+            hw = localfile(os.path.join(testdir, "files/helloworld"))
+            self.assertEquals(cat(hw).open().readlines(), ["hello world!"])
+            # Apps should run in current working directory
+            os.chdir(testdir)
+            x = cat(localfile("files/helloworld"))
+            self.assertEquals(x.open().readlines(), ["hello world!"])
+            os.chdir(olddir)
+            res = [cat(hw) for i in range(50)]
+            waitall(res)
+            for r in res:
+                self.assertEquals(r.open().readlines(), ["hello world!"])
+            self.assertExecutionException(ExitCodeException, missing().get)
+            self.assertExecutionException(AppLaunchException, invalid().get)
+            self.assertExecutionException(IOError, bad_redirect().get)
+        finally:
+            os.chdir(olddir)
+            configure_apps(launcher=old_launcher)
+            self.assertRaises(ValueError, configure_apps, launcher='fork')
+
+    def testPathCache(self):
+        """
+        Check caching of executable locations
+        """
+        import tempfile
+        import shutil
+        tmpdir = tempfile.mkdtemp()
+        bindir = os.path.join(tmpdir, "bin")
+        os.mkdir(bindir)
+        exe = os.path.join(bindir, "myexe")
+        def make_exe():
+            open(exe, 'w').close()
+            os.chmod(exe, 0755)
+        def count(key):
+            return app_paths.stats()[key]
+        old_paths = list(app_paths.paths)
+        old_revalidate = app_paths.REVALIDATE
+        try:
+            app_paths.set_paths([bindir])
+            self.assertEquals(app_paths.lookup("myexe"), None)
+            # Not found should be cached
+            start = count('hits')
+            self.assertEquals(app_paths.lookup("myexe"), None)
+            self.assertEquals(count('hits') - start, 1)
+            make_exe()
+            self.assertEquals(app_paths.lookup("myexe"), None)
+            # Adding a lower priority path should invalidate
+            app_paths.add_path(tmpdir, top=False)
+            self.assertEquals(app_paths.lookup("myexe"), exe)
+            start = count('misses')
+            self.assertEquals(app_paths.lookup("myexe"), exe)
+            self.assertEquals(count('misses') - start, 0)
+
+            # Revalidation should notice file going away
+            os.remove(exe)
+            self.assertEquals(app_paths.lookup("myexe"), exe)
+            app_paths.configure(revalidate=True)
+            self.assertEquals(app_paths.lookup("myexe"), None)
+            make_exe()
+            self.assertEquals(app_paths.lookup("myexe"), exe)
+            app_paths.configure(revalidate=False)
+
+            # Saved cache should be used for same paths only
+            app_paths.configure(cache_file=os.path.join(tmpdir, "cache"))
+            app_paths.set_paths([bindir])
+            self.assertEquals(app_paths.lookup("myexe"), exe)
+            app_paths.clear_cache()
+            start = count('misses')
+            self.assertEquals(app_paths.lookup("myexe"), exe)
+            self.assertEquals(count('misses') - start, 0)
+            app_paths.set_paths([tmpdir])
+            self.assertEquals(app_paths.lookup("myexe"), None)
+        finally:
+            app_paths.CACHE_FILE = None
+            app_paths.configure(revalidate=old_revalidate)
+            app_paths.set_paths(old_paths)
+            shutil.rmtree(tmpdir)
+
+    def testCatalog(self):
+        """
+        Check apps are run using executable and wrapper from catalog
+        """
+        import tempfile
+        @app((localfile), (localfile))
+        def mycat(src):
+            return App("my_cat_app", src, stdout=outfiles[0])
+        handle, catalog_file = tempfile.mkstemp()
+        f = os.fdopen(handle, 'w')
+        f.write("# site name path wrapper\n")
+        f.write("othersite my_cat_app /bin/false\n")
+        f.write("localhost my_cat_app /bin/cat env FOO=1\n")
+        f.close()
+        try:
+            app_paths.load_catalog(catalog_file)
+            self.assertEquals(app_paths.resolve(["my_cat_app", "x"]),
+                              ["env", "FOO=1", "/bin/cat", "x"])
+            hw = localfile(os.path.join(testdir, "files/helloworld"))
+            self.assertEquals(mycat(hw).open().readlines(), ["hello world!"])
+        finally:
+            del app_paths.catalog["my_cat_app"]
+            os.remove(catalog_file)
+
+    def testIncremental(self):
+        """
+        Check that apps are only rerun if their outputs are out of date.
+        """
+        import tempfile
+        import shutil
+        import PyDFlow.app.journal as journal
+        from PyDFlow import configure_app_journal
+        @app((localfile), (localfile))
+        def cat(src):
+            return App("cat", src, stdout=outfiles[0])
+        old_journal = journal.JOURNAL_PATH
+        tmpdir = tempfile.mkdtemp()
+        inpath = os.path.join(tmpdir, "in")
+        midpath = os.path.join(tmpdir, "mid")
+        outpath = os.path.join(tmpdir, "out")
+        def pipeline(step):
+            mid = localfile(midpath)
+            out = localfile(outpath)
+            mid <<= cp(localfile(inpath))
+            out <<= step(mid)
+            return out.open().read()
+
+        def skipped():
+            return journal.stats()['skipped']
+
+        configure_app_journal(incremental=True,
+                              path=os.path.join(tmpdir, "journal"))
+        try:
+            f = open(inpath, 'w')
+            f.write("v1")
+            f.close()
+            # Make sure input is older than outputs
+            os.utime(inpath, (time.time() - 10, time.time() - 10))
+            self.assertEquals(pipeline(cp), "v1")
+            start = skipped()
+            self.assertEquals(pipeline(cp), "v1")
+            self.assertEquals(skipped() - start, 2)
+
+            # Changed input: everything downstream should rerun
+            f = open(inpath, 'w')
+            f.write("v2")
+            f.close()
+            os.utime(inpath, (time.time() + 10, time.time() + 10))
+            start = skipped()
+            self.assertEquals(pipeline(cp), "v2")
+            self.assertEquals(skipped() - start, 0)
+
+            # Changed command for last step only
+            os.utime(inpath, (time.time() - 10, time.time() - 10))
+            start = skipped()
+            self.assertEquals(pipeline(cat), "v2")
+            self.assertEquals(skipped() - start, 1)
+
+            # Deleted output
+            os.remove(outpath)
+            start = skipped()
+            self.assertEquals(pipeline(cat), "v2")
+            self.assertEquals(skipped() - start, 1)
+        finally:
+            configure_app_journal(incremental=False, path=old_journal)
+            shutil.rmtree(tmpdir)
+
+    def testSkipJournal(self):
+        """
+        Check that apps are not rerun if the journal shows the same command
+        was already run on the same input data.
+        """
+        import tempfile
+        import shutil
+        import PyDFlow.app.journal as journal
+        from PyDFlow import configure_app_journal
+        old_journal = journal.JOURNAL_PATH
+        tmpdir = tempfile.mkdtemp()
+        inpath = os.path.join(tmpdir, "in")
+        midpath = os.path.join(tmpdir, "mid")
+        outpath = os.path.join(tmpdir, "out")
+        def pipeline():
+            mid = localfile(midpath)
+            out = localfile(outpath)
+            mid <<= cp(localfile(inpath))
+            out <<= cp(mid)
+            return out.open().read()
+
+        def write_input(data):
+            f = open(inpath, 'w')
+            f.write(data)
+            f.close()
+
+        def count(key):
+            return journal.stats()[key]
+
+        configure_app_journal(skip=True, path=os.path.join(tmpdir, "journal"))
+        try:
+            write_input("v1")
+            self.assertEquals(pipeline(), "v1")
+            start = count('skipped')
+            self.assertEquals(pipeline(), "v1")
+            self.assertEquals(count('skipped') - start, 2)
+
+            # Should survive reloading journal from disk without
+            # rehashing unchanged files
+            journal.configure(journal_path=journal.JOURNAL_PATH)
+            start = count('skipped')
+            start_hashed = count('hashed')
+            self.assertEquals(pipeline(), "v1")
+            self.assertEquals(count('skipped') - start, 2)
+            self.assertEquals(count('hashed') - start_hashed, 0)
+
+            # Newer input with same contents: file times don't matter
+            os.utime(inpath, (time.time() + 10, time.time() + 10))
+            start = count('skipped')
+            self.assertEquals(pipeline(), "v1")
+            self.assertEquals(count('skipped') - start, 2)
+
+            # Changed contents
+            write_input("v2")
+            start = count('skipped')
+            self.assertEquals(pipeline(), "v2")
+            self.assertEquals(count('skipped') - start, 0)
+
+            # Output modified since it was written
+            f = open(outpath, 'w')
+            f.write("junk")
+            f.close()
+            start = count('skipped')
+            self.assertEquals(pipeline(), "v2")
+            self.assertEquals(count('skipped') - start, 1)
+
+            # App function is only called once for apps that are run
+            calls = []
+            @app((localfile), (localfile))
+            def counted_cp(src):
+                calls.append(src)
+                return App("cp", src, outfiles[0])
+            copied = counted_cp(localfile(inpath))
+            self.assertEquals(copied.open().read(), "v2")
+            self.assertEquals(len(calls), 1)
+        finally:
+            configure_app_journal(skip=False, path=old_journal)
+            shutil.rmtree(tmpdir)
+
+    def testJournalCompaction(self):
+        """
+        Check that superseded entries are dropped from the journal when it
+        is loaded.
+        """
+        import tempfile
+        import shutil
+        import PyDFlow.app.journal as journal
+        from PyDFlow import configure_app_journal
+        old_journal = journal.JOURNAL_PATH
+        tmpdir = tempfile.mkdtemp()
+        inpath = os.path.join(tmpdir, "in")
+        journal_path = os.path.join(tmpdir, "journal")
+        def lines():
+            return len(open(journal_path).readlines())
+
+        configure_app_journal(skip=True, path=journal_path)
+        try:
+            f = open(inpath, 'w')
+            f.write("v1")
+            f.close()
+            # Each change of modification time means a rehash
+            for i in range(200):
+                os.utime(inpath, (i, i))
+                journal.file_digest(inpath)
+            self.assertEquals(lines(), 200)
+            digest = journal.file_digest(inpath)
+            # Reload: only the latest entry should be kept
+            journal.configure(journal_path=journal_path)
+            start_hashed = journal.stats()['hashed']
+            self.assertEquals(journal.file_digest(inpath), digest)
+            self.assertEquals(journal.stats()['hashed'], start_hashed)
+            self.assertEquals(lines(), 1)
+            self.assertFalse(os.path.exists(journal_path + ".tmp"))
+        finally:
+            configure_app_journal(skip=False, path=old_journal)
+            shutil.rmtree(tmpdir)
+
+    def testJournalTempOutputs(self):
+        """
+        Check that apps writing to temporary files are always rerun, along
+        with the apps which read those files, since the temporary files
+        have different paths on each run.
+        """
+        import tempfile
+        import shutil
+        import PyDFlow.app.journal as journal
+        from PyDFlow import configure_app_journal
+        old_journal = journal.JOURNAL_PATH
+        tmpdir = tempfile.mkdtemp()
+        inpath = os.path.join(tmpdir, "in")
+        outpath = os.path.join(tmpdir, "out")
+        f = open(inpath, 'w')
+        f.write("v1")
+        f.close()
+        def pipeline():
+            # Intermediate file is temporary
+            out = localfile(outpath)
+            out <<= cp(cp(localfile(inpath)))
+            return out.open().read()
+
+        def count(key):
+            return journal.stats()[key]
+
+        configure_app_journal(skip=True, path=os.path.join(tmpdir, "journal"))
+        try:
+            start = count('recorded')
+            self.assertEquals(pipeline(), "v1")
+            # Only the bound output is journalled
+            self.assertEquals(count('recorded') - start, 1)
+            start = count('skipped')
+            self.assertEquals(pipeline(), "v1")
+            self.assertEquals(count('skipped') - start, 0)
+            # Bound output has no dependence on temporary files
+            start = count('skipped')
+            self.assertEquals((localfile(outpath) << cp(localfile(inpath))
+                               ).open().read(), "v1")
+            self.assertEquals((localfile(outpath) << cp(localfile(inpath))
+                               ).open().read(), "v1")
+            self.assertEquals(count('skipped') - start, 1)
+        finally:
+            configure_app_journal(skip=False, path=old_journal)
+            shutil.rmtree(tmpdir)
             
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
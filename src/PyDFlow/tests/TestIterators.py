@@ -18,10 +18,12 @@
 import unittest
 
 from PyDFlow.base.patterns import resultset, resultlist
+from PyDFlow.base.stream import Stream
 from PyDFlow.PyFun import *
 import time
 import random
 from PyDFlow.tests.PyDFlowTest import PyDFlowTest
+import threading
 import logging
 #logging.basicConfig(level=logging.DEBUG)
 
@@ -30,6 +32,25 @@ def inc(x):
     time.sleep(random.random() * 0.1)
     return x + 1
 
+@func((py_ivar), (py_ivar))
+def inc_ivar(x):
+    time.sleep(random.random() * 0.01)
+    return x + 1
+
+# Track how many of count_inc are running at once
+running_lock = threading.Lock()
+running = [0, 0] # current, max
+
+@func((py_ivar), (py_ivar))
+def count_inc(x):
+    with running_lock:
+        running[0] += 1
+        running[1] = max(running)
+    time.sleep(random.random() * 0.01)
+    with running_lock:
+        running[0] -= 1
+    return x + 1
+
 class TestIterators(PyDFlowTest):
 
 
@@ -64,6 +85,9 @@ class TestIterators(PyDFlowTest):
         
         self.checkSequential(resultlist(res2, max_ready=20), COUNT)
         self.checkSequential(resultlist(res2b), COUNT)
+        # 0 means no limit
+        res3 = (inc(i - 1) for i in range(COUNT))
+        self.checkSequential(resultlist(res3, max_ready=0), COUNT)
                 
         
     def testResultBag(self):
@@ -86,6 +110,49 @@ class TestIterators(PyDFlowTest):
         print act2
         self.assertEquals(sorted(act2), exp)
 
+    def testStream(self):
+        COUNT = 20
+        self.checkSequential(Stream(inc(i - 1) for i in range(COUNT)), COUNT)
+        self.checkSequential(Stream((py_ivar(i) for i in range(COUNT)),
+                                    max_running=1), COUNT)
+        act = sorted(Stream((inc(i - 1) for i in range(COUNT)),
+                            max_running=3, ordered=False).values())
+        self.assertEquals(act, range(COUNT))
+
+    def testStreamMapFilter(self):
+        COUNT = 30
+        # List source, so it can be iterated over more than once
+        s = Stream([py_ivar(i) for i in range(COUNT)], max_running=4)
+        s2 = s.map(inc_ivar).filter(lambda x: x % 3 == 0).map(inc_ivar).map(inc_ivar)
+        self.assertEquals(list(s2.values()),
+                          [x + 2 for x in range(1, COUNT + 1) if x % 3 == 0])
+        # Original stream is unchanged
+        self.checkSequential(s, COUNT)
+        evens = s.filter(lambda x: x % 2 == 0).filter(lambda x: x % 4 == 0)
+        self.assertEquals(list(evens.values()), range(0, COUNT, 4))
+
+    def testStreamBounded(self):
+        """
+        Check that inputs are pulled lazily and running tasks are bounded
+        """
+        MAX_RUNNING = 4
+        MAX_BUFFERED = 6
+        pulled = [0]
+        def gen():
+            i = 0
+            while True:
+                pulled[0] += 1
+                yield count_inc(py_ivar(i))
+                i += 1
+        running[:] = [0, 0]
+        s = Stream(gen(), max_running=MAX_RUNNING, max_buffered=MAX_BUFFERED)
+        for i, x in enumerate(s.map(count_inc).values()):
+            self.assertEquals(x, i + 2)
+            self.assertTrue(pulled[0] <= i + 1 + MAX_RUNNING + MAX_BUFFERED)
+            if i == 200:
+                break
+        self.assertTrue(running[1] <= MAX_RUNNING)
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testResultList']
     unittest.main()
\ No newline at end of file
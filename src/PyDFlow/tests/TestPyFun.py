@@ -59,6 +59,10 @@ def cat(first, second):
 @func((String), (Multiple(String)))
 def cat2(*args):
     return "".join(args)
+@func((Int), (Multiple(Int)))
+def sum_all(*args):
+    return sum(args)
+
 @func((Int), (None))
 def rec_fib(n):
     if n == 0:
@@ -93,6 +97,87 @@ class MyException(Exception):
 def cause_exception():
     raise MyException()
 
+@func((Int), (Int, Int), executor='process')
+def proc_add(x, y):
+    return x + y
+
+@func((Int), (None), executor='process')
+def proc_getpid(x):
+    import os
+    return os.getpid()
+
+@func((Int), (), executor='process')
+def proc_exception():
+    raise MyException()
+
+@func((Int), (py_ivar), executor='process')
+def proc_len(x):
+    return len(x)
+
+@func((Int), (None), executor='process')
+def proc_sleep(secs):
+    time.sleep(secs)
+    return 0
+
+@func((Int), (), executor='process')
+def proc_die():
+    import os
+    os._exit(1)
+
+@func((Int), (Multiple(Int)))
+def sleep_sum(*args):
+    time.sleep(0.001)
+    return sum(args) + 1
+
+rendezvous_cond = th.Condition()
+rendezvous_count = [0]
+@func((py_ivar), (None))
+def rendezvous(n):
+    """
+    Wait until n tasks are in here at once, returning False if
+    that didn't happen within a few seconds
+    """
+    with rendezvous_cond:
+        rendezvous_count[0] += 1
+        rendezvous_cond.notifyAll()
+        deadline = time.time() + 10.0
+        while rendezvous_count[0] < n and time.time() < deadline:
+            rendezvous_cond.wait(deadline - time.time())
+        return rendezvous_count[0] >= n
+
+@func((Int), (Int))
+def slow_inc(x):
+    time.sleep(0.02)
+    return x + 1
+
+@func((Int), (None))
+def str_len(s):
+    return len(s)
+
+memo_calls = []
+@func((Int), (Int), cache=True)
+def memo_square(x):
+    memo_calls.append(x)
+    return x * x
+
+@func((String), (None), executor='process', cache=True)
+def proc_memo_str(n):
+    return "x" * n
+
+ckpt_calls = []
+@func((Int), (Int))
+def ckpt_inc(x):
+    ckpt_calls.append(x)
+    return x + 1
+
+ckpt_crash = [True]
+@func((Int), (Int))
+def ckpt_maybe_crash(x):
+    ckpt_calls.append(x)
+    if ckpt_crash[0]:
+        raise ValueError("crashed")
+    return x * 10
+
 class TestPyFun(PyDFlowTest):
 
 
@@ -203,6 +288,45 @@ class TestPyFun(PyDFlowTest):
         self.assertEquals(res.get(), "cowgoesmoo")
         
         
+    def testMap(self):
+        xs = [Int(i) for i in range(10)]
+        self.assertEquals([y.get() for y in inc.map(xs)], range(1, 11))
+        sums = add.map(xs, inc.map(xs))
+        self.assertEquals([y.get() for y in sums], range(1, 21, 2))
+        words = cat2.map([String("a"), String("b")], [String("c"), String("d")])
+        self.assertEquals([w.get() for w in words], ["ac", "bd"])
+        self.assertEquals(inc.map([]), [])
+        self.assertRaises(FlTypeError, inc.map, [Int(1), String("x")])
+        self.assertRaises(FlTypeError, add.map, xs)
+
+        # Extra Multiple args are checked and unpacked the same way as
+        # individual calls
+        rows = [(String("a"), String("b"), [String("c")]),
+                (String("d"), [String("e")], String("f"))]
+        self.assertEquals([w.get() for w in cat2.map(*zip(*rows))],
+                          [cat2(*r).get() for r in rows])
+        self.assertEquals([w.get() for w in cat2.map(*zip(*rows))],
+                          ["abc", "def"])
+
+    def testFanIn(self):
+        """
+        Task with many inputs, some repeated, filled by other tasks
+        """
+        xs = [inc(Int(i)) for i in range(2000)]
+        self.assertEquals(sum_all(*(xs + xs[:10])).get(), 
+                          sum(range(1, 2001)) + sum(range(1, 11)))
+
+    def testSlots(self):
+        """
+        Check that ivars and tasks don't have a per-instance dict
+        """
+        x = Int(1)
+        y = inc(x)
+        self.assertFalse(hasattr(x, '__dict__'))
+        self.assertFalse(hasattr(y, '__dict__'))
+        self.assertFalse(hasattr(y._in_tasks[0], '__dict__'))
+        self.assertEquals(y.get(), 2)
+
     def testType(self):
         MagicInt = Int.subtype()
         self.assertTrue(py_ivar.isinstance(MagicInt("hello")))
@@ -400,6 +524,543 @@ class TestPyFun(PyDFlowTest):
                     res = self._add(self,res)
                 return res.get()
         self.assertEquals(Test(1).add(5), 5)
+
+    def testStripedLocking(self):
+        """
+        Build and run independent graphs from several threads with
+        striped ivar locks.
+        """
+        from PyDFlow.base import mutex
+        mutex.set_lock_mode(mutex.LOCK_STRIPED)
+        try:
+            results = {}
+            def build(n):
+                x = Int(0)
+                for i in range(n):
+                    x = inc(x)
+                results[n] = add(x, one()).get()
+            threads = [th.Thread(target=build, args=(n,))
+                       for n in range(10, 50, 10)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEquals(results, dict([(n, n + 1)
+                                        for n in range(10, 50, 10)]))
+        finally:
+            mutex.set_lock_mode(mutex.LOCK_GLOBAL)
+
+    def testConfigureWorkers(self):
+        from PyDFlow import configure
+        def shrink_to_one():
+            old = list(LocalExecutor.workers)
+            configure(workers=1, adaptive=False)
+            # Extra workers retire and exit once idle
+            for w in old[1:]:
+                w.join(10.0)
+            self.assertEquals(len(LocalExecutor.workers), 1)
+        try:
+            configure(workers=4)
+            self.assertEquals(len(LocalExecutor.workers), 4)
+            # Only returns once all four are running at the same time
+            rendezvous_count[0] = 0
+            meets = [rendezvous(4) for i in range(4)]
+            for m in meets:
+                m.spark()
+            self.assertEquals([m.get() for m in meets], [True] * 4)
+            shrink_to_one()
+
+            # Backlog of work should cause pool to grow
+            configure(workers=1, adaptive=True, max_workers=3)
+            self.assertEquals(LocalExecutor.peak_pool_size, 1)
+            for r in resultset([just_sleep(0.1) for i in range(30)]):
+                pass
+            self.assertTrue(LocalExecutor.peak_pool_size > 1)
+            self.assertTrue(LocalExecutor.peak_pool_size <= 3)
+
+            # Maximum is kept when it isn't passed again
+            configure(workers=2)
+            self.assertEquals(LocalExecutor.MAX_THREADS, 3)
+            # Inconsistent limits are rejected without changing anything
+            self.assertRaises(ValueError, configure, min_workers=4)
+            self.assertRaises(ValueError, configure, workers=5)
+            self.assertRaises(ValueError, configure, max_workers=-1)
+            self.assertEquals((LocalExecutor.MIN_THREADS, 
+                               LocalExecutor.MAX_THREADS), (1, 3))
+            configure(min_workers=2)
+            self.assertEquals(LocalExecutor.MIN_THREADS, 2)
+            # 0 goes back to the defaults
+            configure(min_workers=0, max_workers=0)
+            self.assertEquals(LocalExecutor.MIN_THREADS, 1)
+            self.assertEquals(LocalExecutor.MAX_THREADS, 
+                              max(LocalExecutor.cpu_count(), 2))
+        finally:
+            configure(min_workers=0, max_workers=0)
+            shrink_to_one()
+
+    def testProcessExecutor(self):
+        import os
+        self.assertNotEqual(proc_getpid(0).get(), os.getpid())
+        # Mix of thread and process tasks
+        x = Int(1)
+        for i in range(10):
+            x = proc_add(inc(x), Int(i))
+        self.assertEquals(x.get(), 56)
+        self.assertExecutionException(MyException, proc_exception().get)
+        self.assertExecutionException(MyException, 
+                                      proc_add(one(), proc_exception()).get)
+
+    def testProcessExecutorCache(self):
+        # Large input should be cached in worker processes
+        big = py_ivar(range(100000))
+        lens = [proc_len(big) for i in range(10)]
+        self.assertEquals([l.get() for l in lens], [100000] * 10)
+
+    def testProcessExecutorFailures(self):
+        from PyDFlow.PyFun import ProcessExecutor
+        ProcessExecutor.ensure_init()
+        # Keep all the workers busy so that the rest are queued
+        busy = [proc_sleep(0.3) for w in ProcessExecutor.workers]
+        for b in busy:
+            b.spark()
+        # Can't pickle a function defined here
+        bad = proc_len(py_ivar(lambda: 0))
+        bad.spark()
+        good = proc_add(Int(1), Int(2))
+        self.assertEquals(good.get(), 3)
+        self.assertRaises(Exception, bad.get)
+
+        # Dead worker process should be replaced
+        self.assertExecutionException(EOFError, proc_die().get)
+        self.assertEquals(proc_add(Int(2), Int(3)).get(), 5)
+        self.assertEquals(len(ProcessExecutor.workers), 
+                          ProcessExecutor.pool_size)
+
+    def testProcessExecutorNested(self):
+        # Only top-level functions can be run in other processes
+        @func((Int), (), executor='process')
+        def nested():
+            return 1
+        self.assertExecutionException(ValueError, nested().get)
+        self.assertRaises(ValueError, func, (Int), (), executor='sdfsdf')
+
+    def testMemoCache(self):
+        import os
+        import tempfile
+        import shutil
+        from PyDFlow.PyFun import memo
+        cache_dir = tempfile.mkdtemp()
+        old_dir, old_max = memo.CACHE_DIR, memo.MAX_BYTES
+        memo.configure(cache_dir=cache_dir)
+        try:
+            del memo_calls[:]
+            before = memo.stats()
+            self.assertEquals(memo_square(Int(3)).get(), 9)
+            self.assertEquals(memo_square(Int(3)).get(), 9)
+            self.assertEquals(memo_square(Int(4)).get(), 16)
+            self.assertEquals(memo_calls, [3, 4])
+            after = memo.stats()
+            self.assertEquals(after['hits'] - before['hits'], 1)
+            self.assertEquals(after['misses'] - before['misses'], 2)
+            # Cached results should be found in new cache instance
+            memo.configure(cache_dir=cache_dir)
+            self.assertEquals(memo_square(Int(4)).get(), 16)
+            self.assertEquals(memo_calls, [3, 4])
+            
+            self.assertEquals(proc_memo_str(3).get(), "xxx")
+            self.assertEquals(proc_memo_str(3).get(), "xxx")
+            self.assertEquals(memo.stats()['hits'] - before['hits'], 3)
+
+            # Shrinking cache should evict older entries
+            memo.configure(max_bytes=1)
+            self.assertTrue(memo.stats()['evictions'] > before['evictions'])
+            self.assertEquals(memo.total_bytes, 0)
+
+            # Temporary file is removed if the entry can't be saved
+            key = memo.make_key(memo_square.func, [7])
+            os.mkdir(memo.entry_path(key))
+            memo.store(key, 49)
+            self.assertEquals([n for n in os.listdir(cache_dir) 
+                               if n.endswith(memo.TMP_SUFFIX)], [])
+            # Only stale temporary files from dead processes are removed
+            for name, age in (("old.tmp", 2 * memo.STALE_TMP_AGE), 
+                              ("new.tmp", 0)):
+                path = os.path.join(cache_dir, name)
+                open(path, 'w').close()
+                mtime = time.time() - age
+                os.utime(path, (mtime, mtime))
+            memo.configure(cache_dir=cache_dir)
+            self.assertEquals(memo_square(Int(3)).get(), 9)
+            self.assertFalse(os.path.exists(os.path.join(cache_dir, 
+                                                         "old.tmp")))
+            self.assertTrue(os.path.exists(os.path.join(cache_dir, 
+                                                        "new.tmp")))
+
+            # Unusable cache directory means results aren't cached
+            notdir = os.path.join(cache_dir, "notdir")
+            open(notdir, 'w').close()
+            memo.configure(cache_dir=os.path.join(notdir, "memo"),
+                           max_bytes=old_max)
+            del memo_calls[:]
+            self.assertEquals(memo_square(Int(5)).get(), 25)
+            self.assertEquals(memo_square(Int(5)).get(), 25)
+            self.assertEquals(memo_calls, [5, 5])
+        finally:
+            memo.configure(cache_dir=old_dir, max_bytes=old_max)
+            shutil.rmtree(cache_dir)
+
+    def testCheckpoint(self):
+        import tempfile
+        import shutil
+        import os.path
+        from PyDFlow.base import checkpoint
+        from PyDFlow import configure_checkpoint, configure_monitoring
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, "checkpoint")
+        def workflow():
+            return ckpt_maybe_crash(ckpt_inc(ckpt_inc(Int(1))))
+        try:
+            configure_checkpoint(path)
+            del ckpt_calls[:]
+            ckpt_crash[0] = True
+            self.assertExecutionException(ValueError, workflow().get)
+            self.assertEquals(ckpt_calls, [1, 2, 3])
+
+            # Resume from file: only the failed task should rerun, and 
+            # the tasks before the last finished one shouldn't be touched
+            configure_checkpoint(path)
+            del ckpt_calls[:]
+            ckpt_crash[0] = False
+            before = checkpoint.stats()
+            self.assertEquals(workflow().get(), 30)
+            self.assertEquals(ckpt_calls, [3])
+            self.assertEquals(checkpoint.stats()['restored'] - 
+                              before['restored'], 1)
+
+            # Different input to start of workflow
+            del ckpt_calls[:]
+            self.assertEquals(ckpt_maybe_crash(ckpt_inc(ckpt_inc(Int(2)))).get(), 
+                              40)
+            self.assertEquals(ckpt_calls, [2, 3, 4])
+
+            # Everything done
+            configure_checkpoint(path)
+            del ckpt_calls[:]
+            self.assertEquals(workflow().get(), 30)
+            self.assertEquals(ckpt_calls, [])
+
+            # A partly written entry at the end should be ignored
+            f = open(path, 'ab')
+            f.write("\x80\x02(U")
+            f.close()
+            configure_checkpoint(path)
+            self.assertEquals(workflow().get(), 30)
+            self.assertEquals(ckpt_calls, [])
+
+            # Restored tasks are finished as far as the trace is concerned
+            from PyDFlow.base import trace
+            configure_checkpoint(path)
+            configure_monitoring(trace=True)
+            try:
+                trace.clear()
+                result = workflow()
+                task = result._in_tasks[0]
+                self.assertEquals(result.get(), 30)
+                self.assertFalse(task in trace.in_flight)
+                self.assertEquals(len(trace.records()), 1)
+            finally:
+                configure_monitoring(trace=False)
+                trace.clear()
+
+            # Checkpointing is turned off if the file can't be written
+            checkpoint.checkpoint_file.close()
+            checkpoint.checkpoint_file = open(path, 'rb')
+            del ckpt_calls[:]
+            self.assertEquals(ckpt_inc(Int(5)).get(), 6)
+            self.assertFalse(checkpoint.ACTIVE)
+            self.assertEquals(ckpt_inc(Int(5)).get(), 6)
+            self.assertEquals(ckpt_calls, [5, 5])
+        finally:
+            configure_checkpoint(False)
+            shutil.rmtree(tmpdir)
+
+    def testTrace(self):
+        import tempfile
+        import shutil
+        import os.path
+        import json
+        from PyDFlow.base import trace
+        from PyDFlow import configure_monitoring
+        tmpdir = tempfile.mkdtemp()
+        try:
+            configure_monitoring(trace=True)
+            trace.clear()
+            chain = inc(inc(one()))
+            self.assertEquals(sum_all(chain, 
+                                      *[inc(Int(i)) for i in range(5)]).get(),
+                              18)
+            self.assertExecutionException(Exception, sum_all(chain, 
+                                                cause_exception()).get)
+            self.assertEquals(add(chain, chain).get(), 6)
+            recs = trace.records()
+            by_name = {}
+            for r in recs:
+                by_name.setdefault(r['name'], []).append(r)
+            self.assertEquals(len(by_name['inc']), 7)
+            self.assertEquals(len(by_name['one']), 1)
+            for r in by_name['inc'] + by_name['add']:
+                self.assertTrue(r['success'])
+                self.assertTrue(r['created'] <= r['ready'] <= r['queued'] 
+                                <= r['running'] <= r['done'])
+                self.assertTrue(LocalExecutor.isWorkerThread(
+                                    th.Thread(name=r['thread'])))
+                self.assertTrue(r['source'] in (trace.SOURCE_NEW, 
+                            trace.SOURCE_RESUME, trace.SOURCE_DEQUE,
+                            trace.SOURCE_STEAL, trace.SOURCE_CONTINUATION))
+            # Failed task and task depending on it
+            self.assertFalse(by_name['cause_exception'][0]['success'])
+            self.assertEquals([r['success'] for r in by_name['sum_all']],
+                              [True, False])
+
+            path = os.path.join(tmpdir, "trace.json")
+            trace.write_chrome_trace(path)
+            events = json.load(open(path))['traceEvents']
+            spans = [e for e in events if e['ph'] == 'X']
+            self.assertEquals(len([e for e in spans if e['name'] == 'inc']), 7)
+            self.assertTrue(all([e['dur'] >= 0 for e in spans]))
+
+            # Not recorded when turned off
+            configure_monitoring(trace=False)
+            trace.clear()
+            inc(Int(1)).get()
+            self.assertEquals(trace.records(), [])
+        finally:
+            configure_monitoring(trace=False)
+            trace.clear()
+            shutil.rmtree(tmpdir)
+
+    def testLogFlags(self):
+        """
+        Check scheduler debug logging follows the logging level after
+        configure() is called
+        """
+        from PyDFlow.base import logflags
+        from PyDFlow import configure
+        class Collect(logging.Handler):
+            def __init__(self):
+                logging.Handler.__init__(self)
+                self.messages = []
+            def emit(self, record):
+                self.messages.append(record.getMessage())
+        root = logging.getLogger()
+        old_level = root.level
+        handler = Collect()
+        root.addHandler(handler)
+        try:
+            root.setLevel(logging.DEBUG)
+            configure()
+            self.assertTrue(logflags.DEBUG)
+            self.assertEquals(inc(Int(1)).get(), 2)
+            self.assertTrue(len([m for m in handler.messages 
+                                 if "finished" in m]) > 0)
+            root.setLevel(logging.WARNING)
+            configure()
+            self.assertFalse(logflags.DEBUG or logflags.INFO)
+            # Let the worker finish logging about the last task
+            time.sleep(0.2)
+            del handler.messages[:]
+            self.assertEquals(inc(Int(1)).get(), 2)
+            self.assertEquals(handler.messages, [])
+        finally:
+            root.removeHandler(handler)
+            root.setLevel(old_level)
+            configure()
+
+    def testMetrics(self):
+        """
+        Check scheduler metrics can be read directly and over HTTP in
+        Prometheus format
+        """
+        from PyDFlow.base import metrics
+        from PyDFlow import configure_monitoring
+        import urllib2
+        self.assertEquals(rec_fib(12).get(), 144)
+        snap = metrics.snapshot()
+        self.assertEquals(snap['pydflow_in_queue_depth'], 0)
+        self.assertTrue(snap['pydflow_workers'] >= 1)
+        steal_attempts = snap['pydflow_steal_attempts_total']
+        # One series per worker plus one for retired workers
+        self.assertEquals(len(steal_attempts), snap['pydflow_workers'] + 1)
+        self.assertTrue('worker="retired"' in steal_attempts)
+        for worker, attempts in steal_attempts.items():
+            self.assertTrue(worker.startswith('worker="'))
+            self.assertTrue(attempts >=
+                            snap['pydflow_steals_total'][worker])
+        text = metrics.prometheus_text()
+        self.assertTrue("# TYPE pydflow_steals_total counter\n" in text)
+        self.assertTrue("\npydflow_idle_workers " in text)
+
+        # Check app metrics are served once app executor is imported
+        configure_monitoring(metrics_port=0)
+        try:
+            url = "http://127.0.0.1:%d/metrics" % metrics.server.server_port
+            served = urllib2.urlopen(url).read()
+        finally:
+            configure_monitoring(metrics_port=False)
+        self.assertTrue(metrics.server is None)
+        self.assertTrue("\npydflow_apps_running 0.0\n" in served)
+        for line in served.splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                float(value)
+
+    def run_random_dags(self, seeds):
+        """
+        Run random DAGs where tasks share inputs, checking the results
+        """
+        import random
+        for seed in seeds:
+            rand = random.Random(seed)
+            outs = []
+            expected = []
+            used = set()
+            for i in range(300):
+                window = range(max(0, i - 20), i)
+                inputs = rand.sample(window, min(len(window),
+                                                 rand.randint(0, 3)))
+                outs.append(sleep_sum(*([outs[j] for j in inputs] or
+                                        [Int(0)])))
+                expected.append(sum([expected[j] for j in inputs]) + 1)
+                used.update(inputs)
+            # Force the whole graph at once from a single task
+            exits = [i for i in range(len(outs)) if i not in used]
+            self.assertEquals(sum_all(*[outs[i] for i in exits]).get(),
+                              sum([expected[i] for i in exits]))
+            self.assertEquals([o.get() for o in outs], expected)
+
+    def testSharedInputs(self):
+        """
+        Check tasks waiting on a task started through another of its
+        output tasks still run
+        """
+        from PyDFlow import configure
+        try:
+            configure(workers=4)
+            self.run_random_dags(range(10))
+        finally:
+            configure(workers=1)
+
+    def testPriority(self):
+        from PyDFlow.base import priority
+        from PyDFlow.base.mutex import graph_mutex
+        from PyDFlow import configure, configure_scheduling
+        a = inc(Int(1))
+        b = inc(a)
+        c = inc(b)
+        d = inc(Int(1))
+        with graph_mutex:
+            self.assertEquals(priority.upstream(c), 3.0)
+            self.assertEquals(priority.upstream(d), 1.0)
+            self.assertEquals(priority.bottom_level(a._in_tasks[0]), 3.0)
+        self.assertEquals(c.get(), 4)
+        with graph_mutex:
+            self.assertEquals(priority.upstream(c), 0.0)
+
+        # Adding a task downstream changes bottom level
+        f = Int(1)
+        g = inc(f)
+        with graph_mutex:
+            self.assertEquals(priority.bottom_level(g._in_tasks[0]), 1.0)
+        h = inc(g)
+        with graph_mutex:
+            self.assertEquals(priority.bottom_level(g._in_tasks[0]), 2.0)
+            self.assertEquals(priority.upstream(h), 2.0)
+
+        priority.set_estimator(lambda task: 2.0)
+        try:
+            e = inc(inc(Int(1)))
+            with graph_mutex:
+                self.assertEquals(priority.upstream(e), 4.0)
+                self.assertEquals(priority.upstream(h), 4.0)
+
+            # Lengths invalidated part way through a search, as when
+            # tasks are added concurrently in striped lock mode
+            def invalidating(task):
+                priority.invalidate(priority.UP)
+                return 2.0
+            priority.set_estimator(invalidating)
+            k = inc(inc(inc(Int(1))))
+            with graph_mutex:
+                self.assertEquals(priority.upstream(k), 6.0)
+                self.assertEquals(priority.upstream(k), 6.0)
+            priority.set_estimator(lambda task: 2.0)
+            configure(workers=4)
+            configure_scheduling(priority=True)
+            self.run_random_dags(range(5, 8))
+        finally:
+            priority.set_estimator(None)
+            configure(workers=1)
+            configure_scheduling(priority=False)
+
+    def testHistory(self):
+        """
+        Check runtimes are recorded, kept across runs and used to predict
+        remaining time
+        """
+        import os
+        import tempfile
+        from PyDFlow.base import history, priority
+        from PyDFlow import configure_scheduling
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, "history")
+        try:
+            configure_scheduling(history=path)
+            self.assertTrue(priority.ESTIMATOR is history.predict)
+            for i in range(3):
+                self.assertEquals(slow_inc(Int(i)).get(), i + 1)
+            self.assertEquals(proc_add(Int(1), Int(2)).get(), 3)
+            s = history.lookup('slow_inc')
+            self.assertEquals(s.count, 3)
+            self.assertTrue(0.02 <= s.min <= s.mean <= s.max)
+            self.assertEquals(history.lookup('proc_add').count, 1)
+            self.assertEquals(history.lookup('never_ran'), None)
+
+            # Reload, ignoring a partly written entry
+            configure_scheduling(history=False)
+            self.assertFalse(priority.ESTIMATOR is history.predict)
+            f = open(path, 'ab')
+            f.write("\x80\x02(")
+            f.close()
+            configure_scheduling(history=path)
+            self.assertEquals(history.lookup('slow_inc').count, 3)
+            self.assertAlmostEquals(history.lookup('slow_inc').mean, s.mean)
+
+            chain = slow_inc(slow_inc(slow_inc(Int(0))))
+            other = slow_inc(Int(0))
+            predicted = history.predict(other._in_tasks[0])
+            self.assertAlmostEquals(predicted, s.mean)
+            rem = history.remaining([chain, other], parallelism=2)
+            self.assertEquals(rem['tasks'], 4)
+            self.assertEquals(rem['unknown'], 0)
+            self.assertAlmostEquals(rem['critical_path'], 3 * predicted)
+            self.assertAlmostEquals(rem['total'], 4 * predicted)
+            self.assertAlmostEquals(rem['estimate'], 3 * predicted)
+            self.assertEquals(chain.get(), 3)
+            self.assertEquals(history.remaining([chain])['tasks'], 0)
+
+            # Keep statistics by size of inputs
+            configure_scheduling(history=os.path.join(tmpdir, "by_size"),
+                                 history_by_size=True)
+            for n in (10, 12, 1000):
+                self.assertEquals(str_len("x" * n).get(), n)
+            self.assertEquals(history.lookup('str_len', 9).count, 2)
+            self.assertEquals(history.lookup('str_len', 1001).count, 1)
+            self.assertEquals(history.lookup('str_len').count, 3)
+        finally:
+            configure_scheduling(history=False, history_by_size=False)
+            import shutil
+            shutil.rmtree(tmpdir)
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
\ No newline at end of file
@@ -18,9 +18,11 @@
  
 import unittest
 from PyDFlow.PyFun import *
+from PyDFlow.types import Multiple
 import PyDFlow.examples.reduce as red
-from PyDFlow.base.patterns import dynreduce, treereduce, foldl, scanl
+from PyDFlow.base.patterns import dynreduce, treereduce, lazyreduce, foldl, scanl
 from itertools import imap
+import time
 from PyDFlow.tests.PyDFlowTest import PyDFlowTest
 
 Int = py_ivar.subtype()
@@ -70,6 +72,47 @@ class TestReduce(PyDFlowTest):
         self.assertEquals(exp, foldres)
         self.assertEquals(exp, treeres)
         
+    def testLazyReduce(self):
+        nums, boundnums = red.genlist()
+        tot = sum(nums)
+        @func((Int), (Multiple(Int)))
+        def addmany(*xs):
+            return sum(xs)
+        for fanin in (2, 3, 7):
+            for ordered in (True, False):
+                for max_running in (None, 1, 5):
+                    args = (Int(x) for x in nums)
+                    res = lazyreduce(addmany, args, fanin=fanin,
+                                     ordered=ordered, max_running=max_running)
+                    self.assertEqual(res.get(), tot)
+        self.assertEqual(lazyreduce(red.add, boundnums).get(), tot)
+        self.assertEqual(lazyreduce(addmany, [Int(3)], fanin=4).get(), 3)
+        self.assertRaises(ValueError, lazyreduce, addmany, [])
+        self.assertRaises(ValueError, lazyreduce, addmany, [Int(3)],
+                          max_running=0)
+        # Same ivar more than once
+        x = Int(5)
+        for ordered in (True, False):
+            self.assertEqual(lazyreduce(addmany, [x, x, Int(1), x],
+                                        ordered=ordered).get(), 16)
+
+    def testLazyReduceOrder(self):
+        """
+        Check that ordered lazyreduce works for non-commutative functions
+        """
+        import random
+        strs = [chr(ord('a') + i % 26) * random.randint(1, 3)
+                    for i in range(200)]
+        @func((String), (Multiple(String)))
+        def concat(*xs):
+            time.sleep(random.random() * 0.001)
+            return ''.join(xs)
+        for fanin in (2, 4):
+            for max_running in (None, 8):
+                res = lazyreduce(concat, imap(String, strs), fanin=fanin,
+                                 max_running=max_running)
+                self.assertEquals(res.get(), ''.join(strs))
+
     def testScanl(self):
         COUNT = 50
         @func((Int), (Int, Int))
@@ -98,6 +98,50 @@ class TestWriteOnce(PyDFlowTest):
         replyCh = WriteOnceVar()
         requestCh.set(replyCh)
         self.assertEquals(replyCh.get(), "hello!!")
+
+    def testManyWaiters(self):
+        """
+        Several threads blocked on the same var should all be woken
+        """
+        x = WriteOnceVar()
+        results = []
+        def t():
+            results.append(x.get())
+        threads = [th.Thread(target=t) for i in range(5)]
+        for t in threads:
+            t.start()
+        x.set(7)
+        for t in threads:
+            t.join()
+        self.assertEquals(results, [7] * 5)
+    
+    def testSetTwice(self):
+        from PyDFlow.writeonce.writeonce import VarSetTwiceException
+        x = WriteOnceVar()
+        x.set(1)
+        self.assertRaises(VarSetTwiceException, x.set, 2)
+        self.assertEquals(x.get(), 1)
+        
+    def testFunction(self):
+        calls = []
+        def f():
+            calls.append(1)
+            return "computed"
+        x = WriteOnceVar(function=f)
+        self.assertFalse(x.isSet())
+        self.assertEquals(x.get(), "computed")
+        self.assertEquals(x.get(), "computed")
+        self.assertEquals(len(calls), 1)
+        
+    def testMerge(self):
+        x = WriteOnceVar()
+        y = WriteOnceVar()
+        x.merge_other(y)
+        x.set("merged")
+        self.assertEquals(y.get(), "merged")
+        z = WriteOnceVar()
+        x.merge_other(z)
+        self.assertEquals(z.get(), "merged")
         
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
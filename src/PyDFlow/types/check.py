@@ -141,6 +141,9 @@ class TaskDescriptor(object):
     def validate_inputs(self, args, kwargs):
         return validate_inputs(self.input_spec, args, kwargs)
 
+    def validate_many(self, arg_lists):
+        return validate_many(self.input_spec, arg_lists)
+
     def validate_outputs(self, outputs):
         """
         Checks a list of outputs
@@ -241,8 +244,8 @@ def validate_inputs(input_spec, args, kwargs):
         if spec_len > 0 and input_spec[-1].isMulti():
             rep_type = input_spec[-1].fltype
             for arg in args[spec_len:]: 
-                check_logicaltype(rep_type, arg, input_spec[-1].name)
-                call_args.append(arg)
+                call_args.append(check_logicaltype(rep_type, arg, 
+                                                   input_spec[-1].name))
         else:
             raise FlTypeError("Too many positional arguments %d for input specification %d" % (arg_len, spec_len))
     elif arg_len < spec_len:
@@ -255,12 +258,49 @@ def validate_inputs(input_spec, args, kwargs):
                     raise FlTypeError("Could not find arg %s" % spec.name)
                 else:
                     match = spec.default_val
-            check_logicaltype(spec.fltype, match)                 
-            call_args.append(match) # build up the args list
+            # build up the args list
+            call_args.append(check_logicaltype(spec.fltype, match))
     if len(kwargs) > 0:
         raise FlTypeError("%d extra keyword args supplied: %s" % (len(kwargs), repr(kwargs)))
     return call_args
 
+def validate_many(input_spec, arg_lists):
+    """
+    Check a list of positional argument tuples against input_spec.
+    This is equivalent to calling validate_inputs on each, but works out
+    how the arguments line up with input_spec only once, so all the 
+    tuples must be the same length.
+    Returns a list of argument lists in the order of input_spec.
+    """
+    if len(arg_lists) == 0:
+        return []
+    arg_len = len(arg_lists[0])
+    spec_len = len(input_spec)
+    # Type to check each positional arg against
+    arg_types = [spec.fltype for spec in input_spec[:arg_len]]
+    defaults = []
+    if arg_len > spec_len:
+        if spec_len > 0 and input_spec[-1].isMulti():
+            arg_types.extend([input_spec[-1].fltype] * (arg_len - spec_len))
+        else:
+            raise FlTypeError("Too many positional arguments %d for input specification %d" % (arg_len, spec_len))
+    elif arg_len < spec_len:
+        for spec in input_spec[arg_len:]:
+            if spec.default_val is NoDefault:
+                raise FlTypeError("Could not find arg %s" % spec.name)
+            defaults.append(check_logicaltype(spec.fltype, spec.default_val))
+
+    res = []
+    for args in arg_lists:
+        if len(args) != arg_len:
+            raise FlTypeError("Expected %d arguments, but got %d" % (arg_len, 
+                                                                len(args)))
+        call_args = [check_logicaltype(t, arg) 
+                     for t, arg in zip(arg_types, args)]
+        call_args.extend(defaults)
+        res.append(call_args)
+    return res
+
 def validate_swap(new_ivars, old_ivars):
     """
     Validate that a list of old_ivars can be replaced with new_ivars without breaking types.
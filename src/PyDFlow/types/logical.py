@@ -29,6 +29,8 @@ class flvar(object):
     The base logical type in PyDFlow: a flow variable.
     Subclasses don't need to call init.
     """
+    __slots__ = ()
+
     @classmethod
     def subtype(cls):
         """
@@ -36,7 +38,7 @@ class flvar(object):
         the current type.
         """
         class subtyped(cls):
-            pass
+            __slots__ = ()
         subtyped.__name__ = cls.__name__ + ".subtype"
         return subtyped
 
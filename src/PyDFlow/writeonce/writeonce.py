@@ -18,62 +18,81 @@ Implements a basic write once variable.
 Provided that it is accessed by the set and get methods,
 this enforces write-once semantics.
 
+WriteOnceVars are created for every ivar, so they are kept small: there
+is no lock or condition per variable.  Once set, the value can be read 
+without locking.  The state of unset variables is protected by a single
+module-wide lock, and a thread which has to block allocates its own lock
+to wait on, which the setter releases.
+
 TODO: implement a faster C version
 @author: Tim Armstrong
 '''
 import threading
 
+# Protects the state of all unset WriteOnceVars.  Only held briefly.
+_state_lock = threading.Lock()
+
 class VarSetTwiceException(Exception):
     def __init__(self, value):
         self.parameter = value
     def __str__(self):
         return repr(self.parameter)
 
-class WriteOnceVar:
+class WriteOnceVar(object):
+    __slots__ = ('_data', '_isset', '_function', '_waiters', '_merged')
+
     def __init__(self, function=None):
         """
         Function is a 0-arg function that will be executed
         to get result if not filled
         """
-        self.__data = None
-        self.__isset = False
-        self.__function = function # will be set to None once run
-        self.__cond = threading.Condition()
-        self.__merged = []
+        self._data = None
+        self._isset = False
+        self._function = function # will be set to None once run
+        # Locks of blocked threads, and vars to propagate value to.
+        # Only allocated when needed.
+        self._waiters = None
+        self._merged = None
     
     def __repr__(self):
-        with self.__cond:
-            if self.__isset:
-                return "<WriteOnceVar: %s>" % repr(self.__data)
-            else:
-                return "<WriteOnceVar: unset, fn %s>" % repr(self.__function)    
-            self.__cond.release()
+        if self._isset:
+            return "<WriteOnceVar: %s>" % repr(self._data)
+        else:
+            return "<WriteOnceVar: unset, fn %s>" % repr(self._function)    
         
     def get(self):
         """
         Get the value of a var.  If it is
         not available, block until it is
         """
-        with self.__cond:
-            if self.__function is None:
-                # wait for it to be filled
-                while not self.__isset:
-                    self.__cond.wait()
-                res = self.__data
+        if self._isset:
+            # Fast path: value can't change once set
+            return self._data
+        _state_lock.acquire()
+        if self._isset:
+            _state_lock.release()
+            return self._data
+        fun = self._function
+        if fun is None:
+            # wait for it to be filled
+            waiter = threading.Lock()
+            waiter.acquire()
+            if self._waiters is None:
+                self._waiters = [waiter]
             else:
-                # run the function and
-                # fill ourselves
-                fun = self.__function
-                self.__function = None
-                # release lock to run function
-                self.__cond.release()
-                try:
-                    res = fun()
-                finally:
-                    self.__cond.acquire()
-                self.__data = res
-                self.__isset = True
-                self.__cond.notifyAll()
+                self._waiters.append(waiter)
+            _state_lock.release()
+            # Setter releases the waiter
+            waiter.acquire()
+            return self._data
+        else:
+            # run the function and
+            # fill ourselves
+            self._function = None
+            # release lock to run function
+            _state_lock.release()
+            res = fun()
+            self.set(res)
             return res
     
     def set(self,data):
@@ -81,30 +100,36 @@ class WriteOnceVar:
         Sets the value of this var.  This is only allowed
         to be done once
         """
-
-        with self.__cond:
-            if self.__isset:
+        with _state_lock:
+            if self._isset:
                 raise VarSetTwiceException("A thread attempted to set a filled"
                                 + "write once variable a second time")
-            self.__isset = True
-            self.__data = data
-            for f in self.__merged:
+            self._data = data
+            # Must be set after data for lock-free readers
+            self._isset = True
+            waiters = self._waiters
+            merged = self._merged
+            self._waiters = self._merged = None
+        if waiters is not None:
+            for waiter in waiters:
+                waiter.release()
+        if merged is not None:
+            for f in merged:
                 f.set(data)
-            self.__cond.notifyAll()
-            
             
     def merge_other(self, other):
         """
         Make the value of this var automatically propagate to another var.
         """
         assert(not other.isSet())
-        with self.__cond:
-            if self.__isset:
-                other.set(self.__data)
-            else:
-                self.__merged.append(other)
+        with _state_lock:
+            if not self._isset:
+                if self._merged is None:
+                    self._merged = [other]
+                else:
+                    self._merged.append(other)
+                return
+        other.set(self._data)
 
     def isSet(self):
-        with self.__cond:
-            res = self.__isset
-        return res
+        return self._isset
@@ -0,0 +1,69 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare the rate at which the app launchers can start and reap short
+processes, as the heap of the launching process grows.  Processes are
+started in batches, then all waited on.
+
+Usage: python app_launch.py [processes] [max heap MB]
+"""
+import sys
+import time
+import subprocess
+
+BATCH = 50
+
+def run_child(launcher, n, heap_mb):
+    from PyDFlow.app import launch
+    # Roughly heap_mb megabytes of small objects
+    ballast = [str(i) for i in xrange(heap_mb * 1024 * 1024 / 40)]
+    # Start helper before timing
+    if launcher == launch.LAUNCH_HELPER:
+        launch.spawn(launcher, ["true"], None, None, None).wait()
+    start_t = time.time()
+    done = 0
+    while done < n:
+        procs = [launch.spawn(launcher, ["true"], None, "/dev/null", None)
+                 for i in xrange(min(BATCH, n - done))]
+        for p in procs:
+            p.wait()
+        done += len(procs)
+    print "%.1f" % (n / (time.time() - start_t))
+
+def main():
+    n = 2000
+    max_heap = 512
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        max_heap = int(sys.argv[2])
+
+    print "%d processes, launched in batches of %d" % (n, BATCH)
+    print "%-8s %-8s %s" % ("heap MB", "launcher", "processes/s")
+    heap = 0
+    while heap <= max_heap:
+        for launcher in ("popen", "helper"):
+            # Fresh interpreter for each so heap size is controlled
+            out = subprocess.Popen([sys.executable, __file__, "--child",
+                                    launcher, str(n), str(heap)],
+                                   stdout=subprocess.PIPE).communicate()[0]
+            print "%-8d %-8s %s" % (heap, launcher, out.strip())
+        heap = heap * 4 if heap > 0 else 32
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        run_child(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main()
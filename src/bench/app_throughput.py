@@ -0,0 +1,65 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure throughput of many short-lived no-op app tasks, both independent
+and chained one after another, where every app's completion latency is
+on the critical path.
+
+Usage: python app_throughput.py [independent apps] [chained apps]
+"""
+import sys
+import time
+from PyDFlow.app import app, App, localfile, outfiles
+from PyDFlow import waitall
+import PyDFlow.app.LocalExecutor as AppExecutor
+
+@app((localfile), ())
+def noop():
+    return App("touch", outfiles[0])
+
+@app((localfile), (localfile))
+def after(prev):
+    return App("touch", outfiles[0])
+
+def report(desc, n, elapsed):
+    print "%-12s %6d apps in %7.3fs: %8.1f apps/s" % (desc, n, elapsed,
+                                                      n / elapsed)
+
+def main():
+    n = 10000
+    chain_len = 500
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        chain_len = int(sys.argv[2])
+
+    res = [noop() for i in xrange(n)]
+    start_t = time.time()
+    waitall(res)
+    report("independent", n, time.time() - start_t)
+    res = None
+
+    x = noop()
+    for i in xrange(chain_len - 1):
+        x = after(x)
+    start_t = time.time()
+    x.get()
+    report("chained", chain_len, time.time() - start_t)
+    stats = AppExecutor.stats()
+    print "callback queue: max depth %d, mean wait %.3f ms" % (
+            stats['max_callbacks_queued'], 1000 * stats['mean_callback_wait'])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure how fast threads can add func tasks to the graph while the
+worker threads are busy running other tasks, with the global graph lock
+and with striped per-ivar locks, for 1 up to N builder threads.
+
+Striped locking only covers graph construction: running tasks holds the
+global lock in both modes.  So this measures construction throughput as
+builder threads are added, and how much the running tasks slow it down,
+rather than how execution scales with the number of workers.
+
+Usage: python contention_test.py [max builders] [tasks per builder]
+"""
+import sys
+import subprocess
+import threading
+import time
+
+WORKERS = 4
+CHAIN_LEN = 50
+
+def run_child(mode_name, nbuilders, ntasks):
+    from PyDFlow.PyFun import py_ivar, func
+    from PyDFlow.base import mutex
+    from PyDFlow import configure
+
+    if mode_name == "striped":
+        configure(workers=WORKERS, lock_mode=mutex.LOCK_STRIPED)
+    else:
+        configure(workers=WORKERS, lock_mode=mutex.LOCK_GLOBAL)
+
+    @func((py_ivar), (py_ivar))
+    def inc(x):
+        return x + 1
+
+    # Keep the workers busy running chains of tasks
+    stop = [False]
+    executed = [0]
+    def background():
+        while not stop[0]:
+            x = py_ivar(0)
+            for i in xrange(CHAIN_LEN):
+                x = inc(x)
+            x.get()
+            executed[0] += CHAIN_LEN
+    bg = threading.Thread(target=background)
+    bg.start()
+    time.sleep(0.5)
+
+    def builder():
+        built = 0
+        while built < ntasks:
+            x = py_ivar(0)
+            for i in xrange(CHAIN_LEN):
+                x = inc(x)
+            built += CHAIN_LEN
+
+    threads = [threading.Thread(target=builder) for i in range(nbuilders)]
+    start_executed = executed[0]
+    start_t = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    secs = time.time() - start_t
+    ran = executed[0] - start_executed
+    stop[0] = True
+    bg.join()
+    print "%d %d" % (nbuilders * ntasks / secs, ran / secs)
+
+def main():
+    max_builders = 4
+    ntasks = 5000
+    if len(sys.argv) > 1:
+        max_builders = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        ntasks = int(sys.argv[2])
+
+    print "%d workers running tasks, %d tasks built per builder" % (
+                                                    WORKERS, ntasks)
+    print "%-9s %-8s %-10s %s" % ("builders", "mode", "built/s", "run/s")
+    for nbuilders in range(1, max_builders + 1):
+        for mode_name in ("global", "striped"):
+            # Fresh interpreter for each configuration, since the lock
+            # mode can't be changed once graph is built
+            out = subprocess.Popen([sys.executable, __file__, "--child",
+                                    mode_name, str(nbuilders), str(ntasks)],
+                                   stdout=subprocess.PIPE).communicate()[0]
+            built, ran = out.split()
+            print "%-9d %-8s %-10s %s" % (nbuilders, mode_name, built, ran)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        run_child(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main()
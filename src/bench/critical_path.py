@@ -0,0 +1,134 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare the makespan of randomly generated DAGs of @func tasks with and
+without priority scheduling.  Each task sleeps for a time depending on
+its kind, and takes inputs from a few random earlier tasks.  A final
+task gathers the outputs of all the tasks nothing else depends on.
+
+For each DAG, the lower bound on makespan, max(critical path, total
+work / workers), is shown alongside the makespan with priority
+scheduling off, on with every task counted as 1, and on with an
+estimator that knows the sleep time of each kind.
+
+Usage: python critical_path.py [tasks] [workers] [DAGs]
+"""
+import sys
+import time
+import random
+from PyDFlow.PyFun import py_ivar, func
+from PyDFlow.types import Multiple
+from PyDFlow import configure, configure_scheduling
+from PyDFlow.base import priority
+
+COSTS = {'short': 0.002, 'medium': 0.01, 'long': 0.05}
+
+@func((py_ivar), (Multiple(py_ivar)))
+def short(*inputs):
+    time.sleep(COSTS['short'])
+    return 0
+
+@func((py_ivar), (Multiple(py_ivar)))
+def medium(*inputs):
+    time.sleep(COSTS['medium'])
+    return 0
+
+@func((py_ivar), (Multiple(py_ivar)))
+def long(*inputs):
+    time.sleep(COSTS['long'])
+    return 0
+
+@func((py_ivar), (Multiple(py_ivar)))
+def gather(*inputs):
+    return len(inputs)
+
+KINDS = [(0.7, 'short', short), (0.2, 'medium', medium), (0.1, 'long', long)]
+# Tasks take inputs from the last WINDOW tasks
+WINDOW = 50
+
+def random_dag(n, rand):
+    """
+    Return a list of (kind, input indices) for n tasks
+    """
+    dag = []
+    for i in range(n):
+        r = rand.random()
+        for p, name, fn in KINDS:
+            if r < p:
+                break
+            r -= p
+        # Mostly depend on recent tasks, so there are some long chains
+        window = range(max(0, i - WINDOW), i)
+        inputs = rand.sample(window, min(len(window), rand.randint(0, 3)))
+        dag.append((name, inputs))
+    return dag
+
+def lower_bound(dag, workers):
+    finish = []
+    for name, inputs in dag:
+        finish.append(COSTS[name] + max([0.0] + [finish[i] for i in inputs]))
+    work = sum([COSTS[name] for name, inputs in dag])
+    return max(max(finish), work / workers)
+
+def run(dag):
+    fns = dict([(name, fn) for p, name, fn in KINDS])
+    outs = []
+    used = set()
+    # Multiple needs at least one input
+    start = py_ivar(0)
+    for name, inputs in dag:
+        outs.append(fns[name](*([outs[i] for i in inputs] or [start])))
+        used.update(inputs)
+    start_t = time.time()
+    gather(*[o for i, o in enumerate(outs) if i not in used]).get()
+    return time.time() - start_t
+
+def known_cost(task):
+    return COSTS.get(task._taskname)
+
+def main():
+    n = 300
+    workers = 8
+    ndags = 5
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        workers = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        ndags = int(sys.argv[3])
+    configure(workers=workers)
+    modes = [("fifo", False, None), ("unit", True, None),
+             ("estimated", True, known_cost)]
+    print "%d tasks, %d workers" % (n, workers)
+    print "%-6s %-10s %s" % ("seed", "bound (s)",
+                             " ".join(["%-10s" % m[0] for m in modes]))
+    totals = [0.0] * len(modes)
+    for seed in range(ndags):
+        dag = random_dag(n, random.Random(seed))
+        times = []
+        for i, (mode, active, estimator) in enumerate(modes):
+            configure_scheduling(priority=active)
+            priority.set_estimator(estimator)
+            times.append(run(dag))
+            totals[i] += times[-1]
+        print "%-6d %-10.3f %s" % (seed, lower_bound(dag, workers),
+                                   " ".join(["%-10.3f" % t for t in times]))
+    configure_scheduling(priority=False)
+    priority.set_estimator(None)
+    print "%-6s %-10s %s" % ("mean", "",
+                 " ".join(["%-10.3f" % (t / ndags) for t in totals]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the latency between a func task being sparked and it finishing,
+when the worker threads have gone idle in between.
+
+Usage: python dispatch_latency.py [workers] [trials]
+"""
+import sys
+import time
+from PyDFlow.PyFun import py_ivar, func
+from PyDFlow import configure
+
+# Time to let workers go idle between trials
+IDLE_TIME = 0.01
+
+@func((py_ivar), ())
+def noop():
+    return 1
+
+workers = 4
+trials = 500
+if len(sys.argv) > 1:
+    workers = int(sys.argv[1])
+if len(sys.argv) > 2:
+    trials = int(sys.argv[2])
+
+configure(workers=workers)
+# Warm up thread pool
+noop().get()
+
+latencies = []
+for i in xrange(trials):
+    time.sleep(IDLE_TIME)
+    x = noop()
+    start_t = time.time()
+    x.get()
+    latencies.append(time.time() - start_t)
+
+latencies.sort()
+print "%d workers, %d trials" % (workers, trials)
+print "mean dispatch latency: %.3f ms" % (1000 * sum(latencies) / len(latencies))
+print "median: %.3f ms, 90th percentile: %.3f ms, max: %.3f ms" % (
+            1000 * latencies[len(latencies) / 2],
+            1000 * latencies[int(len(latencies) * 0.9)], 1000 * latencies[-1])
@@ -0,0 +1,53 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the time for a single task with a large number of inputs to 
+become runnable and run, where each input is produced by a separate
+task.
+
+Usage: python fanin.py [inputs] [workers]
+"""
+import sys
+import time
+from PyDFlow.PyFun import py_ivar, func
+from PyDFlow import Multiple, configure
+
+@func((py_ivar), ())
+def one():
+    return 1
+
+@func((py_ivar), (Multiple(py_ivar)))
+def total(*xs):
+    return sum(xs)
+
+def main():
+    n = 100000
+    workers = 1
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        workers = int(sys.argv[2])
+    configure(workers=workers)
+
+    start_t = time.time()
+    res = total(*[one() for i in xrange(n)])
+    build_t = time.time() - start_t
+    start_t = time.time()
+    assert res.get() == n
+    run_t = time.time() - start_t
+    print "%d inputs: built in %.3fs, ran in %.3fs" % (n, build_t, run_t)
+
+if __name__ == "__main__":
+    main()
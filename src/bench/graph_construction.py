@@ -0,0 +1,60 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the time taken to add a large number of tasks to the graph,
+calling the decorated function once per task versus using .map().
+The tasks are not run.
+
+Usage: python graph_construction.py [tasks] [global|striped]
+"""
+import sys
+import time
+from PyDFlow.PyFun import py_ivar, func
+from PyDFlow.base import mutex
+from PyDFlow import configure
+
+@func((py_ivar), (py_ivar, py_ivar))
+def add(x, y):
+    return x + y
+
+def main():
+    n = 100000
+    mode_name = "global"
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        mode_name = sys.argv[2]
+    if mode_name == "striped":
+        configure(lock_mode=mutex.LOCK_STRIPED)
+
+    xs = [py_ivar(i) for i in xrange(n)]
+    ys = [py_ivar(i) for i in xrange(n)]
+
+    start_t = time.time()
+    res = [add(x, y) for x, y in zip(xs, ys)]
+    loop_t = time.time() - start_t
+    res = None
+
+    start_t = time.time()
+    res = add.map(xs, ys)
+    map_t = time.time() - start_t
+    res = None
+
+    print "%d tasks, %s locking" % (n, mode_name)
+    print "%-6s %7.3fs %9.0f tasks/s" % ("call", loop_t, n / loop_t)
+    print "%-6s %7.3fs %9.0f tasks/s" % ("map", map_t, n / map_t)
+
+if __name__ == "__main__":
+    main()
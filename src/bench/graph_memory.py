@@ -0,0 +1,74 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the memory used per ivar and per task in a large graph which
+has not been run yet, from the growth in the resident set size of this
+process.  Linux only.
+
+Usage: python graph_memory.py [nodes]
+"""
+import os
+import sys
+import gc
+from PyDFlow.PyFun import py_ivar, func
+from PyDFlow.app import app, App, localfile, outfiles
+
+@func((py_ivar), (py_ivar))
+def inc(x):
+    return x + 1
+
+@app((localfile), (localfile))
+def cp(src):
+    return App("cp", src, outfiles[0])
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def rss():
+    f = open('/proc/self/statm')
+    try:
+        return int(f.read().split()[1]) * PAGE_SIZE
+    finally:
+        f.close()
+
+def measure(desc, n, build):
+    gc.collect()
+    start = rss()
+    res = build()
+    gc.collect()
+    used = rss() - start
+    print "%-24s %8.1f bytes each" % (desc, float(used) / n)
+    return res
+
+def main():
+    n = 200000
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+
+    print "%d of each" % n
+    # Grow the heap first so it isn't counted against the first test
+    warmup = [py_ivar() for i in xrange(n)]
+    warmup = None
+    measure("py_ivar", n, lambda: [py_ivar() for i in xrange(n)])
+    ivars = measure("py_ivar (bound)", n, 
+                    lambda: [py_ivar(i) for i in xrange(n)])
+    # Each func task creates an output ivar too
+    measure("func task + output", n, lambda: inc.map(ivars))
+    ivars = None
+    files = measure("localfile (bound)", n,
+                    lambda: [localfile("/tmp/f%d" % i) for i in xrange(n)])
+    measure("app task + output", n, lambda: [cp(f) for f in files])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Run the mergesort example with different merge fan-ins and report the
+wall time and the bytes read and written by the merge apps for each.
+Input files are generated with the example's rand.py.  Sizes are
+measured from the files, so they don't depend on the page cache, but the
+times do: use inputs larger than memory to size the fan-in for a disk.
+
+Usage: python mergesort_fanin.py [files] [integers per file] [fan-in ...]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+from PyDFlow.app import app, App, outfiles
+from PyDFlow.types import Multiple
+import PyDFlow.examples.mergesort.mergesort as ms
+
+RAND_SCRIPT = os.path.join(ms.srcdir, "rand.py")
+
+@app((ms.intfile), (int))
+def rand(n):
+    return App(sys.executable, RAND_SCRIPT, n, stdout=outfiles[0])
+
+@app((ms.sorted_intfile), (Multiple(ms.sorted_intfile)))
+def quiet_merge(*files):
+    return App("merge", *(files + (outfiles[0],)), stderr="/dev/null")
+
+def run(inputs, fanin):
+    """
+    Sort inputs with given fan-in.  Returns the time taken and the
+    list of (input files, output file) for each merge.
+    """
+    merges = []
+    def recording_merge(*files):
+        out = quiet_merge(*files)
+        merges.append((files, out))
+        return out
+    start_t = time.time()
+    res = ms.merge_sort(inputs, fanin, merge_fn=recording_merge)
+    res.get()
+    return time.time() - start_t, merges
+
+def main():
+    nfiles = 64
+    per_file = 100000
+    fanins = [2, 4, 8, 16, 64]
+    if len(sys.argv) > 1:
+        nfiles = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        per_file = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        fanins = [int(k) for k in sys.argv[3:]]
+
+    ms.do_compile()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        inputs = [ms.intfile(os.path.join(tmpdir, "in%d.txt" % i))
+                  for i in range(nfiles)]
+        for f in inputs:
+            f <<= rand(per_file)
+        for f in inputs:
+            f.get()
+        input_bytes = sum([os.path.getsize(f.get()) for f in inputs])
+        print "%d files, %d bytes of integers" % (nfiles, input_bytes)
+        print "%-6s %-8s %-10s %-12s %-12s %s" % ("fan-in", "merges",
+                "time (s)", "bytes read", "bytes written", "passes")
+        for fanin in fanins:
+            elapsed, merges = run(inputs, fanin)
+            read = sum([os.path.getsize(f.get())
+                        for files, out in merges for f in files])
+            written = sum([os.path.getsize(out.get())
+                           for files, out in merges])
+            print "%-6d %-8d %-10.2f %-12d %-12d %.2f" % (fanin, len(merges),
+                    elapsed, read, written, float(written) / input_bytes)
+            # Temporary files are removed when merges is freed
+            del merges
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare CPU-bound func tasks run on the thread executor and on the
+process executor, then time repeated tasks sharing a large input, which
+should only be shipped to each worker process once.
+
+Usage: python process_executor.py [workers] [tasks]
+"""
+import sys
+import time
+from PyDFlow.PyFun import py_ivar, func
+from PyDFlow import configure, configure_funcs, waitall
+import PyDFlow.PyFun.ProcessExecutor as ProcessExecutor
+
+ITERATIONS = 3000000
+BIG_INPUT_LEN = 1000000
+
+def burn_loop(n):
+    s = 0
+    for i in xrange(n):
+        s += i
+    return s
+
+@func((py_ivar), (None))
+def thread_burn(n):
+    return burn_loop(n)
+
+@func((py_ivar), (None), executor='process')
+def process_burn(n):
+    return burn_loop(n)
+
+@func((py_ivar), (py_ivar), executor='process')
+def process_len(x):
+    return len(x)
+
+def main():
+    workers = 4
+    tasks = 8
+    if len(sys.argv) > 1:
+        workers = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        tasks = int(sys.argv[2])
+    configure(workers=workers)
+    configure_funcs(processes=workers)
+
+    for f in (thread_burn, process_burn):
+        start_t = time.time()
+        waitall([f(ITERATIONS) for i in xrange(tasks)])
+        print "%-14s %.3fs" % (f.func.__name__, time.time() - start_t)
+
+    big = py_ivar(range(BIG_INPUT_LEN))
+    start_t = time.time()
+    waitall([process_len(big) for i in xrange(tasks * 5)])
+    print "%-14s %.3fs" % ("shared input", time.time() - start_t)
+    print "bytes cached per worker: %s" % (
+                [w.cached_bytes for w in ProcessExecutor.workers])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Copyright 2010-2011 Tim Armstrong <tga@uchicago.edu>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the scheduling overhead per task of building and running a
+graph of trivial @func tasks: a tree reduction of n/2 inputs, each
+produced by a task, which is about n tasks in total.
+
+With --unguarded, the flags guarding the scheduler's debug and info
+logging are forced on while the log level stays at WARNING, so log
+messages are formatted and then discarded, as they were before the
+flags were added.
+
+Usage: python task_overhead.py [--unguarded] [tasks] [workers]
+"""
+import sys
+import time
+from PyDFlow.PyFun import py_ivar, func
+from PyDFlow import configure, treereduce
+from PyDFlow.base import LocalExecutor, logflags
+
+@func((py_ivar), (None))
+def leaf(x):
+    return x
+
+@func((py_ivar), (py_ivar, py_ivar))
+def add(x, y):
+    return x + y
+
+def main():
+    n = 100000
+    workers = 1
+    args = sys.argv[1:]
+    unguarded = len(args) > 0 and args[0] == "--unguarded"
+    if unguarded:
+        args = args[1:]
+    if len(args) > 0:
+        n = int(args[0])
+    if len(args) > 1:
+        workers = int(args[1])
+    configure(workers=workers)
+    # Start the pool first, as it resets the flags
+    LocalExecutor.initFuture.get()
+    if unguarded:
+        logflags.DEBUG = logflags.INFO = True
+
+    leaves = n / 2
+    start_t = time.time()
+    res = treereduce(add, [leaf(i) for i in xrange(leaves)])
+    build_t = time.time() - start_t
+    start_t = time.time()
+    assert res.get() == leaves * (leaves - 1) / 2
+    run_t = time.time() - start_t
+    ntasks = 2 * leaves - 1
+    print "%d tasks, %d workers%s" % (ntasks, workers, 
+                                      unguarded and ", unguarded logging" or "")
+    print "built in %.3fs (%.1fus/task), ran in %.3fs (%.1fus/task)" % (
+            build_t, build_t * 1e6 / ntasks, run_t, run_t * 1e6 / ntasks)
+
+if __name__ == "__main__":
+    main()